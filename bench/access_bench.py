@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Compares the cost of permission-aware listings (see pins4days.access)
+with today's unfiltered ones: the first page and the fifth page (fetched
+with its cursor, see pins4days.paging) of Pin.query_all(), unfiltered and
+restricted to BENCH_ACCESS_VISIBLE of the BENCH_ACCESS_CHANNELS channels,
+plus the cached lookup of a user's channels.
+"""
+
+import functools
+import os
+import unittest
+
+from google.appengine.ext import ndb
+
+from benchmark_case import BenchmarkTestCase
+from benchmark_case import Timer
+from fixtures import synthesize_events
+from pins4days import access
+from pins4days import paging
+from pins4days.event import PinnedMessage
+from pins4days.models.access import ChannelMembership
+from pins4days.models.pin import Pin
+from pins4days.tenants import get_tenant
+
+
+EVENTS = int(os.environ.get('BENCH_ACCESS_EVENTS', 5000))
+CHANNELS = int(os.environ.get('BENCH_ACCESS_CHANNELS', 50))
+VISIBLE = int(os.environ.get('BENCH_ACCESS_VISIBLE', 10))
+BATCH_SIZE = 500
+PAGE_SIZE = 10
+REPEAT = 20
+
+
+def best_ms(func):
+    """Runs func repeatedly with an empty ndb in-context cache, and returns the
+    fastest run in milliseconds.
+    """
+    times = []
+    for _ in range(REPEAT):
+        ndb.get_context().clear_cache()
+        with Timer() as timer:
+            func()
+        times.append(timer.elapsed * 1000)
+    return min(times)
+
+
+class AccessBenchmark(BenchmarkTestCase):
+
+    def setUp(self):
+        super(AccessBenchmark, self).setUp()
+        pins = [
+            PinnedMessage.factory(e)
+            for e in synthesize_events(EVENTS, channels=CHANNELS)
+        ]
+        for i in range(0, EVENTS, BATCH_SIZE):
+            ndb.put_multi(pins[i:i + BATCH_SIZE])
+        self.channel_ids = sorted(set(p.channel_id for p in pins))[:VISIBLE]
+        ChannelMembership(id='U1', channel_ids=self.channel_ids).put()
+        self.tenant = get_tenant({'channel_access': True}, None)
+
+    def run_listing(self, scenario, channel_ids):
+        tiers = [functools.partial(Pin.query_all, channel_ids)]
+
+        def fetch_page(cursor=None):
+            return paging.fetch_page_async(
+                tiers, PAGE_SIZE, cursor).get_result()
+
+        cursor = None
+        for _ in range(4):
+            _, cursor = fetch_page(cursor)
+        self.report(
+            scenario,
+            events=EVENTS,
+            channels=CHANNELS,
+            visible=len(channel_ids) if channel_ids is not None else CHANNELS,
+            page_ms=best_ms(fetch_page),
+            page_5_ms=best_ms(lambda: fetch_page(cursor)))
+
+    def test_unfiltered(self):
+        self.run_listing('access.unfiltered', None)
+
+    def test_filtered(self):
+        channel_ids = access.visible_channels(self.tenant, 'U1')
+        self.assertEquals(frozenset(self.channel_ids), channel_ids)
+        self.run_listing('access.filtered', channel_ids)
+        self.report(
+            'access.lookup',
+            visible=len(channel_ids),
+            lookup_ms=best_ms(
+                lambda: access.visible_channels(self.tenant, 'U1')))
+
+
+if __name__ == '__main__':
+    unittest.main()
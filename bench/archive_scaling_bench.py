@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Measures how the Pin queries, offset paging, entity decoding, to_dict()
+serialisation and the /pins template render scale with archive size.
+
+Archive sizes are set with BENCH_ARCHIVE_SIZES (comma separated, default
+1000,10000). Larger archives (100000, 1000000) work but take a long time to
+load into the datastore stub. The archive grows from one size to the next, so
+each size only loads the difference.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+from flask import render_template
+from google.appengine.ext import ndb
+
+from benchmark_case import BenchmarkTestCase
+from generator import ArchiveGenerator
+from pins4days.models.pin import Pin
+
+
+SIZES = [int(s) for s in
+         os.environ.get('BENCH_ARCHIVE_SIZES', '1000,10000').split(',')]
+REPEAT = int(os.environ.get('BENCH_ARCHIVE_REPEAT', 20))
+PAGE_SIZE = 10
+DECODE_BATCH = 100
+
+os.environ.setdefault('LOCAL_APP_CONFIG_PATH', 'test/data/app_config.yaml')
+os.environ.setdefault('REMOTE_APP_CONFIG_PATH', 'configs/pins4days.yaml')
+
+
+def best_ms(func, repeat=REPEAT):
+    """Runs func repeatedly with an empty ndb in-context cache, and returns the
+    fastest run in milliseconds.
+    """
+    times = []
+    for _ in range(repeat):
+        ndb.get_context().clear_cache()
+        start = time.time()
+        func()
+        times.append((time.time() - start) * 1000)
+    return min(times)
+
+
+def chart(rows, metric, width=40):
+    """Draws a horizontal bar chart of one metric against archive size.
+
+    Args:
+        rows (list): One dict of measurements per archive size.
+        metric (str): The measurement to chart.
+        width (int): Width of the longest bar.
+
+    Returns:
+        str
+    """
+    top = max(r[metric] for r in rows) or 1
+    lines = ['{} (ms)'.format(metric)]
+    for r in rows:
+        bar = '#' * max(1, int(r[metric] / top * width))
+        lines.append('{:>9} | {} {:.2f}'.format(r['size'], bar, r[metric]))
+    return '\n'.join(lines)
+
+
+class ArchiveScalingBenchmark(BenchmarkTestCase):
+
+    def setUp(self):
+        super(ArchiveScalingBenchmark, self).setUp()
+        import main
+        self.main = main
+
+    def measure(self, size):
+        deep_offset = max(size // 2, 0)
+        pins = Pin.query_all().fetch(DECODE_BATCH)
+
+        def render():
+            with self.main.app.test_request_context('/pins'):
+                render_template(
+                    'pins.html', username='bench', next_url='/pins?page=2',
+                    pins=pins[:PAGE_SIZE])
+
+        keys_ms = best_ms(
+            lambda: Pin.query_all().fetch(DECODE_BATCH, keys_only=True))
+        entities_ms = best_ms(lambda: Pin.query_all().fetch(DECODE_BATCH))
+        return {
+            'size': size,
+            'query_all': best_ms(lambda: Pin.query_all().fetch(PAGE_SIZE)),
+            'query_user': best_ms(
+                lambda: Pin.query_user('author-0').fetch(PAGE_SIZE)),
+            'page_1': best_ms(
+                lambda: Pin.query_all().fetch(PAGE_SIZE, offset=PAGE_SIZE)),
+            'page_deep': best_ms(
+                lambda: Pin.query_all().fetch(PAGE_SIZE, offset=deep_offset)),
+            'decode_per_100': max(entities_ms - keys_ms, 0.0),
+            'to_dict_per_100': best_ms(lambda: [p.to_dict() for p in pins]),
+            'render_page': best_ms(render),
+        }
+
+    def test_scaling(self):
+        generator = ArchiveGenerator()
+        rows = []
+        for size in sorted(SIZES):
+            generator.bulk_load(size - generator.generated)
+            row = self.measure(size)
+            rows.append(row)
+            self.report('archive.{}'.format(size), **row)
+
+        for metric in sorted(rows[0]):
+            if metric != 'size':
+                sys.stderr.write('\n' + chart(rows, metric) + '\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Base class for benchmarks. Benchmarks are unittest test cases that run
+against the App Engine testbed stubs, so they are discovered and run by
+runner.py like the tests:
+
+    $ python runner.py ~/google-cloud-sdk --test-path=bench --test-pattern=*_bench.py
+
+The stubs don't model production RPC latency, so absolute numbers are only
+comparable with other runs on the same machine. They are good at showing how
+much work (RPCs, CPU) each code path does.
+
+Results can be checked against bench/baseline.json with check_baseline(). Run
+with BENCH_UPDATE_BASELINE=1 to record the current results as the baseline
+instead. The committed baseline only tracks RPCs per request, which don't
+depend on the machine. Set BENCH_BASELINE_TIMINGS=1 as well to also record
+throughput and p99 latency for your own machine, and BENCH_TOLERANCE to
+change how much slower than the baseline a scenario may get (default 0.2,
+i.e. 20%).
+"""
+
+import json
+import os
+import sys
+import time
+import unittest
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+
+ROOT_PATH = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+BASELINE_PATH = os.path.join(ROOT_PATH, 'bench', 'baseline.json')
+TOLERANCE = float(os.environ.get('BENCH_TOLERANCE', 0.2))
+UPDATE_BASELINE = bool(os.environ.get('BENCH_UPDATE_BASELINE'))
+BASELINE_TIMINGS = bool(os.environ.get('BENCH_BASELINE_TIMINGS'))
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        # Benchmarks read back what they just wrote, so make every write
+        # visible to queries straight away.
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT_PATH)
+        self.taskqueue_stub = self.testbed.get_stub('taskqueue')
+        # Needed to load the app config from the Cloud Storage stub.
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_urlfetch_stub()
+        self.testbed.init_blobstore_stub()
+        ndb.get_context().clear_cache()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def report(self, scenario, **values):
+        """Writes a single benchmark result line to stderr.
+
+        Args:
+            scenario (str): Name of the measured scenario.
+            **values: Measured values.
+        """
+        fields = ' '.join(
+            '{}={}'.format(k, round(v, 2) if isinstance(v, float) else v)
+            for k, v in sorted(values.items()))
+        sys.stderr.write('\nBENCH {} {}\n'.format(scenario, fields))
+
+    def check_baseline(self, scenario, result):
+        """Fails if the scenario regressed against bench/baseline.json, or
+        records the result as the new baseline when BENCH_UPDATE_BASELINE is
+        set.
+
+        Tracked values:
+            rpcs: per-service RPCs per request; may not grow at all. Only
+            compared if the same number of events was replayed.
+            events_per_sec: if recorded, may drop by at most TOLERANCE.
+            p99_ms: if recorded, may grow by at most TOLERANCE.
+
+        Args:
+            scenario (str): Name of the measured scenario.
+            result (dict): The measured values.
+        """
+        baselines = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH) as f:
+                baselines = json.load(f)
+
+        if UPDATE_BASELINE:
+            tracked = ['events', 'rpcs']
+            if BASELINE_TIMINGS:
+                tracked += ['events_per_sec', 'p99_ms']
+            baselines[scenario] = dict((k, result[k]) for k in tracked)
+            with open(BASELINE_PATH, 'w') as f:
+                json.dump(
+                    baselines, f, indent=2, sort_keys=True,
+                    separators=(',', ': '))
+                f.write('\n')
+            return
+
+        baseline = baselines.get(scenario)
+        self.assertIsNotNone(
+            baseline,
+            '{} has no baseline, record one with BENCH_UPDATE_BASELINE=1.'.format(
+                scenario))
+        if 'events_per_sec' in baseline:
+            self.assertGreaterEqual(
+                result['events_per_sec'],
+                baseline['events_per_sec'] * (1 - TOLERANCE),
+                '{} throughput regressed.'.format(scenario))
+        if 'p99_ms' in baseline:
+            self.assertLessEqual(
+                result['p99_ms'],
+                baseline['p99_ms'] * (1 + TOLERANCE),
+                '{} p99 latency regressed.'.format(scenario))
+        if result['events'] != baseline['events']:
+            return
+        for service, count in result['rpcs'].items():
+            self.assertIn(
+                service, baseline['rpcs'],
+                '{} makes {} RPCs, which its baseline has none of. Record '
+                'them with BENCH_UPDATE_BASELINE=1 in the change that adds '
+                'them.'.format(scenario, service))
+            self.assertLessEqual(
+                count,
+                baseline['rpcs'].get(service, 0),
+                '{} makes more {} RPCs per request.'.format(scenario, service))
+
+
+class Timer(object):
+
+    """Context manager that measures wall time.
+
+    Attributes:
+        elapsed (float): Seconds spent inside the with block.
+    """
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.time() - self.start
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Synthesizes Slack pin events from the fixtures in test/data."""
+
+import copy
+import json
+import os
+
+
+FIXTURES_PATH = os.path.realpath(
+    os.path.join(os.path.dirname(__file__), '..', 'test', 'data'))
+
+PIN_ADDED_FIXTURES = [
+    'pin_added_image.json',
+    'pin_added_link.json',
+    'pin_added_message.json',
+    'pin_added_multi.json',
+]
+
+
+def load_fixtures():
+    """Loads the pin_added_* fixtures.
+
+    Returns:
+        list: dicts as sent by the Slack events API.
+    """
+    fixtures = []
+    for name in PIN_ADDED_FIXTURES:
+        with open(os.path.join(FIXTURES_PATH, name)) as f:
+            fixtures.append(json.load(f))
+    return fixtures
+
+
+def synthesize_events(count, channels=10, token=None):
+    """Builds pin_added events by cycling through the fixtures and giving
+    each event its own message ts, channel and creation time, so that every
+    event becomes a distinct Pin.
+
+    Args:
+        count (int): Number of events to build.
+        channels (int): Number of distinct channels to spread the events over.
+        token (str): Optional. Slack verification token to set on the events.
+
+    Returns:
+        list: dicts as sent by the Slack events API.
+    """
+    fixtures = load_fixtures()
+    events = []
+    for i in range(count):
+        event = copy.deepcopy(fixtures[i % len(fixtures)])
+        channel = 'channel-{}'.format(i % channels)
+        item = event['event']['item']
+        item['message']['ts'] = '1525800000.{:06d}'.format(i)
+        item['created'] = 1525800000 + i
+        event['event']['pinned_info']['channel'] = channel
+        if token is not None:
+            event['token'] = token
+        events.append(event)
+    return events
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Generates realistic Pin entities for large-archive benchmarks.
+
+The number of attachments per pin, the length of pin and attachment text and
+the attachment URLs are all sampled from the pin_added fixtures in test/data,
+so a generated archive has the same shape as the pins the app really stores.
+"""
+
+import random
+
+from google.appengine.ext import ndb
+
+from fixtures import load_fixtures
+from pins4days.event import PinnedMessage
+from pins4days.models.pin import Attachment
+from pins4days.models.pin import Pin
+
+
+class ArchiveGenerator(object):
+
+    """Builds and bulk-loads Pins.
+
+    Attributes:
+        attachment_counts (list): Attachments per pin seen in the fixtures.
+        attachments (list): Attachment models seen in the fixtures.
+        authors (int): Number of distinct authors.
+        channels (int): Number of distinct channels.
+        generated (int): Number of Pins generated so far. Used to give every
+        Pin a unique ts.
+        random (Random): Seeded random number generator.
+        text_lengths (list): Pin text lengths seen in the fixtures.
+        texts (list): Pin texts seen in the fixtures.
+    """
+
+    START_TS = 1420070400
+
+    def __init__(self, channels=50, authors=200, seed=0):
+        """
+        Args:
+            channels (int): Number of distinct channels.
+            authors (int): Number of distinct authors.
+            seed (int): Random seed, so that runs are repeatable.
+        """
+        self.channels = channels
+        self.authors = authors
+        self.random = random.Random(seed)
+        self.generated = 0
+
+        pins = [PinnedMessage.factory(e) for e in load_fixtures()]
+        self.attachment_counts = [len(p.attachments) for p in pins]
+        self.attachments = [a for p in pins for a in p.attachments]
+        self.texts = [p.text for p in pins]
+        self.text_lengths = [len(t) for t in self.texts]
+
+    def _text(self, samples, length):
+        text = self.random.choice(samples) or u'lorem ipsum'
+        return (text * (length // len(text) + 1))[:length]
+
+    def _length(self, lengths):
+        # Jitter the observed lengths so that they aren't all identical.
+        return max(1, int(self.random.choice(lengths) *
+                          self.random.uniform(0.5, 1.5)))
+
+    def attachment(self):
+        """Builds a single Attachment.
+
+        Returns:
+            Attachment
+        """
+        template = self.random.choice(self.attachments)
+        text = None
+        if template.text:
+            text = self._text(
+                [template.text], self._length([len(template.text)]))
+        suffix = '?v={}'.format(self.random.randint(0, 10 ** 6))
+        return Attachment(
+            from_url=template.from_url + suffix if template.from_url else None,
+            image_url=template.image_url,
+            original_url=(
+                template.original_url + suffix if template.original_url else None),
+            text=text)
+
+    def pin(self):
+        """Builds a single Pin. Pins are created one second apart, in
+        increasing order.
+
+        Returns:
+            Pin
+        """
+        i = self.generated
+        self.generated += 1
+        created = self.START_TS + i
+        attachments = [
+            self.attachment()
+            for _ in range(self.random.choice(self.attachment_counts))
+        ]
+        return Pin.create(
+            text=self._text(self.texts, self._length(self.text_lengths)),
+            author_id='author-{}'.format(self.random.randrange(self.authors)),
+            pinner_id='author-{}'.format(self.random.randrange(self.authors)),
+            channel_id='channel-{}'.format(self.random.randrange(self.channels)),
+            pinned_ts=created,
+            created_ts=created,
+            attachments=attachments,
+            ts='{}.{:06d}'.format(created, i % 10 ** 6))
+
+    def bulk_load(self, count, batch_size=500):
+        """Generates and stores Pins. Each batch is built while the previous
+        one is being written.
+
+        Args:
+            count (int): Number of Pins to store.
+            batch_size (int): Number of Pins per put_multi.
+        """
+        pending = []
+        for start in range(0, count, batch_size):
+            batch = [self.pin() for _ in range(min(batch_size, count - start))]
+            futures = ndb.put_multi_async(
+                batch, use_cache=False, use_memcache=False)
+            ndb.Future.wait_all(pending)
+            pending = futures
+        ndb.Future.wait_all(pending)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Compares the push and pull ingest modes. See pins4days.ingest."""
+
+import os
+import unittest
+
+from benchmark_case import BenchmarkTestCase
+from benchmark_case import Timer
+from fixtures import synthesize_events
+from pins4days.constants import INGEST_MODE_PULL
+from pins4days.constants import INGEST_MODE_PUSH
+from pins4days.ingest import drain
+from pins4days.ingest import enqueue_pins_async
+from pins4days.models.pin import Pin
+
+
+EVENTS = int(os.environ.get('BENCH_INGEST_EVENTS', 2000))
+
+
+class IngestBenchmark(BenchmarkTestCase):
+
+    def setUp(self):
+        super(IngestBenchmark, self).setUp()
+        self.events = synthesize_events(EVENTS)
+
+    def enqueue(self, mode):
+        for future in enqueue_pins_async(self.events, mode):
+            future.get_result()
+
+    def test_push(self):
+        import worker
+        client = worker.app.test_client()
+        with Timer() as timer:
+            self.enqueue(INGEST_MODE_PUSH)
+            for task in self.taskqueue_stub.get_filtered_tasks(
+                    url='/worker/create_pin'):
+                client.post('/worker/create_pin', data=task.payload)
+        self.assertEquals(EVENTS, Pin.query().count())
+        self.report(
+            'ingest.push',
+            events=EVENTS,
+            seconds=timer.elapsed,
+            pins_per_sec=EVENTS / timer.elapsed)
+
+    def test_pull(self):
+        with Timer() as timer:
+            self.enqueue(INGEST_MODE_PULL)
+            drain(time_budget=3600)
+        self.assertEquals(EVENTS, Pin.query().count())
+        self.report(
+            'ingest.pull',
+            events=EVENTS,
+            seconds=timer.elapsed,
+            pins_per_sec=EVENTS / timer.elapsed)
+
+
+if __name__ == '__main__':
+    unittest.main()
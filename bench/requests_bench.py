@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Replays synthesized pin events against the request handlers through the
+Flask test client, and checks each scenario against bench/baseline.json.
+
+Every scenario reports events (requests) per second, p50/p99 latency and the
+RPCs per request recorded by pins4days.metrics.
+"""
+
+import json
+import os
+import re
+import time
+import unittest
+
+from google.appengine.ext import ndb
+
+from benchmark_case import BenchmarkTestCase
+from fixtures import synthesize_events
+from pins4days import metrics
+from pins4days.event import PinnedMessage
+from pins4days.models.user import User
+
+
+EVENTS = int(os.environ.get('BENCH_REQUEST_EVENTS', 500))
+READS = int(os.environ.get('BENCH_REQUEST_READS', 200))
+
+os.environ.setdefault('LOCAL_APP_CONFIG_PATH', 'test/data/app_config.yaml')
+os.environ.setdefault('REMOTE_APP_CONFIG_PATH', 'configs/pins4days.yaml')
+
+
+class RequestsBenchmark(BenchmarkTestCase):
+
+    def setUp(self):
+        super(RequestsBenchmark, self).setUp()
+        import main
+        import worker
+        self.main = main
+        self.worker = worker
+        self.events = synthesize_events(
+            EVENTS, token=main.app.config['slack_verification_token'])
+        metrics.reset()
+
+    def load_pins(self):
+        ndb.put_multi([PinnedMessage.factory(e) for e in self.events])
+
+    def run_scenario(self, scenario, route, requests):
+        """Times each request and builds the scenario's result.
+
+        Args:
+            scenario (str): Name of the scenario.
+            route (str): URL rule the requests hit, to look up their metrics.
+            requests (list): Callables that each make a request and return the
+            response.
+
+        Returns:
+            dict: The scenario's result.
+        """
+        # Let ndb finish the cache updates of the setup's writes, so that
+        # they aren't counted against the scenario's first requests.
+        ndb.get_context().flush().get_result()
+        ndb.eventloop.run()
+
+        latencies = []
+        for make_request in requests:
+            start = time.time()
+            response = make_request()
+            latencies.append((time.time() - start) * 1000)
+            self.assertLess(response.status_code, 400)
+
+        latencies.sort()
+        summary = metrics.summary()[route]
+        result = {
+            'events': len(latencies),
+            'events_per_sec': len(latencies) / (sum(latencies) / 1000),
+            'p50_ms': metrics.percentile(latencies, 50),
+            'p99_ms': metrics.percentile(latencies, 99),
+            'rpcs': dict(
+                (service, stats['count_per_request'])
+                for service, stats in summary['rpcs'].items()),
+        }
+        self.report(scenario, **dict(
+            [(k, v) for k, v in result.items() if k != 'rpcs'] +
+            [('rpcs.' + k, v) for k, v in result['rpcs'].items()]))
+        self.check_baseline(scenario, result)
+        return result
+
+    def test_api_pins_post(self):
+        client = self.main.app.test_client()
+        self.run_scenario('api_pins_post', '/api/pins', [
+            lambda event=event: client.post(
+                '/api/pins',
+                data=json.dumps(event),
+                content_type='application/json')
+            for event in self.events
+        ])
+
+    def test_worker_create_pin(self):
+        client = self.worker.app.test_client()
+        self.run_scenario('worker_create_pin', '/worker/create_pin', [
+            lambda event=event: client.post(
+                '/worker/create_pin', data=json.dumps(event))
+            for event in self.events
+        ])
+
+    def login(self, client):
+        User.create_with_encryption(id='bench', password='bench')
+        client.post('/login', data={'username': 'bench', 'password': 'bench'})
+
+    def test_api_pins_get(self):
+        self.load_pins()
+        client = self.main.app.test_client()
+        self.login(client)
+        self.run_scenario('api_pins_get', '/api/pins', [
+            lambda: client.get('/api/pins')
+        ] * READS)
+
+    def test_pins_page(self):
+        self.load_pins()
+        client = self.main.app.test_client()
+        self.login(client)
+        next_url = ['/pins']
+
+        def get_page():
+            # Follows the next page link, starting over after the last page.
+            response = client.get(next_url[0])
+            match = re.search(r'href="(/pins\?[^"]+)"', response.data)
+            next_url[0] = (
+                match.group(1).replace('&amp;', '&') if match else '/pins')
+            return response
+
+        self.run_scenario('pins_page', '/pins', [get_page] * READS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Compares the GET /api/pins response encoding paths: Pin.to_dict() with
+jsonify() against pins4days.serializers, with and without the memcache
+cache of encoded pins.
+"""
+
+import os
+import time
+import unittest
+
+from flask import Flask
+from flask import jsonify
+from google.appengine.ext import ndb
+
+from benchmark_case import BenchmarkTestCase
+from generator import ArchiveGenerator
+from pins4days.serializers import encode_pins_response
+
+
+PINS = int(os.environ.get('BENCH_SERIALIZE_PINS', 100))
+REPEAT = int(os.environ.get('BENCH_SERIALIZE_REPEAT', 200))
+
+
+class SerializersBenchmark(BenchmarkTestCase):
+
+    def setUp(self):
+        super(SerializersBenchmark, self).setUp()
+        generator = ArchiveGenerator()
+        self.pins = [generator.pin() for _ in range(PINS)]
+        ndb.put_multi(self.pins)
+        self.app = Flask(__name__)
+
+    def measure(self, scenario, func):
+        with self.app.test_request_context('/api/pins'):
+            start = time.time()
+            for _ in range(REPEAT):
+                size = len(func())
+            elapsed = time.time() - start
+        self.report(
+            scenario,
+            pins=PINS,
+            bytes=size,
+            us_per_pin=elapsed / (REPEAT * PINS) * 10 ** 6,
+            responses_per_sec=REPEAT / elapsed)
+
+    def test_to_dict_jsonify(self):
+        self.measure('serialize.to_dict_jsonify', lambda: jsonify(
+            {'data': {'pins': [p.to_dict() for p in self.pins]}}).get_data())
+
+    def test_serializer(self):
+        self.measure(
+            'serialize.serializer', lambda: encode_pins_response(self.pins))
+
+    def test_serializer_cached(self):
+        encode_pins_response(self.pins, cache=True)
+        ndb.get_context().flush().get_result()
+        self.measure('serialize.serializer_cached', lambda: encode_pins_response(
+            self.pins, cache=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
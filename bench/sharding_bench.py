@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Compares sustained Pin write throughput with and without sharded
+ordering. See pins4days.sharding.
+
+A backfill writes pins with clustered, increasing created_ts values. Without
+sharding every write lands at the tail of the created_ts listing indexes;
+with BENCH_SHARDS shards it lands at the tail of one of that many shard_key
+ranges. The single-property created_ts index, which stays either way, is
+left out of the model. The datastore stub doesn't model hotspots, so the measured stub
+throughput says nothing about them. Next to it the benchmark reports
+model_capacity_per_sec, which is not a measurement: the number of index
+tails written to, times the assumed BENCH_TAIL_WRITES_PER_SEC (default 500,
+the rate a single key range can sustain before it needs to split).
+"""
+
+import os
+import unittest
+
+from google.appengine.ext import ndb
+
+from benchmark_case import BenchmarkTestCase
+from benchmark_case import Timer
+from fixtures import synthesize_events
+from pins4days.event import PinnedMessage
+from pins4days.models.pin import Pin
+
+
+EVENTS = int(os.environ.get('BENCH_SHARDING_EVENTS', 5000))
+SHARDS = int(os.environ.get('BENCH_SHARDS', 8))
+BATCH_SIZE = 500
+TAIL_WRITES_PER_SEC = float(os.environ.get('BENCH_TAIL_WRITES_PER_SEC', 500))
+PAGE_SIZE = 10
+
+
+class ShardingBenchmark(BenchmarkTestCase):
+
+    def setUp(self):
+        super(ShardingBenchmark, self).setUp()
+        self.pins = [PinnedMessage.factory(e) for e in synthesize_events(EVENTS)]
+
+    def tearDown(self):
+        Pin.set_shards(1)
+        super(ShardingBenchmark, self).tearDown()
+
+    def run_backfill(self, scenario, shards):
+        Pin.set_shards(shards)
+        with Timer() as timer:
+            for i in range(0, EVENTS, BATCH_SIZE):
+                ndb.put_multi(self.pins[i:i + BATCH_SIZE])
+        self.assertEquals(EVENTS, Pin.query().count())
+
+        if shards > 1:
+            tails = len(set(p.shard_key[:3] for p in self.pins))
+        else:
+            tails = 1
+        measured = EVENTS / timer.elapsed
+        page = Pin.query_all().fetch(PAGE_SIZE)
+        self.assertEquals(
+            sorted((p.created_ts for p in page), reverse=True),
+            [p.created_ts for p in page])
+        with Timer() as read_timer:
+            Pin.query_all().fetch(PAGE_SIZE, offset=PAGE_SIZE)
+
+        self.report(
+            scenario,
+            events=EVENTS,
+            shards=shards,
+            index_tails=tails,
+            pins_per_sec=measured,
+            model_capacity_per_sec=tails * TAIL_WRITES_PER_SEC,
+            page_ms=read_timer.elapsed * 1000)
+
+    def test_unsharded(self):
+        self.run_backfill('sharding.unsharded', 1)
+
+    def test_sharded(self):
+        self.run_backfill('sharding.sharded', SHARDS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,7 +7,7 @@ This app utilizes:
 - NDB client library for connecting to Google Cloud Datastore (NoSQL!), and
 storing pins and user info.
 - Google Cloud Storage (GCS) for storing configs
-- Memcache for session storage
+- Signed, expiring cookies for sessions
 
 Attributes:
     app (obj): Flask app.
@@ -16,18 +16,39 @@ Attributes:
     app.
     login_manager (LoginManager): User session manager.
 
+Per-request timings and RPC counts are logged, and summarized at
+/debug/metrics. See pins4days.metrics.
+
+JSON and HTML responses are gzip/deflate compressed for clients that accept
+it. See pins4days.compression.
+
+A deployment can serve several Slack workspaces, each with its own datastore
+and memcache namespace. See pins4days.tenants. Users link their Slack account
+to see their workspace's pins. See pins4days.identity.
+
+Old pins can be moved to archive blobs; listings carry on into them
+transparently. See pins4days.archive.
+
+Stored pins are counted in per-channel weekly and monthly digests, served by
+/api/digests. See pins4days.digests.
+
+Users can be limited to the pins of the channels they belong to. See
+pins4days.access.
+
+Listings can be pre-rendered to static snapshots, which are served without
+the app. See pins4days.snapshots.
+
 Todo:
     * Handle duplicate user creation in signup().
     * Investigate possible exceptions for User creation and add exception
     handling to signup().
-    * Handle pagination, aka return more than 10 pins from the /pins view and
-    /api/pins endpoint!
     * Read in existing pins and store them.
-    * Add auth to GET /api/pins.
 """
 
+import functools
 import logging
 import json
+from datetime import timedelta
 
 from flask import Flask
 from flask import request
@@ -36,55 +57,134 @@ from flask import redirect
 from flask import make_response
 from flask import url_for
 from flask import render_template
+from flask import Response
+from flask import session
 from flask_login import login_user
 from flask_login import LoginManager
 from flask_login import login_required
 from flask_login import current_user
-from werkzeug.contrib.cache import MemcachedCache
 from werkzeug.urls import Href
-from google.appengine.api import taskqueue
+from google.appengine.api import memcache
+from google.appengine.api import namespace_manager
+from google.appengine.ext import ndb
 
 from pins4days.constants import KEY_FLASK_APP_CONFIG
 from pins4days.constants import KEY_FLASK_SECRET_KEY
+from pins4days.constants import INGEST_MODE_PULL
+from pins4days.constants import INGEST_MODE_PUSH
+from pins4days.constants import PRIORITY_BACKFILL
 from pins4days.utils import load_config
-from pins4days.utils import get_channel_pins
+from pins4days.utils import get_channel_pins_async
 from pins4days.event import PinnedMessage
+from pins4days.ingest import enqueue_pins_async
+from pins4days.ingest import store_async
+from pins4days.blobs import get_blob_store
+from pins4days.models.archive import ArchivedPin
 from pins4days.models.pin import Pin
-from pins4days.models.user import User
 from pins4days.models.exceptions import EntityDoesNotExistException
 from pins4days.models.exceptions import IncorrectPasswordException
 from pins4days.appuser import AppUser
+from pins4days.serializers import encode_pin
+from pins4days.serializers import encode_pins_response
+from pins4days.serializers import response_cache_key
+from pins4days.serializers import CACHE_TTL
+from pins4days.verification import verify_signature
+from pins4days.verification import verify_token
+from pins4days.tenants import get_tenant
+from pins4days.tenants import UnknownTenantException
+from pins4days import access
+from pins4days import archive
+from pins4days import compression
+from pins4days import digests
+from pins4days import identity
+from pins4days import links
+from pins4days import metrics
+from pins4days import paging
+from pins4days import rotation
+from pins4days import snapshots
+from pins4days import storage
 
 
 app = Flask(__name__)
 config = load_config()
 app.config.update(config[KEY_FLASK_APP_CONFIG])
-app.config['SESSION_TYPE'] = 'memcached'
-app.config['SESSION_MEMCACHED'] = MemcachedCache()
+app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(
+    days=app.config.get('session_lifetime_days', 14))
 app.secret_key = config[KEY_FLASK_SECRET_KEY]
 login_manager = LoginManager()
 login_manager.init_app(app)
+metrics.init_app(app)
+compression.init_app(app)
+Pin.set_shards(app.config.get('pin_shards', 1))
+snapshots.init_app(app)
+storage.init_app(app)
+
+
+@app.before_request
+def activate_session_tenant():
+    """Switches to the namespace of the logged in user's workspace. Requests
+    from Slack switch to their workspace's namespace themselves.
+    """
+    try:
+        get_tenant(app.config, session_team_id()).activate()
+    except UnknownTenantException:
+        namespace_manager.set_namespace('')
+
+
+def session_slack_identity():
+    """Finds the logged in user's verified Slack identity. It is kept in the
+    session, and loaded from the User for sessions that predate it.
+
+    Returns:
+        dict: See identity.session_identity().
+    """
+    if 'slack_identity' not in session:
+        if not current_user.is_authenticated:
+            return identity.session_identity(None)
+        session['slack_identity'] = identity.session_identity(
+            current_user.user_model)
+    return session['slack_identity']
+
+
+def session_team_id():
+    """
+    Returns:
+        str or None: The logged in user's verified Slack team ID.
+    """
+    return session_slack_identity()['team_id']
+
+
+def session_slack_user_id():
+    """
+    Returns:
+        str or None: The logged in user's verified Slack user ID.
+    """
+    return session_slack_identity()['user_id']
 
 
 @login_manager.user_loader
 def load_user(username):
-    """Loads a User model instance based on their unique username.
+    """Builds the AppUser of the session's user.
+
+    The session lives in a cookie that is signed with the app's secret key,
+    and expires after the 'session_lifetime_days' app config (default 14).
+    Since the signature already proves the user logged in, the User model is
+    not loaded here; AppUser loads it the first time a handler needs it.
 
     Args:
         username (str): The user's username which they created upon sign up.
 
     Returns:
-        AppUser or None: Returns an AppUser if the User exists in the DB.
-        Returns None if the user does not exist.
+        AppUser
     """
-    user = User.get_by_id(username)
-    return AppUser(user) if user else None
+    return AppUser(username)
 
 
 @app.route('/signup', methods=['POST', 'GET'])
 def signup():
     """Handles user sign up. This requires that the user create a unique
-    username, and a password.
+    username, and a password. Their Slack team is linked afterwards, see
+    slack_connect().
 
     If the user is already logged in, redirect them to the main /pins page.
     If the user is not logged in, show them the signup form.
@@ -103,13 +203,13 @@ def signup():
     username = request.form['username']
     password = request.form['password']
 
-    User.create_with_encryption(id=username, password=password)
+    storage.get_repository().users.create_with_encryption(username, password)
     return redirect(url_for('login'))
 
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
-    """Logs in user, creating a session in memcache.
+    """Logs in user, creating a session cookie.
 
     If the user is already logged in, redirect them the /pins page.
     If the user is not logged in, show them the login form. See
@@ -151,10 +251,14 @@ def handle_login_post(request):
             render_template('login.html', error='E_BAD_FORM'), 400)
 
     try:
-        user = User.login(request.form['username'], request.form['password'])
-        app_user = AppUser(user)
+        user = storage.get_repository().users.login(
+            request.form['username'], request.form['password'])
+        app_user = AppUser(user.username, user)
         if app_user:
+            session.permanent = True
+            session['slack_identity'] = identity.session_identity(user)
             login_user(app_user)
+            refresh_session_channels()
             return redirect(url_for('pins'), 302)
     except EntityDoesNotExistException as e:
         return make_response(
@@ -164,6 +268,81 @@ def handle_login_post(request):
             render_template('login.html', error='E_INCORRECT_PASSWORD'), 400)
 
 
+@app.route('/slack/connect', methods=['GET'])
+@login_required
+def slack_connect():
+    """Sends the logged in user to Slack to confirm their Slack identity. See
+    pins4days.identity.
+
+    Returns:
+        Response:
+    """
+    if not identity.is_configured(app.config):
+        return make_response(
+            jsonify(message='Slack sign in is not configured.'), 404)
+    state = identity.new_state()
+    session['slack_state'] = state
+    return redirect(identity.authorize_url(
+        app.config, state, url_for('slack_connect_callback', _external=True)))
+
+
+@app.route('/slack/connect/callback', methods=['GET'])
+@login_required
+def slack_connect_callback():
+    """Stores the Slack identity that Slack confirmed for the logged in user,
+    and redirects them to the /pins page. See pins4days.identity.
+
+    Returns:
+        Response:
+    """
+    if not identity.is_configured(app.config):
+        return make_response(
+            jsonify(message='Slack sign in is not configured.'), 404)
+    if 'code' not in request.args or not identity.check_state(
+            session.pop('slack_state', None), request.args.get('state')):
+        return make_response(jsonify(message='Invalid OAuth state.'), 400)
+    try:
+        team_id, slack_user_id = identity.verify(
+            app.config, request.args['code'],
+            url_for('slack_connect_callback', _external=True))
+    except identity.IdentityException:
+        logging.exception('Could not verify a Slack identity.')
+        return make_response(
+            jsonify(message='Slack did not confirm your identity.'), 403)
+
+    user = storage.get_repository().users.link_slack_identity(
+        current_user.username, team_id, slack_user_id)
+    session['slack_identity'] = identity.session_identity(user)
+    refresh_session_channels()
+    return redirect(url_for('pins'), 302)
+
+
+def refresh_session_channels():
+    """Lists the logged in user's channels from Slack if channel access
+    control is on and they are missing or stale. See pins4days.access.
+    """
+    try:
+        tenant = get_tenant(app.config, session_team_id())
+    except UnknownTenantException:
+        return
+    tenant.activate()
+    access.refresh_if_stale(tenant, session_slack_user_id())
+
+
+def session_channels():
+    """Finds the channels whose pins the logged in user may see.
+
+    Returns:
+        frozenset or None: The channel IDs, or None if channel access control
+        is off and every pin is visible. See pins4days.access.
+    """
+    try:
+        tenant = get_tenant(app.config, session_team_id())
+    except UnknownTenantException:
+        return frozenset() if app.config.get('channel_access') else None
+    return access.visible_channels(tenant, session_slack_user_id())
+
+
 def validate_form(form):
     """Executes simple form validation. Checks for None or empty string values.
 
@@ -178,32 +357,135 @@ def validate_form(form):
         form['password'].replace(' ', '') and form['password'] is not None)
 
 
+@ndb.tasklet
+def fetch_pins_async(live_query, archived_query, limit, cursor=None):
+    """Fetches a page of pins, carrying on into archived pins if archiving
+    is enabled, and fills in their link previews. See pins4days.links and
+    pins4days.paging.
+
+    Args:
+        live_query (callable): Pin query builder, e.g. Pin.query_all.
+        archived_query (callable): The matching ArchivedPin query builder.
+        limit (int): Page size.
+        cursor (str): Optional. The cursor returned with the previous page.
+
+    Returns:
+        Future: Resolves to a tuple (list, str): the Pins and the cursor of
+        the next page, or None if this is the last one.
+    """
+    if archive.is_enabled(app.config):
+        pins, cursor = yield archive.fetch_page_async(
+            live_query, archived_query, limit, cursor,
+            get_blob_store(app.config))
+    else:
+        pins, cursor = yield paging.fetch_page_async(
+            [live_query], limit, cursor)
+    pins = yield links.resolve_async(pins)
+    raise ndb.Return((pins, cursor))
+
+
 @app.route('/pins', methods=['GET'])
-@login_required
+@ndb.toplevel
 def pins():
     """Renders the /pins page template.
 
+    Only pins from the channels the user may see are listed. The pins query
+    is started as soon as those are known, so that it is in flight while the
+    rest of the page is set up.
+
     Returns:
-        TYPE: Description
+        Response:
     """
+    if not current_user.is_authenticated:
+        return login_manager.unauthorized()
+
+    limit = int(request.args.get('limit', 10))
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            paging.decode_cursor(cursor)
+        except ValueError:
+            return make_response(jsonify(message='Invalid cursor.'), 400)
+    channel_ids = session_channels()
+    pins_future = fetch_pins_async(
+        functools.partial(Pin.query_all, channel_ids),
+        functools.partial(ArchivedPin.query_all, channel_ids), limit, cursor)
+
     username = current_user.username
-    limit = request.args.get('limit', 10)
-    page = int(request.args.get('page', 1))
-    offset = (page - 1) * limit
-    href = Href(url_for('pins'))
-    next_url = href({'page': page + 1})
+    snapshots_url = session_snapshots_url()
+    slack_connect_url = session_slack_connect_url()
+    pins, next_cursor = pins_future.get_result()
+    next_url = None
+    if next_cursor:
+        href = Href(url_for('pins'))
+        next_url = href({'cursor': next_cursor, 'limit': limit})
     return render_template(
         'pins.html',
         username=username,
         next_url=next_url,
-        pins=Pin.query_all().fetch(limit, offset=offset))
+        snapshots_url=snapshots_url,
+        slack_connect_url=slack_connect_url,
+        pins=pins)
+
+
+def session_slack_connect_url():
+    """
+    Returns:
+        str or None: The URL where the logged in user links their Slack
+        account, or None if it is linked or Slack sign in isn't configured.
+    """
+    if session_team_id() or not identity.is_configured(app.config):
+        return None
+    return url_for('slack_connect')
+
+
+def session_snapshots_url():
+    """
+    Returns:
+        str or None: The URL of the static snapshots of the logged in user's
+        workspace, or None if it has none. See pins4days.snapshots.
+    """
+    try:
+        tenant = get_tenant(app.config, session_team_id())
+    except UnknownTenantException:
+        return None
+    if not snapshots.is_enabled(tenant):
+        return None
+    return snapshots.snapshot_url(app.config)
+
+
+@app.route('/snapshots/<path:name>', methods=['GET'])
+def snapshot(name):
+    """Serves a static snapshot from the local blob directory, or redirects
+    to it in Cloud Storage, where it is normally linked to directly. See
+    pins4days.snapshots. Snapshots are public.
+
+    Args:
+        name (str): The snapshot's blob name, without 'snapshots/'.
+
+    Returns:
+        Response:
+    """
+    name = 'snapshots/' + name
+    if not app.config.get('blob_local_dir'):
+        return redirect(snapshots.public_url(app.config, name), 301)
+
+    result = snapshots.read(app.config, name)
+    if result is None:
+        return make_response(jsonify(message='Snapshot does not exist.'), 404)
+    data, content_type, ttl = result
+    response = compression.precompressed_response(data, content_type)
+    response.headers['Cache-Control'] = 'public, max-age={}'.format(ttl)
+    return response
 
 
 @app.route('/api/pins', methods=['POST', 'GET'])
+@ndb.toplevel
 def api_pins():
     """Fetches or creates Pins.
 
     See handle_api_pins_post() and handle_api_pins_get() for more details.
+    Fetching requires a login.
 
     Returns:
         Response:
@@ -211,31 +493,144 @@ def api_pins():
     if request.method == 'POST':
         return handle_api_pins_post(request)
     elif request.method == 'GET':
+        if not current_user.is_authenticated:
+            return login_required_response()
         return handle_api_pins_get(request)
 
 
+def login_required_response():
+    """
+    Returns:
+        Response: 401 for API requests without a logged in user.
+    """
+    return make_response(jsonify(message='Login required.'), 401)
+
+
+@app.route('/api/pins/<pin_id>', methods=['GET'])
+def api_pin(pin_id):
+    """Fetches a single Pin by its key id, whether it is live or archived.
+    Requires a login. Pins from channels the user may not see don't exist as
+    far as the user is concerned.
+
+    Args:
+        pin_id (str): The Pin's key id, see Pin.build_key_id().
+
+    Returns:
+        Response:
+    """
+    if not current_user.is_authenticated:
+        return login_required_response()
+    if archive.is_enabled(app.config):
+        pin = archive.get_pins([pin_id], get_blob_store(app.config))[0]
+    else:
+        pin = Pin.get_by_id(pin_id)
+    channel_ids = session_channels()
+    if pin is None or (
+            channel_ids is not None and pin.channel_id not in channel_ids):
+        return make_response(jsonify(message='Pin does not exist.'), 404)
+    links.resolve_async([pin]).get_result()
+    return Response(
+        '{"data":{"pin":' + encode_pin(pin) + '}}',
+        mimetype='application/json')
+
+
+@app.route('/api/digests', methods=['GET'])
+def api_digests():
+    """Fetches per-channel pin counts, top authors, pinners and linked
+    domains per week or month. See pins4days.digests. Requires a login, and
+    only counts the channels the user may see.
+
+    Query params:
+        period: 'week' or 'month' (default).
+        buckets: Number of weeks or months, counting back from the current
+        one. Default 12, at most 104.
+        channel_id: Optional. Only report this channel.
+        top: Number of authors, pinners and domains listed per bucket.
+        Default 10.
+
+    Returns:
+        Response:
+    """
+    if not current_user.is_authenticated:
+        return login_required_response()
+    period = request.args.get('period', digests.PERIOD_MONTH)
+    if period not in digests.PERIODS:
+        return make_response(jsonify(message='Unknown period.'), 400)
+    try:
+        buckets = int(request.args.get('buckets', digests.DEFAULT_BUCKETS))
+        buckets = max(1, min(buckets, digests.MAX_BUCKETS))
+        top = int(request.args.get('top', digests.DEFAULT_TOP))
+    except ValueError:
+        return make_response(jsonify(message='Invalid number.'), 400)
+
+    results = digests.query_digests(
+        period, buckets=buckets, channel_id=request.args.get('channel_id'),
+        top=top, channel_ids=session_channels())
+    return jsonify(data={'period': period, 'digests': results})
+
+
 @app.route('/channels/<channel_id>/pins/enqueue', methods=['GET'])
 @login_required
+@ndb.toplevel
 def channels_pins_enqueue(channel_id):
+    """Reads in a channel's existing pins and enqueues a worker task for each
+    of them.
+
+    Tasks are added in batches, and all batches are sent concurrently. They
+    go to the backfill queue so that they don't hold up live pin events. See
+    pins4days.ingest for the push and pull ingest modes.
+
+    Users whose workspace isn't served by the deployment (e.g. who haven't
+    linked their Slack account) are refused.
+
+    Args:
+        channel_id (str): Slack channel ID.
+
+    Returns:
+        Response:
+    """
     if request.method == 'GET':
-        resp = get_channel_pins(channel_id, app.config['slack_user_token'])
-        pins = resp['items']
-        for pin in pins:
-            task = taskqueue.add(
-                url='/worker/create_pin',
-                target='worker',
-                payload=json.dumps(pin),
-                method='POST')
+        try:
+            tenant = get_tenant(app.config, session_team_id())
+        except UnknownTenantException:
+            return make_response(
+                jsonify(message='Unrecognized team.'), 403)
+        resp = get_channel_pins_async(
+            channel_id, tenant.setting('slack_user_token')).get_result()
+        futures = enqueue_pins_async(
+            resp['items'],
+            tenant.setting('ingest_mode', INGEST_MODE_PUSH),
+            PRIORITY_BACKFILL,
+            countdown=tenant.enqueue_delay(len(resp['items'])))
+        for future in futures:
+            future.get_result()
         return make_response('', 200)
 
 
 def handle_api_pins_post(request):
     """Handles POST requests to /api/pins.
 
-    If the JSON POST request body contains the 'challenge' or 'token' keys,
-    perform Slack's URL verification handshake. For more details, see:
-    https://api.slack.com/events-api#url_verification.
-    Otherwise, create a Pin (and its attachments).
+    If the 'slack_signing_secret' app config is set, the request's Slack
+    signature is verified over the raw body before anything else is done.
+    Otherwise, the deprecated 'token' in the JSON body is checked against the
+    'slack_verification_token' app config.
+
+    If the JSON POST request body contains the 'challenge' key, perform
+    Slack's URL verification handshake. For more details, see:
+    https://api.slack.com/events-api#url_verification. The handshake names
+    no team, so its token may be any workspace's.
+
+    Other events are routed to their workspace by their 'team_id'. Events for
+    workspaces that this deployment doesn't serve are rejected. Otherwise,
+    create a Pin (and its attachments). When the 'ingest_mode' app
+    config is 'pull', the event is buffered in the ingest pull queue instead,
+    and stored in a batch by the worker service.
+
+    If pin rotation is enabled and the channel is close to Slack's pin cap,
+    a rotation of the channel is scheduled. See pins4days.rotation.
+
+    member_joined_channel and member_left_channel events update the stored
+    channel memberships instead. See pins4days.access.
 
     Args:
         request (Request):
@@ -243,28 +638,87 @@ def handle_api_pins_post(request):
     Returns:
         Response:
     """
-    json = request.get_json()
-    if ('token' not in json or
-        json['token'] != app.config['slack_verification_token']):
+    signing_secret = app.config.get('slack_signing_secret')
+    if signing_secret and not verify_signature(
+            signing_secret,
+            request.headers.get('X-Slack-Request-Timestamp'),
+            request.get_data(),
+            request.headers.get('X-Slack-Signature')):
         return make_response(
-            jsonify(message='Missing or unrecognized token.'),
+            jsonify(message='Missing or invalid signature.'),
             401)
 
+    json = request.get_json()
     if 'challenge' in json:
         # Handle the very first and only auth call.
+        if not signing_secret and not any(
+                verify_token(expected, json.get('token'))
+                for expected in verification_tokens()):
+            return make_response(
+                jsonify(message='Missing or unrecognized token.'),
+                401)
         challenge = json['challenge']
         return jsonify(challenge=challenge)
 
+    try:
+        tenant = get_tenant(app.config, json.get('team_id'))
+    except UnknownTenantException:
+        return make_response(
+            jsonify(message='Unrecognized team.'),
+            403)
+
+    if not signing_secret and (
+            'token' not in json or
+            not verify_token(
+                tenant.setting('slack_verification_token'), json['token'])):
+        return make_response(
+            jsonify(message='Missing or unrecognized token.'),
+            401)
+
+    tenant.activate()
+    if access.is_membership_event(json):
+        access.apply_event(json)
+        return make_response('', 200)
+
+    if rotation.should_rotate(tenant, json):
+        rotation.schedule(rotation.event_channel(json), tenant.team_id)
+
+    if tenant.setting('ingest_mode', INGEST_MODE_PUSH) == INGEST_MODE_PULL:
+        # Task queue RPCs aren't waited for by ndb.toplevel.
+        futures = enqueue_pins_async(
+            [json], INGEST_MODE_PULL, countdown=tenant.enqueue_delay(1))
+        for future in futures:
+            future.get_result()
+        return make_response('', 202)
+
     pin = PinnedMessage.factory(json)
-    pin.put()
+    # Slack doesn't retry acknowledged events, so only acknowledge the event
+    # once the pin is stored.
+    store_async([pin]).get_result()
     return make_response('', 201)
 
 
+def verification_tokens():
+    """
+    Returns:
+        list: The Slack verification token of every workspace.
+    """
+    teams = app.config.get('teams') or {}
+    tokens = [app.config.get('slack_verification_token')]
+    tokens += [team.get('slack_verification_token') for team in teams.values()]
+    return [token for token in tokens if token]
+
+
 def handle_api_pins_get(request):
     """Handles GET requests to /api/pins.
 
     If 'user_id' query param is set, pins for that user are returned.
-    Otherwise, the most recently pinned messages are returned.
+    Otherwise, the most recently pinned messages are returned. Either way,
+    only pins from the channels the logged in user may see are returned.
+
+    The response is encoded by pins4days.serializers. Set the 'cache_pin_json'
+    app config to reuse encoded pins from memcache, and the
+    'cache_api_responses' app config to cache whole (gzipped) responses.
 
     Args:
         request (Request):
@@ -273,14 +727,30 @@ def handle_api_pins_get(request):
         Response:
     """
     user_id = request.args.get('user_id')
+    channel_ids = session_channels()
+    cache_responses = app.config.get('cache_api_responses', False)
+    if cache_responses:
+        cache_key = response_cache_key(
+            'api_pins', user_id, access.fingerprint(channel_ids))
+        cached = memcache.get(cache_key)
+        if cached is not None:
+            return compression.precompressed_response(cached, 'application/json')
+
     if user_id:
-        pins = Pin.query_user(user_id).fetch(10)
+        pins = fetch_pins_async(
+            functools.partial(Pin.query_user, user_id, channel_ids),
+            functools.partial(ArchivedPin.query_user, user_id, channel_ids), 10)
     else:
-        pins = Pin.query_all().fetch(10)
-
-    response = {
-        'data': {
-            'pins': [pin.to_dict() for pin in pins]
-        }
-    }
-    return jsonify(response)
+        pins = fetch_pins_async(
+            functools.partial(Pin.query_all, channel_ids),
+            functools.partial(ArchivedPin.query_all, channel_ids), 10)
+    pins, _ = pins.get_result()
+
+    body = encode_pins_response(
+        pins, cache=app.config.get('cache_pin_json', False))
+    if cache_responses:
+        compressed = compression.compress(
+            body, level=app.config.get('gzip_level', compression.DEFAULT_LEVEL))
+        memcache.add(cache_key, compressed, time=CACHE_TTL)
+        return compression.precompressed_response(compressed, 'application/json')
+    return Response(body, mimetype='application/json')
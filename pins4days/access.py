@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""Channel-level access control.
+
+When the 'channel_access' app config (or workspace setting, see
+pins4days.tenants) is set, users only see pins from the channels they belong
+to. Visibility is decided per channel, never per pin:
+
+1. Each user's channels are listed from Slack (users.conversations) ahead of
+   time and stored in a ChannelMembership, keyed by the user's Slack user ID
+   in the workspace's namespace. Memberships are listed at login if they are
+   missing or older than REFRESH_HOURS, by a worker cron job every few hours,
+   and kept current in between by Slack's member_joined_channel and
+   member_left_channel events (see apply_event()).
+2. A compact copy of the channel IDs, a sorted comma separated string, is
+   cached in memcache per user, so a listing costs one memcache read on top
+   of its queries (see get_channels_async()).
+3. The channel IDs are passed to the Pin and ArchivedPin query helpers (e.g.
+   Pin.query_all(channel_ids)), which filter on them with IN, one query per
+   batch of channels (and per shard), and merge them newest first, the same
+   way sharded queries are merged (see pins4days.sharding). The queries run
+   in parallel, and never read a pin the user can't see, however many
+   channels they are in. Listings page through them with a cursor, so each
+   query reads about a page of pins (see pins4days.paging).
+
+Users need a Slack user ID (User.slack_user_id) to see any pins while access
+control is on. It is only ever taken from a Slack identity that Slack
+confirmed (see pins4days.identity), never from user input, since it decides
+which private channels and DMs a user can read. The Slack user token needs the channels:read, groups:read,
+mpim:read and im:read scopes.
+
+Attributes:
+    CACHE_TTL (int): Seconds a user's channels stay cached in memcache.
+    CONVERSATION_TYPES (str): The kinds of conversations whose pins are
+    controlled.
+    MEMBERSHIP_EVENTS (tuple): Slack event types that change a membership.
+    REFRESH_HOURS (int): Age, in hours, at which a membership is listed from
+    Slack again.
+"""
+
+import hashlib
+import logging
+import re
+import time
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.api import namespace_manager
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from pins4days.constants import QUEUE_ACCESS
+from pins4days.models.access import ChannelMembership
+from pins4days.models.user import User
+from pins4days.tenants import get_tenant
+from pins4days.tenants import UnknownTenantException
+from pins4days.utils import get_user_conversations_async
+
+
+CACHE_TTL = 6 * 60 * 60
+CONVERSATION_TYPES = 'public_channel,private_channel,mpim,im'
+MEMBERSHIP_EVENTS = ('member_joined_channel', 'member_left_channel')
+REFRESH_HOURS = 6
+
+
+def is_enabled(tenant):
+    """
+    Args:
+        tenant (Tenant): The workspace.
+
+    Returns:
+        bool: True if the workspace's pins are only shown to channel members.
+    """
+    return bool(tenant.setting('channel_access'))
+
+
+def cache_key(slack_user_id):
+    """
+    Args:
+        slack_user_id (str): The Slack user ID.
+
+    Returns:
+        str: The memcache key of the user's channels, in the current
+        namespace.
+    """
+    return 'access:{}'.format(slack_user_id)
+
+
+def encode_channels(channel_ids):
+    """
+    Args:
+        channel_ids (iterable): Channel IDs.
+
+    Returns:
+        str: The sorted, comma separated channel IDs.
+    """
+    return ','.join(sorted(set(channel_ids)))
+
+
+def decode_channels(value):
+    """
+    Args:
+        value (str): Channel IDs from encode_channels().
+
+    Returns:
+        frozenset
+    """
+    return frozenset(c for c in value.split(',') if c)
+
+
+def fingerprint(channel_ids):
+    """Identifies a set of visible channels in cache keys, e.g. of cached
+    responses.
+
+    Args:
+        channel_ids (frozenset or None): Visible channels, or None if access
+        control is off.
+
+    Returns:
+        str
+    """
+    if channel_ids is None:
+        return 'all'
+    return hashlib.sha1(encode_channels(channel_ids)).hexdigest()[:16]
+
+
+@ndb.tasklet
+def get_channels_async(slack_user_id, team_id=None):
+    """Gets the channels a user belongs to, from memcache if possible. If
+    the user's membership hasn't been listed yet, a refresh is enqueued and
+    the user sees no channels until it has run.
+
+    Args:
+        slack_user_id (str or None): The Slack user ID.
+        team_id (str or None): The user's Slack team ID.
+
+    Returns:
+        Future: Resolves to a frozenset of channel IDs.
+    """
+    if not slack_user_id:
+        raise ndb.Return(frozenset())
+    context = ndb.get_context()
+    cached = yield context.memcache_get(cache_key(slack_user_id))
+    if cached is not None:
+        raise ndb.Return(decode_channels(cached))
+
+    membership = yield ChannelMembership.get_by_id_async(slack_user_id)
+    if membership is None:
+        enqueue_refresh(slack_user_id, team_id)
+        raise ndb.Return(frozenset())
+    # add() rather than set(), so that a membership read before a concurrent
+    # update (see apply_event()) can't overwrite the updated copy.
+    yield context.memcache_add(
+        cache_key(slack_user_id), encode_channels(membership.channel_ids),
+        time=CACHE_TTL)
+    raise ndb.Return(frozenset(membership.channel_ids))
+
+
+def visible_channels(tenant, slack_user_id):
+    """
+    Args:
+        tenant (Tenant): The user's workspace.
+        slack_user_id (str or None): The user's Slack user ID.
+
+    Returns:
+        frozenset or None: The channels whose pins the user may see, or None
+        if access control is off and every pin is visible.
+    """
+    if not is_enabled(tenant):
+        return None
+    return get_channels_async(slack_user_id, tenant.team_id).get_result()
+
+
+@ndb.tasklet
+def list_channels_async(slack_user_id, token):
+    """Lists every conversation a user is a member of from Slack.
+
+    Args:
+        slack_user_id (str): The Slack user ID.
+        token (str): Slack user token.
+
+    Returns:
+        Future: Resolves to a set of channel IDs.
+
+    Raises:
+        Exception: Thrown if Slack returns an error.
+    """
+    channel_ids = set()
+    cursor = None
+    while True:
+        response = yield get_user_conversations_async(
+            slack_user_id, token, CONVERSATION_TYPES, cursor)
+        if not response.get('ok'):
+            raise Exception('users.conversations failed: {}'.format(
+                response.get('error')))
+        channel_ids.update(c['id'] for c in response.get('channels', []))
+        cursor = (response.get('response_metadata') or {}).get('next_cursor')
+        if not cursor:
+            raise ndb.Return(channel_ids)
+
+
+def refresh(tenant, slack_user_id):
+    """Lists a user's channels from Slack and stores them. Called by the
+    worker service, and at login.
+
+    Args:
+        tenant (Tenant): The user's workspace. Must be active.
+        slack_user_id (str): The Slack user ID.
+
+    Returns:
+        frozenset: The user's channel IDs.
+    """
+    channel_ids = list_channels_async(
+        slack_user_id, tenant.setting('slack_user_token')).get_result()
+    ChannelMembership(
+        id=slack_user_id, channel_ids=sorted(channel_ids)).put()
+    ndb.get_context().memcache_set(
+        cache_key(slack_user_id), encode_channels(channel_ids),
+        time=CACHE_TTL).get_result()
+    return frozenset(channel_ids)
+
+
+def _is_stale(membership):
+    return membership is None or membership.updated is None or (
+        datetime.utcnow() - membership.updated > timedelta(hours=REFRESH_HOURS))
+
+
+def refresh_if_stale(tenant, slack_user_id):
+    """Refreshes a user's channels at login if they are missing or stale.
+    Failures are logged; the user then sees the channels listed last time.
+
+    Args:
+        tenant (Tenant): The user's workspace. Must be active.
+        slack_user_id (str or None): The Slack user ID.
+    """
+    if not slack_user_id or not is_enabled(tenant):
+        return
+    if not _is_stale(ChannelMembership.get_by_id(slack_user_id)):
+        return
+    try:
+        refresh(tenant, slack_user_id)
+    except Exception:
+        logging.exception('Could not list the channels of %s.', slack_user_id)
+        enqueue_refresh(slack_user_id, tenant.team_id)
+
+
+def enqueue_refresh(slack_user_id, team_id=None):
+    """Enqueues a refresh of a user's channels in the current namespace.
+    Tasks are named after the user and the hour, so a user is listed at
+    most once an hour however often it is asked for.
+
+    Args:
+        slack_user_id (str): The Slack user ID.
+        team_id (str or None): The user's Slack team ID.
+    """
+    namespace = namespace_manager.get_namespace() or '_'
+    task_name = 'access-{}-{}-{}'.format(
+        re.sub(r'[^0-9A-Za-z_-]', '_', namespace),
+        re.sub(r'[^0-9A-Za-z_-]', '_', slack_user_id),
+        int(time.time()) // (60 * 60))
+    try:
+        taskqueue.add(
+            name=task_name,
+            queue_name=QUEUE_ACCESS,
+            url='/worker/access/refresh',
+            target='worker',
+            method='POST',
+            params={'slack_user_id': slack_user_id, 'team_id': team_id or ''})
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def enqueue_all(app_config):
+    """Enqueues a refresh for every user with a verified Slack identity whose
+    workspace has access control on. Called by the worker's cron job.
+
+    Args:
+        app_config (dict): The app config.
+
+    Returns:
+        int: Number of refreshes enqueued.
+    """
+    enqueued = 0
+    try:
+        for user in User.query(namespace='').iter():
+            if not user.slack_verified or not user.slack_user_id:
+                continue
+            try:
+                tenant = get_tenant(app_config, user.team_id)
+            except UnknownTenantException:
+                continue
+            if not is_enabled(tenant):
+                continue
+            tenant.activate()
+            enqueue_refresh(user.slack_user_id, tenant.team_id)
+            enqueued += 1
+    finally:
+        namespace_manager.set_namespace('')
+    return enqueued
+
+
+def is_membership_event(event):
+    """
+    Args:
+        event (dict): The Slack events API request body.
+
+    Returns:
+        bool: True if the event changes a channel's members.
+    """
+    return (event.get('event') or {}).get('type') in MEMBERSHIP_EVENTS
+
+
+@ndb.transactional
+def _update_membership(slack_user_id, channel_id, joined):
+    membership = ChannelMembership.get_by_id(slack_user_id)
+    if membership is None:
+        return None
+    channel_ids = set(membership.channel_ids)
+    if joined:
+        channel_ids.add(channel_id)
+    else:
+        channel_ids.discard(channel_id)
+    membership.channel_ids = sorted(channel_ids)
+    membership.put()
+    return membership
+
+
+def apply_event(event):
+    """Applies a member_joined_channel or member_left_channel event to the
+    user's stored membership, in the current namespace. Memberships that
+    haven't been listed yet are left alone; they are complete once they are.
+
+    Args:
+        event (dict): The Slack events API request body.
+
+    Returns:
+        bool: True if a membership was updated.
+    """
+    inner = event['event']
+    slack_user_id = inner.get('user')
+    channel_id = inner.get('channel')
+    if not slack_user_id or not channel_id:
+        return False
+    membership = _update_membership(
+        slack_user_id, channel_id, inner['type'] == 'member_joined_channel')
+    if membership is None:
+        return False
+    ndb.get_context().memcache_set(
+        cache_key(slack_user_id), encode_channels(membership.channel_ids),
+        time=CACHE_TTL).get_result()
+    return True
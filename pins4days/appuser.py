@@ -1,26 +1,44 @@
 # -*- coding: utf-8 -*-
 
-from models.user import User
 from flask_login.mixins import UserMixin
 
+import storage
+
 
 class AppUser(UserMixin):
 
     """Represents a Pins4Days user in Flask.
 
+    The User is only loaded from the storage backend the first time
+    user_model is accessed, so that requests which only need to know who is
+    logged in don't make any RPCs.
+
     Attributes:
         user_model (pins4days.models.User): The Pins4Days User model.
         username (str): The user's username.
     """
 
-    def __init__(self, user):
+    def __init__(self, username, user=None):
         """Creates a Flask user.
 
         Args:
-            user (pins4days.models.User): The Pins4Days User model.
+            username (str): The user's username, which is also the User ID.
+            user (pins4days.models.User): Optional. The Pins4Days User model,
+            if it has already been loaded.
+        """
+        self.username = username
+        self._user_model = user
+
+    @property
+    def user_model(self):
+        """The Pins4Days User model. Loaded on first access.
+
+        Returns:
+            pins4days.models.User or None: None if the User no longer exists.
         """
-        self.user_model = user
-        self.username = user.key.id()
+        if self._user_model is None:
+            self._user_model = storage.get_repository().users.get(self.username)
+        return self._user_model
 
     def get_id(self):
         """Gets the user's ID.
@@ -28,4 +46,4 @@ class AppUser(UserMixin):
         Returns:
             str: The pins4days.models.User ID which is the user's username.
         """
-        return self.user_model.key.id()
+        return self.username
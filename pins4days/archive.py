@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""Hot/cold tiering of old pins.
+
+Pins created more than 'archive_after_days' days ago (app config; tiering is
+off when it isn't set) are moved out of the Pin kind into archive blobs, one
+per channel and month per run, written to the blob store (see
+pins4days.blobs). Each blob is NDJSON, gzip-compressed as a whole so that
+similar pins compress together. An ArchivedPin stub with the same key id,
+the indexed properties and the Pin's byte range in the uncompressed NDJSON
+is left in the datastore. Blobs are read whole, once per listing.
+
+The Pin queries therefore only walk recent pins. Listings continue into the
+stubs once the recent pins run out (see fetch_page_async()), and archived
+pins are read back from their blobs when they are listed or requested.
+
+Attributes:
+    DEFAULT_BATCH_SIZE (int): Number of Pins archived per batch.
+    DEFAULT_TIME_BUDGET (int): Seconds a single task may spend archiving
+    before handing over to a fresh task.
+"""
+
+import collections
+import json
+import logging
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from pins4days import compression
+from pins4days import paging
+from pins4days.constants import QUEUE_MIGRATIONS
+from pins4days.models.archive import ArchivedPin
+from pins4days.models.pin import Attachment
+from pins4days.models.pin import Pin
+from pins4days.serializers import serialize_pin
+
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_TIME_BUDGET = 8 * 60
+
+_DAY = 24 * 60 * 60
+
+
+def is_enabled(app_config):
+    """
+    Args:
+        app_config (dict): The app config.
+
+    Returns:
+        bool: True if pins get archived.
+    """
+    return bool(app_config.get('archive_after_days'))
+
+
+def encode_record(pin):
+    """Encodes a Pin as a single NDJSON line.
+
+    Args:
+        pin (Pin): The Pin.
+
+    Returns:
+        str
+    """
+    return json.dumps(serialize_pin(pin), separators=(',', ':')) + '\n'
+
+
+def decode_record(record):
+    """Rebuilds a Pin from its archive record. The Pin has the same key as
+    the archived Pin, but isn't in the datastore.
+
+    Args:
+        record (str): The record, as written by encode_record().
+
+    Returns:
+        Pin
+    """
+    data = json.loads(record)
+    data['attachments'] = [Attachment(**a) for a in data['attachments']]
+    return Pin.create(**data)
+
+
+def blob_name(channel_id, month, namespace=''):
+    """Builds a unique name for a new archive blob.
+
+    Args:
+        channel_id (str): The channel of the blob's Pins.
+        month (str): The month of the blob's Pins, as YYYY-MM.
+        namespace (str): The namespace the Pins were stored in.
+
+    Returns:
+        str
+    """
+    return 'archive/{}/{}/{}/{}.ndjson.gz'.format(
+        namespace or '_', channel_id, month, int(time.time() * 1000))
+
+
+def _month(created_ts):
+    if created_ts is None:
+        return 'undated'
+    return time.strftime('%Y-%m', time.gmtime(created_ts))
+
+
+def archive_batch(store, cutoff, batch_size=DEFAULT_BATCH_SIZE):
+    """Archives the oldest Pins created before the cutoff.
+
+    Blobs are written first, then the stubs, and only then are the Pins
+    deleted, so every Pin stays readable throughout. A batch that
+    fails half way may leave both a Pin and its stub behind; the Pin wins
+    (see get_pins()) and the next run archives it again.
+
+    Args:
+        store (GcsBlobStore or LocalBlobStore): Where to write the blobs.
+        cutoff (int): Pins created before this timestamp are archived.
+        batch_size (int): Maximum number of Pins to archive.
+
+    Returns:
+        int: Number of Pins archived.
+    """
+    pins = Pin.query_created_before(cutoff).fetch(batch_size)
+    if not pins:
+        return 0
+
+    groups = collections.defaultdict(list)
+    for pin in pins:
+        groups[(pin.channel_id, _month(pin.created_ts))].append(pin)
+
+    stubs = []
+    for (channel_id, month), group in groups.items():
+        name = blob_name(channel_id, month, pins[0].key.namespace())
+        records = []
+        offset = 0
+        for pin in group:
+            record = encode_record(pin)
+            stubs.append(ArchivedPin.create(pin, name, offset, len(record)))
+            records.append(record)
+            offset += len(record)
+        store.write(
+            name, compression.compress(''.join(records)), 'application/gzip')
+
+    ndb.put_multi(stubs)
+    ndb.delete_multi([pin.key for pin in pins])
+    return len(pins)
+
+
+def run_archive(store, archive_after_days, batch_size=DEFAULT_BATCH_SIZE,
+                time_budget=DEFAULT_TIME_BUDGET):
+    """Archives batches until no Pins are old enough or the time budget runs
+    out, then re-enqueues itself if there is more to do.
+
+    Args:
+        store (GcsBlobStore or LocalBlobStore): Where to write the blobs.
+        archive_after_days (int): Age, in days, at which Pins are archived.
+        batch_size (int): Number of Pins archived per batch.
+        time_budget (float): Seconds this call may keep starting new batches.
+
+    Returns:
+        int: Number of Pins archived.
+    """
+    cutoff = int(time.time()) - archive_after_days * _DAY
+    deadline = time.time() + time_budget
+    archived = 0
+    while True:
+        count = archive_batch(store, cutoff, batch_size)
+        archived += count
+        if count < batch_size:
+            break
+        if time.time() >= deadline:
+            taskqueue.add(
+                queue_name=QUEUE_MIGRATIONS,
+                url='/worker/archive',
+                target='worker',
+                method='POST')
+            break
+    logging.info('Archived %d pins created before %d.', archived, cutoff)
+    return archived
+
+
+def hydrate(stubs, store):
+    """Reads archived Pins back from their blobs. Every blob is read and
+    decompressed once, however many of its Pins are needed.
+
+    Args:
+        stubs (list): ArchivedPin stubs.
+        store (GcsBlobStore or LocalBlobStore): Where the blobs are.
+
+    Returns:
+        list: Pins, in the same order as the stubs.
+    """
+    by_blob = collections.defaultdict(list)
+    for stub in stubs:
+        by_blob[stub.blob].append(stub)
+
+    pins = {}
+    for name, group in by_blob.items():
+        data = compression.decompress(store.read(name))
+        for s in group:
+            pins[s.key.id()] = decode_record(data[s.offset:s.offset + s.length])
+    return [pins[s.key.id()] for s in stubs]
+
+
+def get_pins(key_ids, store):
+    """Gets Pins by key id, whether they are live or archived.
+
+    Args:
+        key_ids (list): Pin key ids.
+        store (GcsBlobStore or LocalBlobStore): Where the archive blobs are.
+
+    Returns:
+        list: Pins, or None for ids that don't exist, in the same order as
+        key_ids.
+    """
+    live = ndb.get_multi([ndb.Key(Pin, key_id) for key_id in key_ids])
+    missing = [key_id for key_id, pin in zip(key_ids, live) if pin is None]
+    stubs = ndb.get_multi([ndb.Key(ArchivedPin, key_id) for key_id in missing])
+    stubs = [s for s in stubs if s is not None]
+    archived = dict((p.key.id(), p) for p in hydrate(stubs, store))
+    return [pin or archived.get(key_id) for key_id, pin in zip(key_ids, live)]
+
+
+@ndb.tasklet
+def fetch_page_async(live_query, archived_query, limit, cursor, store):
+    """Fetches a page of Pins that continues from the live Pins into the
+    archived ones. Archived Pins are older than live Pins, so a listing in
+    reverse chronological order carries on into the stubs once the live Pins
+    run out. See pins4days.paging.
+
+    A Pin that is stored again after it was archived has both a Pin and a
+    stub until the next archive run. Its stub is skipped, as in get_pins().
+
+    Args:
+        live_query (callable): Pin query builder, e.g. Pin.query_all.
+        archived_query (callable): The matching ArchivedPin query builder,
+        e.g. ArchivedPin.query_all.
+        limit (int): Page size.
+        cursor (str): The cursor returned with the previous page, or None.
+        store (GcsBlobStore or LocalBlobStore): Where the archive blobs are.
+
+    Returns:
+        Future: Resolves to a tuple (list, str): the Pins and the cursor of
+        the next page, or None if this is the last one.
+    """
+    entities, cursor = yield paging.fetch_page_async(
+        [live_query, archived_query], limit, cursor)
+    pins = iter(hydrate(
+        [e for e in entities if isinstance(e, ArchivedPin)], store))
+    raise ndb.Return((
+        [next(pins) if isinstance(e, ArchivedPin) else e for e in entities],
+        cursor))
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Blob storage for archives and other generated files.
+
+Blobs are stored in Google Cloud Storage (GCS), or in a local directory when
+the 'blob_local_dir' app config is set. The local directory stands in for GCS
+on the development server, in tests and on self-hosted deployments.
+"""
+
+import errno
+import os
+
+from google.appengine.api import app_identity
+import lib.cloudstorage as gcs
+
+
+class GcsBlobStore(object):
+
+    """Stores blobs in a GCS bucket.
+
+    Attributes:
+        bucket (str): The bucket name.
+    """
+
+    def __init__(self, bucket):
+        """
+        Args:
+            bucket (str): The bucket name.
+        """
+        self.bucket = bucket
+
+    def _path(self, name):
+        return '/{}/{}'.format(self.bucket, name)
+
+    def write(self, name, data, content_type='application/octet-stream',
+              options=None):
+        """Writes a blob, replacing it if it exists.
+
+        Args:
+            name (str): The blob's name (path within the bucket).
+            data (str): The blob's contents.
+            content_type (str): The blob's content type.
+            options (dict): Optional. Extra GCS headers, e.g.
+            'content-encoding' or 'cache-control'.
+        """
+        gcs_file = gcs.open(
+            self._path(name), 'w', content_type=content_type, options=options)
+        gcs_file.write(data)
+        gcs_file.close()
+
+    def read(self, name, offset=0, length=None):
+        """Reads a blob, or a byte range of it.
+
+        Args:
+            name (str): The blob's name.
+            offset (int): First byte to read.
+            length (int): Optional. Number of bytes to read. Reads to the end
+            of the blob if None.
+
+        Returns:
+            str
+        """
+        gcs_file = gcs.open(self._path(name))
+        try:
+            gcs_file.seek(offset)
+            return gcs_file.read() if length is None else gcs_file.read(length)
+        finally:
+            gcs_file.close()
+
+
+class LocalBlobStore(object):
+
+    """Stores blobs as files in a local directory.
+
+    Attributes:
+        root (str): The directory.
+    """
+
+    def __init__(self, root):
+        """
+        Args:
+            root (str): The directory. Created on first write if needed.
+        """
+        self.root = root
+
+    def _path(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+    def write(self, name, data, content_type='application/octet-stream',
+              options=None):
+        """See GcsBlobStore.write(). content_type and options are ignored."""
+        path = self._path(name)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def read(self, name, offset=0, length=None):
+        """See GcsBlobStore.read()."""
+        with open(self._path(name), 'rb') as f:
+            f.seek(offset)
+            return f.read() if length is None else f.read(length)
+
+
+def get_blob_store(app_config):
+    """Builds the blob store selected by the app config.
+
+    Args:
+        app_config (dict): The app config. 'blob_local_dir' selects a local
+        directory; otherwise 'blob_bucket' (default: the app's default GCS
+        bucket) is used.
+
+    Returns:
+        GcsBlobStore or LocalBlobStore
+    """
+    local_dir = app_config.get('blob_local_dir')
+    if local_dir:
+        return LocalBlobStore(local_dir)
+    bucket = app_config.get('blob_bucket') or os.environ.get(
+        'BUCKET_NAME', app_identity.get_default_gcs_bucket_name())
+    return GcsBlobStore(bucket)
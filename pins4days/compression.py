@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Negotiated gzip/deflate compression of responses.
+
+init_app() compresses JSON and HTML responses for clients that accept it,
+once they are bigger than the 'gzip_min_size' app config (bytes, default
+1024), at the 'gzip_level' app config (1-9, default 6).
+
+Response bodies that are cached should be cached compressed, with
+compress(), and served with precompressed_response(). Clients that accept
+gzip then get the cached bytes as they are, so the compression is only paid
+once, when the body is cached.
+
+Attributes:
+    COMPRESSIBLE_MIMETYPES (set): Response mimetypes that get compressed.
+    DEFAULT_LEVEL (int): Compression level used if 'gzip_level' isn't set.
+    DEFAULT_MIN_SIZE (int): Smallest body, in bytes, that gets compressed if
+    'gzip_min_size' isn't set.
+"""
+
+import gzip
+import io
+import zlib
+
+from flask import request
+from flask import Response
+
+
+COMPRESSIBLE_MIMETYPES = set(['application/json', 'text/html'])
+DEFAULT_LEVEL = 6
+DEFAULT_MIN_SIZE = 1024
+
+GZIP = 'gzip'
+DEFLATE = 'deflate'
+
+
+def negotiate_encoding(accept_encodings):
+    """Picks the content encoding to use, preferring gzip.
+
+    Args:
+        accept_encodings (Accept): The request's parsed Accept-Encoding header.
+
+    Returns:
+        str or None: 'gzip', 'deflate' or None if neither is accepted.
+    """
+    for encoding in (GZIP, DEFLATE):
+        if accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def compress(data, encoding=GZIP, level=DEFAULT_LEVEL):
+    """Compresses a body.
+
+    Args:
+        data (str): The body.
+        encoding (str): 'gzip' or 'deflate'.
+        level (int): Compression level, 1-9.
+
+    Returns:
+        str: The compressed body.
+    """
+    if encoding == DEFLATE:
+        return zlib.compress(data, level)
+    buf = io.BytesIO()
+    # A fixed mtime keeps the output identical for identical bodies.
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def decompress(data, encoding=GZIP):
+    """Reverses compress().
+
+    Args:
+        data (str): The compressed body.
+        encoding (str): 'gzip' or 'deflate'.
+
+    Returns:
+        str
+    """
+    if encoding == DEFLATE:
+        return zlib.decompress(data)
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+def precompressed_response(data, mimetype, status=200):
+    """Serves a gzipped body. Clients that don't accept gzip get it
+    decompressed.
+
+    Args:
+        data (str): The body, compressed with compress(data, 'gzip').
+        mimetype (str): The body's mimetype.
+        status (int): Response status code.
+
+    Returns:
+        Response
+    """
+    if not request.accept_encodings[GZIP]:
+        return Response(decompress(data), status=status, mimetype=mimetype)
+    response = Response(data, status=status, mimetype=mimetype)
+    response.headers['Content-Encoding'] = GZIP
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    """Compresses an app's JSON and HTML responses.
+
+    Args:
+        app (Flask): The app.
+    """
+    @app.after_request
+    def compress_response(response):
+        if (response.direct_passthrough or
+                response.mimetype not in COMPRESSIBLE_MIMETYPES or
+                'Content-Encoding' in response.headers or
+                response.status_code < 200 or response.status_code >= 300):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < app.config.get('gzip_min_size', DEFAULT_MIN_SIZE):
+            return response
+
+        response.set_data(compress(
+            data, encoding, app.config.get('gzip_level', DEFAULT_LEVEL)))
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -6,6 +6,25 @@ Attributes:
     be present in the GCS_CONFIG_* files.
     KEY_FLASK_SECRET_KEY (str): The key for the Flask app secret key that must
     be present in the GCS_CONFIG_* files.
+    INGEST_MODE_PULL (str): Ingest mode that coalesces pins through the
+    pull queue. See pins4days.ingest.
+    INGEST_MODE_PUSH (str): Ingest mode that stores every pin in its own push
+    task. This is the default.
+    PRIORITY_BACKFILL (str): Priority of pins read in from existing channel
+    pins.
+    PRIORITY_LIVE (str): Priority of pins sent by the Slack events API.
+    PULL_QUEUE_INGEST (str): The pull queue that buffers pins to be stored
+    in batches. Must match queue.yaml.
+    QUEUE_ACCESS (str): Push queue for refreshing users' channel
+    memberships from Slack.
+    QUEUE_BACKFILL (str): Push queue for backfilled pins.
+    QUEUE_LIVE (str): Push queue for live pins and ingest drains.
+    QUEUE_MEDIA (str): Push queue for fetching link previews and images.
+    QUEUE_MIGRATIONS (str): Push queue for migration slices.
+    QUEUE_ROTATION (str): Push queue for unpinning the oldest pins of full
+    channels.
+    QUEUE_SNAPSHOTS (str): Push queue for rendering static snapshots of pin
+    listings.
     SLACK_AUTH_URL (str): Slack's auth URL.
     SLACK_OAUTH_URL (str): Slack's auth URL.
 """
@@ -18,3 +37,18 @@ KEY_FLASK_SECRET_KEY = 'flask_secret_key'
 
 LOCAL_APP_CONFIG_PATH_KEY = 'LOCAL_APP_CONFIG_PATH'
 REMOTE_APP_CONFIG_PATH_KEY = 'REMOTE_APP_CONFIG_PATH'
+
+INGEST_MODE_PUSH = 'push'
+INGEST_MODE_PULL = 'pull'
+
+PRIORITY_LIVE = 'live'
+PRIORITY_BACKFILL = 'backfill'
+
+QUEUE_LIVE = 'pins-live'
+QUEUE_BACKFILL = 'pins-backfill'
+QUEUE_MIGRATIONS = 'migrations'
+QUEUE_MEDIA = 'media'
+QUEUE_ROTATION = 'pins-rotation'
+QUEUE_ACCESS = 'access'
+QUEUE_SNAPSHOTS = 'snapshots'
+PULL_QUEUE_INGEST = 'pin-ingest-pull'
@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""Per-channel digests: pin counts per week and per month.
+
+Every stored pin is added to the Digest of its channel's week and month as
+it is ingested (see record_async()), so aggregated views such as the top
+pinned authors of the month, pins per channel per week or the most linked
+domains are read from a handful of Digest entities instead of scanning Pin.
+
+Every counted pin leaves a DigestMark under the Digest, so that storing a
+pin again doesn't count it twice. Reading a Digest never reads its marks.
+
+Incremental updates are best effort: a Digest transaction that fails is
+logged and skipped. The worker therefore rebuilds the recent buckets from
+Pin every night (see reconcile()). Buckets of pins that were archived (see
+pins4days.archive) are left as they are, since the archive only keeps the
+properties needed to list pins.
+
+Attributes:
+    DEFAULT_BUCKETS (int): Number of buckets returned by query_digests() if
+    not specified.
+    DEFAULT_RECONCILE_DAYS (int): Number of days of pins rebuilt by
+    reconcile() if the 'digest_reconcile_days' app config isn't set.
+    DEFAULT_TOP (int): Number of authors, pinners and domains listed per
+    bucket by query_digests() if not specified.
+    MAX_BUCKETS (int): Most buckets served by a single /api/digests request.
+    PERIODS (tuple): The bucket periods.
+"""
+
+import calendar
+import collections
+import logging
+import time
+import urlparse
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.ext import ndb
+
+from pins4days.models.digest import Digest
+from pins4days.models.digest import DigestMark
+from pins4days.models.pin import Pin
+
+
+PERIOD_WEEK = 'week'
+PERIOD_MONTH = 'month'
+PERIODS = (PERIOD_WEEK, PERIOD_MONTH)
+
+DEFAULT_BUCKETS = 12
+DEFAULT_RECONCILE_DAYS = 35
+DEFAULT_TOP = 10
+MAX_BUCKETS = 104
+
+_DAY = 24 * 60 * 60
+
+
+def bucket_start(period, ts):
+    """Finds the start of the bucket a timestamp falls in. Weeks start on
+    Monday, and all buckets start at midnight UTC.
+
+    Args:
+        period (str): 'week' or 'month'.
+        ts (int): The timestamp.
+
+    Returns:
+        int: Timestamp of the start of the bucket.
+    """
+    day = datetime.utcfromtimestamp(ts).date()
+    if period == PERIOD_WEEK:
+        day -= timedelta(days=day.weekday())
+    else:
+        day = day.replace(day=1)
+    return calendar.timegm(day.timetuple())
+
+
+def next_start(period, start):
+    """
+    Args:
+        period (str): 'week' or 'month'.
+        start (int): Start of a bucket.
+
+    Returns:
+        int: Start of the following bucket.
+    """
+    if period == PERIOD_WEEK:
+        return start + 7 * _DAY
+    day = datetime.utcfromtimestamp(start).date()
+    day = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return calendar.timegm(day.timetuple())
+
+
+def previous_start(period, start):
+    """
+    Args:
+        period (str): 'week' or 'month'.
+        start (int): Start of a bucket.
+
+    Returns:
+        int: Start of the preceding bucket.
+    """
+    return bucket_start(period, start - _DAY)
+
+
+def bucket_label(period, start):
+    """
+    Args:
+        period (str): 'week' or 'month'.
+        start (int): Start of a bucket.
+
+    Returns:
+        str: E.g. '2018-05-07' for a week, '2018-05' for a month.
+    """
+    fmt = '%Y-%m-%d' if period == PERIOD_WEEK else '%Y-%m'
+    return time.strftime(fmt, time.gmtime(start))
+
+
+def domain_of(url):
+    """Extracts the domain of an attachment link.
+
+    Args:
+        url (str): The link.
+
+    Returns:
+        str or None: The lowercased host without 'www.', or None if the link
+        has no host.
+    """
+    host = urlparse.urlsplit(url or '').hostname
+    if not host:
+        return None
+    return host[4:] if host.startswith('www.') else host
+
+
+def digest_key(pin, period):
+    """Builds the key of the Digest a Pin is counted in.
+
+    Args:
+        pin (Pin): The Pin. Must have a created_ts.
+        period (str): 'week' or 'month'.
+
+    Returns:
+        Key
+    """
+    label = bucket_label(period, bucket_start(period, pin.created_ts))
+    return ndb.Key(
+        Digest, Digest.build_key_id(period, label, pin.channel_id),
+        namespace=pin.key.namespace())
+
+
+def mark_key(key, pin):
+    """Builds the key of the DigestMark of a Pin counted in a Digest.
+
+    Args:
+        key (Key): The Digest's key, see digest_key().
+        pin (Pin): The Pin.
+
+    Returns:
+        Key
+    """
+    return ndb.Key(DigestMark, pin.key.id(), parent=key)
+
+
+def new_digest(key, pin, period):
+    """Creates an empty Digest for the bucket of a Pin.
+
+    Args:
+        key (Key): The Digest's key, see digest_key().
+        pin (Pin): A Pin of the bucket.
+        period (str): 'week' or 'month'.
+
+    Returns:
+        Digest
+    """
+    return Digest(
+        key=key,
+        channel_id=pin.channel_id,
+        period=period,
+        start=bucket_start(period, pin.created_ts),
+        authors={},
+        pinners={},
+        domains={})
+
+
+def _increment(counts, key):
+    if key:
+        counts[key] = counts.get(key, 0) + 1
+
+
+def add_pin(digest, pin):
+    """Counts a Pin in a Digest. Callers check the Pin's DigestMark first.
+
+    Args:
+        digest (Digest): The Digest of the Pin's bucket.
+        pin (Pin): The Pin.
+    """
+    digest.count += 1
+    _increment(digest.authors, pin.author_id)
+    _increment(digest.pinners, pin.pinner_id)
+    for attachment in pin.attachments:
+        _increment(digest.domains, domain_of(attachment.original_url))
+
+
+def _group_by_digest(pins):
+    groups = collections.OrderedDict()
+    for pin in pins:
+        if pin.created_ts is None or not pin.channel_id:
+            continue
+        for period in PERIODS:
+            key = digest_key(pin, period)
+            groups.setdefault(key, (period, collections.OrderedDict()))[1][
+                pin.key.id()] = pin
+    return groups
+
+
+@ndb.tasklet
+def _update_digest_async(key, period, pins):
+    @ndb.tasklet
+    def txn():
+        mark_keys = [mark_key(key, pin) for pin in pins]
+        entities = yield ndb.get_multi_async([key] + mark_keys)
+        digest, marks = entities[0], entities[1:]
+        new = [pin for pin, mark in zip(pins, marks) if mark is None]
+        if not new:
+            return
+        if digest is None:
+            digest = new_digest(key, pins[0], period)
+        for pin in new:
+            add_pin(digest, pin)
+        yield ndb.put_multi_async(
+            [digest] + [DigestMark(key=mark_key(key, pin)) for pin in new])
+
+    try:
+        yield ndb.transaction_async(txn)
+    except Exception:
+        logging.warning(
+            'Could not update digest %s, leaving it to reconcile().',
+            key.id(), exc_info=True)
+
+
+@ndb.tasklet
+def record_async(pins):
+    """Counts newly stored Pins in the Digests of their channels' weeks and
+    months. Each Digest is updated in its own transaction, once per call, so
+    storing a batch of Pins costs one transaction per bucket rather than per
+    Pin.
+
+    Args:
+        pins (list): The stored Pins.
+
+    Returns:
+        Future
+    """
+    groups = _group_by_digest(pins)
+    yield [
+        _update_digest_async(key, period, group.values())
+        for key, (period, group) in groups.items()
+    ]
+
+
+@ndb.tasklet
+def _rebuild_digest_async(key, period, pins):
+    # Pins that were marked but aren't in the bucket (any more).
+    dropped = set()
+
+    @ndb.tasklet
+    def txn():
+        marks = yield DigestMark.query(ancestor=key).fetch_async(keys_only=True)
+        marked = set(k.id() for k in marks)
+        unknown = marked - set(pins) - dropped
+        if unknown:
+            raise ndb.Return(unknown)
+        if not pins:
+            yield ndb.delete_multi_async([key] + marks)
+            raise ndb.Return(set())
+        digest = None
+        for pin in pins.values():
+            digest = digest or new_digest(key, pin, period)
+            add_pin(digest, pin)
+        yield (
+            ndb.put_multi_async([digest] + [
+                DigestMark(key=mark_key(key, pin))
+                for key_id, pin in pins.items() if key_id not in marked
+            ]),
+            ndb.delete_multi_async([k for k in marks if k.id() in dropped]))
+        raise ndb.Return(set())
+
+    while True:
+        unknown = yield ndb.transaction_async(txn)
+        if not unknown:
+            raise ndb.Return(bool(pins))
+        # Counted by record_async() since the Pins were queried, or no longer
+        # stored in this bucket.
+        unknown = sorted(unknown)
+        fetched = yield ndb.get_multi_async([
+            ndb.Key(Pin, key_id, namespace=key.namespace())
+            for key_id in unknown
+        ])
+        for key_id, pin in zip(unknown, fetched):
+            if (pin is not None and pin.channel_id and
+                    pin.created_ts is not None and
+                    digest_key(pin, period) == key):
+                pins[key_id] = pin
+            else:
+                dropped.add(key_id)
+
+
+def rebuild(since, batch_size=500):
+    """Rebuilds the Digests of the current namespace from Pin, and their
+    DigestMarks, for every bucket starting at or after a timestamp.
+
+    Each Digest is rebuilt in a transaction on its entity group, like
+    record_async() updates it. Pins counted by record_async() after the Pins
+    were queried still have their DigestMarks, and are counted too.
+
+    Args:
+        since (int): Start of the rebuilt range. Buckets that start earlier
+        are left alone.
+        batch_size (int): Query batch size.
+
+    Returns:
+        int: Number of Digests written.
+    """
+    starts = dict((p, bucket_start(p, since)) for p in PERIODS)
+    for period, start in starts.items():
+        if start < since:
+            starts[period] = next_start(period, start)
+
+    buckets = collections.OrderedDict()
+    query = Pin.query_created_since(min(starts.values()))
+    for pin in query.iter(batch_size=batch_size):
+        if pin.channel_id is None:
+            continue
+        for period in PERIODS:
+            if pin.created_ts < starts[period]:
+                continue
+            buckets.setdefault(
+                digest_key(pin, period), (period, collections.OrderedDict())
+            )[1][pin.key.id()] = pin
+
+    for period, start in starts.items():
+        for key in Digest.query_period(period, start).fetch(keys_only=True):
+            buckets.setdefault(key, (period, collections.OrderedDict()))
+    futures = [
+        _rebuild_digest_async(key, period, pins)
+        for key, (period, pins) in buckets.items()
+    ]
+    return len([f for f in futures if f.get_result()])
+
+
+def reconcile(app_config, now=None):
+    """Rebuilds the recent Digests of the current namespace. Runs nightly,
+    see worker.py.
+
+    Args:
+        app_config (dict): The app config. 'digest_reconcile_days' sets how
+        many days are rebuilt. The range never reaches back past
+        'archive_after_days', since archived pins can't be recounted.
+        now (int): Optional. The current timestamp.
+
+    Returns:
+        int: Number of Digests written.
+    """
+    now = int(now or time.time())
+    days = int(app_config.get('digest_reconcile_days', DEFAULT_RECONCILE_DAYS))
+    since = now - days * _DAY
+    archive_after_days = app_config.get('archive_after_days')
+    if archive_after_days:
+        since = max(since, now - int(archive_after_days) * _DAY)
+    written = rebuild(since)
+    logging.info('Rebuilt %d digests since %d.', written, since)
+    return written
+
+
+def _top(counts, top):
+    return sorted(counts.items(), key=lambda c: (-c[1], c[0]))[:top]
+
+
+def query_digests(period, buckets=DEFAULT_BUCKETS, channel_id=None,
+                  top=DEFAULT_TOP, now=None, channel_ids=None):
+    """Fetches the latest buckets of a period. Only Digest entities are read,
+    so the cost grows with the number of buckets (times channels), not pins.
+
+    Args:
+        period (str): 'week' or 'month'.
+        buckets (int): Number of buckets, counting back from the current one.
+        channel_id (str): Optional. Only report this channel. Otherwise the
+        channels of each bucket are added up.
+        top (int): Number of authors, pinners and domains listed per bucket.
+        now (int): Optional. The current timestamp.
+        channel_ids (iterable): Optional. Only count these channels, e.g. the
+        ones a user may see. See pins4days.access.
+
+    Returns:
+        list: JSON friendly dicts, one per bucket that has pins, newest
+        first.
+    """
+    since = bucket_start(period, int(now or time.time()))
+    for _ in range(buckets - 1):
+        since = previous_start(period, since)
+
+    merged = collections.OrderedDict()
+    for digest in Digest.query_period(period, since, channel_id):
+        if channel_ids is not None and digest.channel_id not in channel_ids:
+            continue
+        bucket = merged.get(digest.start)
+        if bucket is None:
+            bucket = merged[digest.start] = {
+                'start': digest.start,
+                'bucket': bucket_label(period, digest.start),
+                'count': 0,
+                'channels': {},
+                'authors': collections.Counter(),
+                'pinners': collections.Counter(),
+                'domains': collections.Counter()
+            }
+        bucket['count'] += digest.count
+        bucket['channels'][digest.channel_id] = digest.count
+        for field in ('authors', 'pinners', 'domains'):
+            bucket[field].update(getattr(digest, field) or {})
+
+    for bucket in merged.values():
+        for field in ('authors', 'pinners', 'domains'):
+            bucket[field] = _top(bucket[field], top)
+    return merged.values()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Verified Slack identities ("Sign in with Slack").
+
+A user's Slack team ID decides which workspace's pins they see (see
+pins4days.tenants), and their Slack user ID which channels' pins they see
+when channel access control is on (see pins4days.access). Both must come
+from Slack, never from the user. A logged in user links their Slack account
+through Slack's OAuth flow with the identity.basic scope:
+
+1. /slack/connect stores a random state in the session and redirects to
+   authorize_url(),
+2. Slack sends the user back to /slack/connect/callback with a code and the
+   state,
+3. verify() exchanges the code for the user's identity (oauth.access), and
+   the team and user IDs that Slack returns are stored on the User (see
+   User.slack_verified).
+
+Team and user IDs stored before identities were verified are ignored (see
+session_identity()) until the user links their Slack account.
+
+Requires the 'slack_client_id' and 'slack_client_secret' app config of a
+Slack app that has the callback URL as a redirect URL.
+
+Attributes:
+    SCOPE (str): The OAuth scope requested from Slack.
+"""
+
+import hmac
+import os
+import urllib
+
+from pins4days.constants import SLACK_AUTH_URL
+from pins4days.utils import get_oauth_access_async
+
+
+SCOPE = 'identity.basic'
+
+
+class IdentityException(Exception):
+    """Should be thrown when Slack doesn't confirm a user's identity."""
+    pass
+
+
+def is_configured(app_config):
+    """
+    Args:
+        app_config (dict): The app config.
+
+    Returns:
+        bool: True if users can link their Slack accounts.
+    """
+    return bool(
+        app_config.get('slack_client_id') and
+        app_config.get('slack_client_secret'))
+
+
+def new_state():
+    """
+    Returns:
+        str: A random OAuth state, to be kept in the session.
+    """
+    return os.urandom(16).encode('hex')
+
+
+def check_state(expected, received):
+    """Compares the OAuth state Slack sent back with the session's, in
+    constant time.
+
+    Args:
+        expected (str or None): The session's state.
+        received (str or None): The state Slack sent back.
+
+    Returns:
+        bool
+    """
+    if not expected or not received:
+        return False
+    return hmac.compare_digest(str(expected), str(received))
+
+
+def authorize_url(app_config, state, redirect_uri):
+    """
+    Args:
+        app_config (dict): The app config.
+        state (str): The session's OAuth state, see new_state().
+        redirect_uri (str): Where Slack sends the user back to.
+
+    Returns:
+        str: The Slack URL that asks the user to share their identity.
+    """
+    return SLACK_AUTH_URL + '?' + urllib.urlencode([
+        ('client_id', app_config['slack_client_id']),
+        ('scope', SCOPE),
+        ('state', state),
+        ('redirect_uri', redirect_uri),
+    ])
+
+
+def verify(app_config, code, redirect_uri):
+    """Asks Slack whose identity an OAuth code was issued for.
+
+    Args:
+        app_config (dict): The app config.
+        code (str): The code Slack sent the user back with.
+        redirect_uri (str): The redirect URI passed to authorize_url().
+
+    Returns:
+        tuple: (str, str) the user's Slack team ID and Slack user ID.
+
+    Raises:
+        IdentityException: Thrown if Slack doesn't confirm the identity.
+    """
+    try:
+        response = get_oauth_access_async(
+            code, app_config['slack_client_id'],
+            app_config['slack_client_secret'], redirect_uri).get_result()
+    except Exception as e:
+        raise IdentityException(str(e))
+    if not response.get('ok'):
+        raise IdentityException(
+            'oauth.access failed: {}'.format(response.get('error')))
+    try:
+        return response['team']['id'], response['user']['id']
+    except (KeyError, TypeError):
+        raise IdentityException('oauth.access returned no identity.')
+
+
+def session_identity(user):
+    """Builds the Slack identity kept in a user's session.
+
+    Args:
+        user (User or None): The user.
+
+    Returns:
+        dict: The 'team_id' and 'user_id' of the user's verified Slack
+        identity, both None if the user hasn't linked their Slack account.
+    """
+    if user is None or not getattr(user, 'slack_verified', False):
+        return {'team_id': None, 'user_id': None}
+    return {'team_id': user.team_id, 'user_id': user.slack_user_id}
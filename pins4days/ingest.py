@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""Enqueues Slack pins for storage and stores them in batches.
+
+Pins can be ingested in one of two modes, selected with the 'ingest_mode'
+app config value:
+
+- 'push' (default): every pin gets its own push task, and the worker service
+  stores it with its own put().
+- 'pull': pins are added to a pull queue. A worker leases hundreds of them at
+  a time, drops duplicates, stores them with a single ndb.put_multi() and
+  deletes the leased tasks in bulk. This keeps up with bursts, e.g. a backfill
+  overlapping with live pin events.
+
+Every pin is enqueued with a priority. In push mode, live pins and backfilled
+pins go to separate queues (see queue.yaml) so that a large backfill can't
+starve live events. In pull mode, tasks are tagged with their priority and
+live pins are leased first.
+
+Link previews are split off the pins and stored once per link (see
+pins4days.links), and every stored pin is counted in its channel's digests
+(see pins4days.digests).
+
+Pins are stored in the namespace that was current when they were enqueued
+(see pins4days.tenants). Push tasks carry it in a request header, pull tasks
+in their payload. Pull tasks without one are stored in the default namespace.
+
+Attributes:
+    DRAIN_KICK_INTERVAL (int): Seconds covered by each named drain task.
+    Enqueueing many pins within the interval only kicks off a single drain.
+    LEASE_SECONDS (int): How long leased tasks stay invisible to other
+    workers. Tasks that aren't deleted by then are leased again.
+    MAX_LEASE_TASKS (int): Maximum number of tasks leased at once.
+"""
+
+import json
+import logging
+import time
+
+from google.appengine.api import namespace_manager
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from pins4days import digests
+from pins4days import links
+from pins4days import snapshots
+from pins4days.constants import INGEST_MODE_PULL
+from pins4days.constants import PRIORITY_BACKFILL
+from pins4days.constants import PRIORITY_LIVE
+from pins4days.constants import PULL_QUEUE_INGEST
+from pins4days.constants import QUEUE_BACKFILL
+from pins4days.constants import QUEUE_LIVE
+from pins4days.event import PinnedMessage
+
+
+LEASE_SECONDS = 60
+MAX_LEASE_TASKS = 1000
+DRAIN_KICK_INTERVAL = 10
+
+PUSH_QUEUES = {
+    PRIORITY_LIVE: QUEUE_LIVE,
+    PRIORITY_BACKFILL: QUEUE_BACKFILL,
+}
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def enqueue_pins_async(pins, mode, priority=PRIORITY_LIVE, countdown=0):
+    """Enqueues Slack pins (pin_added events or pins.list items) to be
+    stored by the worker service, in the current namespace.
+
+    Args:
+        pins (list): dicts as sent by the Slack events API or returned by
+        pins.list.
+        mode (str): One of the INGEST_MODE_* constants.
+        priority (str): One of the PRIORITY_* constants.
+        countdown (int): Seconds to hold the tasks back for. See
+        pins4days.tenants.Tenant.enqueue_delay().
+
+    Returns:
+        list: Futures for the task queue RPCs. These aren't ndb futures, so
+        ndb.toplevel doesn't wait for them; callers must call get_result() on
+        each before reporting the pins as accepted.
+    """
+    if mode == INGEST_MODE_PULL:
+        queue = taskqueue.Queue(PULL_QUEUE_INGEST)
+        namespace = namespace_manager.get_namespace()
+        tasks = [
+            taskqueue.Task(
+                payload=json.dumps({'namespace': namespace, 'pin': pin}),
+                method='PULL',
+                tag=priority,
+                countdown=countdown)
+            for pin in pins
+        ]
+    else:
+        queue = taskqueue.Queue(PUSH_QUEUES[priority])
+        tasks = [
+            taskqueue.Task(
+                url='/worker/create_pin',
+                target='worker',
+                payload=json.dumps(pin),
+                method='POST',
+                countdown=countdown)
+            for pin in pins
+        ]
+    futures = [
+        queue.add_async(batch)
+        for batch in _batches(tasks, taskqueue.MAX_TASKS_PER_ADD)
+    ]
+    if mode == INGEST_MODE_PULL and tasks:
+        kick_drain(countdown)
+    return futures
+
+
+def kick_drain(countdown=0):
+    """Enqueues a push task that drains the pull queue. The task is named
+    after the current DRAIN_KICK_INTERVAL so that a burst of enqueues only
+    starts one drain.
+
+    A drain for tasks that are held back runs at the end of the interval in
+    which they become leasable, and is named after that interval instead, so
+    that it drains every task held back until then.
+
+    Args:
+        countdown (int): Seconds the pulled tasks are held back for.
+    """
+    now = int(time.time())
+    if countdown:
+        interval = (now + countdown) // DRAIN_KICK_INTERVAL + 1
+        task_name = 'ingest-drain-delayed-{}'.format(interval)
+        countdown = interval * DRAIN_KICK_INTERVAL - now
+    else:
+        task_name = 'ingest-drain-{}'.format(now // DRAIN_KICK_INTERVAL)
+    try:
+        taskqueue.add(
+            name=task_name,
+            queue_name=QUEUE_LIVE,
+            url='/worker/ingest/drain',
+            target='worker',
+            method='POST',
+            countdown=countdown)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+@ndb.tasklet
+def store_async(pins):
+    """Stores Pins, and their link previews alongside them, and then counts
+    them in their digests and schedules renders of their static snapshots.
+
+    Args:
+        pins (list): The Pins.
+
+    Returns:
+        Future
+    """
+    previews = links.extract(pins)
+    yield ndb.put_multi_async(pins), links.save_async(previews)
+    yield digests.record_async(pins)
+    snapshots.schedule(pins)
+
+
+def lease_and_store(max_tasks=MAX_LEASE_TASKS, lease_seconds=LEASE_SECONDS):
+    """Leases a batch of pins from the pull queue and stores them. Live pins
+    are leased first, and the rest of the batch is filled with backfilled
+    pins.
+
+    Pins that appear more than once in the batch (e.g. the same message
+    pinned by a live event and by a backfill) are written once. Tasks whose
+    payload can't be turned into a Pin are logged and deleted so that they
+    don't get leased forever.
+
+    Args:
+        max_tasks (int): Maximum number of tasks to lease.
+        lease_seconds (int): How long the tasks stay leased.
+
+    Returns:
+        tuple: (int, int) number of tasks leased and number of Pins written.
+    """
+    queue = taskqueue.Queue(PULL_QUEUE_INGEST)
+    tasks = queue.lease_tasks_by_tag(lease_seconds, max_tasks, tag=PRIORITY_LIVE)
+    if len(tasks) < max_tasks:
+        tasks += queue.lease_tasks_by_tag(
+            lease_seconds, max_tasks - len(tasks), tag=PRIORITY_BACKFILL)
+    if not tasks:
+        return 0, 0
+
+    pins = {}
+    namespace = namespace_manager.get_namespace()
+    try:
+        for task in tasks:
+            try:
+                data = json.loads(task.payload)
+                namespace_manager.set_namespace(data['namespace'])
+                pin = PinnedMessage.factory(data['pin'])
+            except (ValueError, KeyError, TypeError, NotImplementedError):
+                logging.exception('Dropping malformed pin task %s.', task.name)
+                continue
+            pins[pin.key] = pin
+    finally:
+        namespace_manager.set_namespace(namespace)
+
+    store_async(pins.values()).get_result()
+    queue.delete_tasks(tasks)
+    return len(tasks), len(pins)
+
+
+def drain(time_budget=LEASE_SECONDS / 2):
+    """Leases and stores batches until the pull queue is empty or the time
+    budget runs out. If pins are left over, another drain is kicked off.
+
+    Args:
+        time_budget (float): Seconds this call may keep leasing new batches.
+        This should stay well below LEASE_SECONDS so that leased tasks are
+        deleted before their lease expires.
+
+    Returns:
+        tuple: (int, int) number of tasks leased and number of Pins written.
+    """
+    deadline = time.time() + time_budget
+    leased = written = 0
+    while True:
+        batch_leased, batch_written = lease_and_store()
+        leased += batch_leased
+        written += batch_written
+        if batch_leased < MAX_LEASE_TASKS:
+            break
+        if time.time() >= deadline:
+            kick_drain()
+            break
+    logging.info('Drained %d pin tasks into %d pins.', leased, written)
+    return leased, written
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""Shared link previews.
+
+Slack sends the preview of a link (its text and image) with every message
+that contains it, so the same link pinned in many channels used to be stored
+again inside every Pin. Previews now live in the Link kind instead, keyed by
+a hash of the normalised link. A stored Attachment only keeps original_url;
+its other fields are filled in from the Link when Pins are rendered (see
+resolve_async()).
+
+PinnedMessage.factory() still builds complete Attachments, as Slack sent
+them. extract() splits the previews off right before the Pins are stored
+(see pins4days.ingest.store_async()). Attachments without an original_url
+are stored as they are, and so are Attachments stored before previews were
+shared; resolve_async() leaves both alone.
+
+Links whose preview is missing or older than REFRESH_DAYS are fetched again
+by the worker service, on the media queue (see refresh()). Every Pin with
+that link picks up the new preview. Encoded Pins cached by
+pins4days.serializers are keyed by the version of their Links too, so they
+don't outlive a refresh.
+
+Attributes:
+    FETCH_DEADLINE (int): Seconds allowed for fetching a link.
+    MAX_HTML_SIZE (int): Bytes of a page searched for preview metadata.
+    MAX_TEXT_LENGTH (int): Longest preview text kept, in characters.
+    PREVIEW_FIELDS (tuple): Attachment properties that live in Links.
+    REFRESH_DAYS (int): Age, in days, at which a preview is fetched again.
+"""
+
+import hashlib
+import logging
+import re
+import time
+import urllib
+import urlparse
+from datetime import datetime
+from datetime import timedelta
+from HTMLParser import HTMLParser
+
+from google.appengine.api import namespace_manager
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from pins4days.constants import QUEUE_MEDIA
+from pins4days import serializers
+from pins4days.models.link import Link
+
+
+FETCH_DEADLINE = 10
+MAX_HTML_SIZE = 256 * 1024
+MAX_TEXT_LENGTH = 1000
+REFRESH_DAYS = 30
+
+PREVIEW_FIELDS = ('from_url', 'image_url', 'text')
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+_META_TAG = re.compile(r'<meta\s[^>]*>', re.I)
+_ATTRIBUTE = re.compile(r'([\w:-]+)\s*=\s*("[^"]*"|\'[^\']*\')')
+_IMAGE_META = ('og:image', 'twitter:image')
+_TEXT_META = ('og:description', 'twitter:description', 'description')
+
+
+def normalise_url(url):
+    """Normalises a link so that trivially different spellings of it share a
+    preview. The scheme and host are lowercased, default ports, fragments
+    and 'utm_*' tracking params are dropped.
+
+    Args:
+        url (unicode): The link.
+
+    Returns:
+        unicode
+    """
+    parts = urlparse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        netloc += ':{}'.format(parts.port)
+    query = '&'.join(
+        p for p in parts.query.split('&')
+        if p and not p.lower().startswith('utm_'))
+    return urlparse.urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def link_id(url):
+    """Builds the key id of a link's Link.
+
+    Args:
+        url (unicode): The link, normalised or not.
+
+    Returns:
+        str: The SHA-1 hex digest of the normalised link.
+    """
+    return hashlib.sha1(normalise_url(url).encode('utf-8')).hexdigest()
+
+
+def link_key(url, namespace=None):
+    """
+    Args:
+        url (unicode): The link.
+        namespace (str): Optional. Defaults to the current namespace.
+
+    Returns:
+        Key: The key of the link's Link.
+    """
+    return ndb.Key(Link, link_id(url), namespace=namespace)
+
+
+def is_reference(attachment):
+    """
+    Args:
+        attachment (Attachment): An Attachment.
+
+    Returns:
+        bool: True if the Attachment's preview lives in a Link.
+    """
+    return bool(attachment.original_url) and not any(
+        getattr(attachment, f) for f in PREVIEW_FIELDS)
+
+
+def extract(pins):
+    """Moves the link previews of Pins that are about to be stored into
+    Links. The previews are removed from the Pins' Attachments.
+
+    Args:
+        pins (list): The Pins.
+
+    Returns:
+        dict: The Links, by key. Not stored yet, see save_async().
+    """
+    links = {}
+    for pin in pins:
+        for attachment in pin.attachments:
+            if not attachment.original_url or is_reference(attachment):
+                continue
+            key = link_key(attachment.original_url, pin.key.namespace())
+            if key not in links or not links[key].has_preview:
+                links[key] = Link(
+                    key=key,
+                    url=normalise_url(attachment.original_url),
+                    from_url=attachment.from_url,
+                    image_url=attachment.image_url,
+                    text=attachment.text)
+            for field in PREVIEW_FIELDS:
+                setattr(attachment, field, None)
+    return links
+
+
+def _is_stale(link):
+    checked = link.fetched or link.updated
+    return checked is None or (
+        datetime.utcnow() - checked > timedelta(days=REFRESH_DAYS))
+
+
+@ndb.tasklet
+def save_async(links):
+    """Stores the Links extracted from new Pins. Links that are already
+    stored are only written again if they had no preview and now have one,
+    so pinning a known link costs a single batched read.
+
+    Links that still have no preview, or whose stored preview is stale, are
+    queued for a refresh.
+
+    Args:
+        links (dict): Links by key, as returned by extract().
+
+    Returns:
+        Future
+    """
+    if not links:
+        return
+    keys = links.keys()
+    stored = yield ndb.get_multi_async(keys)
+    to_put = []
+    to_refresh = []
+    for key, link in zip(keys, stored):
+        new = links[key]
+        if link is None or (new.has_preview and not link.has_preview):
+            # A preview that was just extracted is fresh.
+            to_put.append(new)
+            if not new.has_preview:
+                to_refresh.append(key)
+        elif not link.has_preview or _is_stale(link):
+            to_refresh.append(key)
+    yield ndb.put_multi_async(to_put)
+    for key in to_refresh:
+        enqueue_refresh(key)
+
+
+@ndb.tasklet
+def resolve_async(pins):
+    """Fills in the previews of the Pins' Attachments from their Links, with
+    one batched read. Meant for rendering: the Pins must not be stored
+    again afterwards. Sets each Pin's links_version to the version of the
+    newest Link it was filled in from, see
+    pins4days.serializers.links_version_of().
+
+    Args:
+        pins (list): The Pins.
+
+    Returns:
+        Future: Resolves to the Pins.
+    """
+    attachments = {}
+    for pin in pins:
+        for attachment in pin.attachments:
+            if is_reference(attachment):
+                key = link_key(attachment.original_url, pin.key.namespace())
+                attachments.setdefault(key, []).append((pin, attachment))
+    if attachments:
+        keys = attachments.keys()
+        links = yield ndb.get_multi_async(keys)
+        for key, link in zip(keys, links):
+            if link is None:
+                continue
+            version = serializers.version_of(link)
+            for pin, attachment in attachments[key]:
+                for field in PREVIEW_FIELDS:
+                    setattr(attachment, field, getattr(link, field))
+                pin.links_version = max(
+                    version, serializers.links_version_of(pin))
+    raise ndb.Return(pins)
+
+
+def enqueue_refresh(key):
+    """Enqueues a refresh of a Link on the media queue. The task is named
+    after the Link and the day, so that a link pinned in many channels is
+    only fetched once a day.
+
+    Args:
+        key (Key): The Link's key.
+    """
+    namespace = re.sub(r'[^0-9A-Za-z_-]', '_', key.namespace() or '_')
+    task_name = 'link-{}-{}-{}'.format(
+        namespace, key.id(), int(time.time()) // (24 * 60 * 60))
+    current = namespace_manager.get_namespace()
+    try:
+        namespace_manager.set_namespace(key.namespace())
+        taskqueue.add(
+            name=task_name,
+            queue_name=QUEUE_MEDIA,
+            url='/worker/links/{}/refresh'.format(key.id()),
+            target='worker',
+            method='POST')
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+    finally:
+        namespace_manager.set_namespace(current)
+
+
+def parse_preview(html):
+    """Extracts the preview image and text of a page from its meta tags,
+    e.g. <meta property="og:image" content="...">.
+
+    Args:
+        html (str): The page.
+
+    Returns:
+        tuple: (unicode or None, unicode or None) the image URL and text.
+    """
+    meta = {}
+    parser = HTMLParser()
+    for tag in _META_TAG.findall(html[:MAX_HTML_SIZE]):
+        attributes = dict(
+            (name.lower(), value[1:-1])
+            for name, value in _ATTRIBUTE.findall(tag))
+        name = (attributes.get('property') or attributes.get('name') or '').lower()
+        if name and 'content' in attributes and name not in meta:
+            meta[name] = parser.unescape(
+                attributes['content'].decode('utf-8', 'replace'))
+    image_url = next((meta[n] for n in _IMAGE_META if meta.get(n)), None)
+    text = next((meta[n] for n in _TEXT_META if meta.get(n)), None)
+    return image_url, text[:MAX_TEXT_LENGTH] if text else None
+
+
+def refresh(key_id):
+    """Fetches a link again and updates its Link's preview. Links to images
+    become their own preview image. Called by the worker service.
+
+    Args:
+        key_id (str): The Link's key id.
+
+    Returns:
+        Link or None: The Link, or None if it doesn't exist.
+    """
+    link = Link.get_by_id(key_id)
+    if link is None:
+        return None
+
+    context = ndb.get_context()
+    url = urllib.quote(link.url.encode('utf-8'), safe=":/?&=%#;,+@!$'()*~")
+    result = context.urlfetch(
+        url, deadline=FETCH_DEADLINE, follow_redirects=True).get_result()
+    link.fetched = datetime.utcnow()
+    if result.status_code == 200:
+        content_type = result.headers.get('content-type', '').lower()
+        if content_type.startswith('image/'):
+            link.image_url = link.url
+        elif content_type.startswith('text/html'):
+            image_url, text = parse_preview(result.content)
+            link.image_url = image_url or link.image_url
+            link.text = text or link.text
+        link.from_url = link.from_url or link.url
+    else:
+        logging.info(
+            'Link %s returned %d, keeping its preview.', key_id,
+            result.status_code)
+    link.put()
+    # Drops cached responses, which may show the old preview.
+    serializers.invalidate_async().get_result()
+    return link
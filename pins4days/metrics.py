@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""Request-level performance instrumentation.
+
+init_app() adds Flask hooks that record, for every request:
+
+- wall time per route
+- count and latency of each App Engine RPC service (datastore_v3, memcache,
+  urlfetch, taskqueue, ...), collected with an apiproxy hook
+- memcache get hit ratio, which includes ndb's global cache lookups
+- response payload size
+
+Each request is written out as a structured 'request_metrics' log line, and
+kept in a rolling window per route so that the metrics endpoint can report
+percentiles. The window is per instance.
+
+Attributes:
+    PERCENTILES (tuple): Percentiles reported by summary().
+    WINDOW_SIZE (int): Number of requests per route kept for percentiles.
+"""
+
+import collections
+import json
+import logging
+import threading
+import time
+
+from flask import jsonify
+from flask import request
+from google.appengine.api import apiproxy_stub_map
+
+
+WINDOW_SIZE = 1000
+PERCENTILES = (50, 90, 99)
+
+_HOOK_KEY = 'pins4days_metrics'
+
+_local = threading.local()
+_lock = threading.Lock()
+_samples = collections.defaultdict(
+    lambda: collections.deque(maxlen=WINDOW_SIZE))
+
+
+class RequestStats(object):
+
+    """RPC accounting for a single request.
+
+    Attributes:
+        cache_hits (int): Number of keys found by memcache gets.
+        cache_lookups (int): Number of keys looked up by memcache gets.
+        rpcs (dict): Maps an RPC service name to a [count, total ms] pair.
+        start (float): When the request started.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.rpcs = collections.defaultdict(lambda: [0, 0.0])
+        self.cache_lookups = 0
+        self.cache_hits = 0
+        self._pending = {}
+
+    def rpc_started(self, rpc_id):
+        self._pending[rpc_id] = time.time()
+
+    def rpc_finished(self, rpc_id, service):
+        started = self._pending.pop(rpc_id, None)
+        stats = self.rpcs[service]
+        stats[0] += 1
+        if started is not None:
+            stats[1] += (time.time() - started) * 1000
+
+    @property
+    def cache_hit_ratio(self):
+        if not self.cache_lookups:
+            return None
+        return float(self.cache_hits) / self.cache_lookups
+
+
+def _current_stats():
+    return getattr(_local, 'stats', None)
+
+
+def _pre_call_hook(service, call, request, response, rpc):
+    stats = _current_stats()
+    if stats is not None:
+        stats.rpc_started(id(rpc) if rpc is not None else id(request))
+
+
+def _post_call_hook(service, call, request, response, rpc, error):
+    stats = _current_stats()
+    if stats is None:
+        return
+    stats.rpc_finished(id(rpc) if rpc is not None else id(request), service)
+    if service == 'memcache' and call == 'Get' and error is None:
+        stats.cache_lookups += request.key_size()
+        stats.cache_hits += response.item_size()
+
+
+def install_hooks():
+    """Adds the RPC accounting hooks to the current apiproxy. Safe to call
+    repeatedly; the hooks are only added once per apiproxy.
+    """
+    apiproxy = apiproxy_stub_map.apiproxy
+    apiproxy.GetPreCallHooks().Append(_HOOK_KEY, _pre_call_hook)
+    apiproxy.GetPostCallHooks().Append(_HOOK_KEY, _post_call_hook)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile.
+
+    Args:
+        values (list): Sorted numbers.
+        pct (int): Percentile between 0 and 100.
+
+    Returns:
+        float or None: None if there are no values.
+    """
+    if not values:
+        return None
+    rank = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+def start_request():
+    """Starts RPC accounting for the current request."""
+    install_hooks()
+    _local.stats = RequestStats()
+
+
+def finish_request(route, status_code, payload_size):
+    """Stops RPC accounting for the current request, records it in the
+    rolling window and writes it to the log.
+
+    Args:
+        route (str): The matched URL rule.
+        status_code (int): Response status code.
+        payload_size (int): Response body size in bytes.
+
+    Returns:
+        dict or None: The recorded metrics, or None if start_request() wasn't
+        called for this request.
+    """
+    stats = _current_stats()
+    if stats is None:
+        return None
+    _local.stats = None
+    record = {
+        'route': route,
+        'status': status_code,
+        'wall_ms': round((time.time() - stats.start) * 1000, 2),
+        'bytes': payload_size,
+        'rpcs': dict(
+            (service, {'count': count, 'ms': round(ms, 2)})
+            for service, (count, ms) in stats.rpcs.items()),
+        'cache_hit_ratio': stats.cache_hit_ratio,
+    }
+    with _lock:
+        _samples[route].append(record)
+    logging.info('request_metrics %s', json.dumps(record, sort_keys=True))
+    return record
+
+
+def summary():
+    """Summarizes the rolling window of every route.
+
+    Returns:
+        dict: Maps each route to its request count, wall time and payload
+        size percentiles, and per-service RPC count and latency averages.
+    """
+    with _lock:
+        samples = dict((route, list(window)) for route, window in _samples.items())
+
+    result = {}
+    for route, records in samples.items():
+        wall = sorted(r['wall_ms'] for r in records)
+        size = sorted(r['bytes'] for r in records)
+        rpcs = collections.defaultdict(lambda: [0, 0.0])
+        lookups = [r['cache_hit_ratio'] for r in records
+                   if r['cache_hit_ratio'] is not None]
+        for r in records:
+            for service, stats in r['rpcs'].items():
+                rpcs[service][0] += stats['count']
+                rpcs[service][1] += stats['ms']
+        result[route] = {
+            'requests': len(records),
+            'wall_ms': dict(
+                ('p{}'.format(p), percentile(wall, p)) for p in PERCENTILES),
+            'bytes': dict(
+                ('p{}'.format(p), percentile(size, p)) for p in PERCENTILES),
+            'rpcs': dict(
+                (service, {
+                    'count_per_request': round(float(count) / len(records), 2),
+                    'avg_ms': round(ms / count, 2) if count else None
+                })
+                for service, (count, ms) in rpcs.items()),
+            'cache_hit_ratio': (
+                round(sum(lookups) / len(lookups), 3) if lookups else None),
+        }
+    return result
+
+
+def reset():
+    """Clears the rolling windows."""
+    with _lock:
+        _samples.clear()
+
+
+def init_app(app, url='/debug/metrics'):
+    """Instruments a Flask app and adds the metrics endpoint to it.
+
+    The endpoint isn't protected by the app itself; map it to an admin-only
+    handler in the service's yaml file.
+
+    Args:
+        app (Flask): The app to instrument.
+        url (str): Where to serve summary() as JSON.
+    """
+    @app.before_request
+    def before_request():
+        start_request()
+
+    @app.after_request
+    def after_request(response):
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        size = response.content_length
+        if size is None and not response.is_streamed:
+            size = len(response.get_data())
+        finish_request(route, response.status_code, size or 0)
+        return response
+
+    @app.route(url, methods=['GET'])
+    def debug_metrics():
+        return jsonify(summary())
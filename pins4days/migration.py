@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Batched, resumable schema migrations over Pin entities.
+
+A migration is a transform registered under a name with register_migration().
+The worker service walks the Pin kind with query cursors in bounded batches,
+applies the transform to every Pin, writes the changed Pins back with
+ndb.put_multi() and checkpoints its cursor in a MigrationState entity. When a
+task runs low on time it re-enqueues itself, and the next task picks up from
+the checkpoint.
+
+Every namespace (i.e. every workspace, see pins4days.tenants) is migrated
+separately, with its own checkpoint and tasks. See start_in_namespaces().
+
+Example:
+
+    @register_migration('drop_empty_attachments')
+    def drop_empty_attachments(pin):
+        attachments = [a for a in pin.attachments if a.original_url]
+        if len(attachments) == len(pin.attachments):
+            return None
+        pin.attachments = attachments
+        return pin
+
+Attributes:
+    DEFAULT_BATCH_SIZE (int): Number of Pins read per batch.
+    DEFAULT_TIME_BUDGET (int): Seconds a single task may spend on batches
+    before handing over to a fresh task. Push tasks on automatically scaled
+    services get 10 minutes, so this leaves room for the last batch.
+"""
+
+import logging
+import re
+import time
+
+from google.appengine.api import namespace_manager
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from pins4days.constants import QUEUE_MIGRATIONS
+from pins4days.models.migration import MigrationState
+from pins4days.models.pin import Pin
+
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_TIME_BUDGET = 8 * 60
+
+_MIGRATIONS = {}
+
+
+def register_migration(name):
+    """Registers a Pin transform under the given name.
+
+    The transform is called with a single Pin. It should return the Pin (or a
+    replacement Pin) when it needs to be written back, or None when the Pin
+    was left untouched.
+
+    Args:
+        name (str): Unique migration name. Only letters, digits, '-' and '_'
+        are allowed since the name is used in task names.
+
+    Returns:
+        function: Decorator.
+
+    Raises:
+        ValueError: Thrown if the name is invalid or already registered.
+    """
+    if not re.match(r'^[a-zA-Z0-9_-]+$', name):
+        raise ValueError("Invalid migration name '{}'.".format(name))
+
+    def decorator(transform):
+        if name in _MIGRATIONS:
+            raise ValueError(
+                "Migration '{}' is already registered.".format(name))
+        _MIGRATIONS[name] = transform
+        return transform
+    return decorator
+
+
+def get_migration(name):
+    """Looks up a registered transform.
+
+    Args:
+        name (str): Migration name.
+
+    Returns:
+        function: The transform.
+
+    Raises:
+        KeyError: Thrown if no migration is registered under that name.
+    """
+    return _MIGRATIONS[name]
+
+
+def start_migration(name, batch_size=DEFAULT_BATCH_SIZE):
+    """Resets the migration's checkpoint and enqueues its first task.
+
+    Args:
+        name (str): Migration name.
+        batch_size (int): Number of Pins read per batch.
+
+    Returns:
+        MigrationState: The fresh checkpoint.
+    """
+    get_migration(name)
+    state = MigrationState(id=name)
+    state.put()
+    enqueue_migration(name, batch_size, state.batches, state.started)
+    return state
+
+
+def start_in_namespaces(name, namespaces, batch_size=DEFAULT_BATCH_SIZE):
+    """Starts the migration in each of the given namespaces.
+
+    Args:
+        name (str): Migration name.
+        namespaces (list): The namespaces, see tenants.list_namespaces().
+        batch_size (int): Number of Pins read per batch.
+
+    Returns:
+        dict: The fresh MigrationState of each namespace.
+    """
+    get_migration(name)
+    states = {}
+    current = namespace_manager.get_namespace()
+    try:
+        for namespace in namespaces:
+            namespace_manager.set_namespace(namespace)
+            states[namespace] = start_migration(name, batch_size)
+    finally:
+        namespace_manager.set_namespace(current)
+    return states
+
+
+def enqueue_migration(name, batch_size, batches, started):
+    """Enqueues a task that continues the migration from its checkpoint, in
+    the current namespace.
+
+    The task is named after the migration, its namespace, its start time and
+    the number of committed batches, so a retried task can never enqueue its
+    successor twice. Task names are global, hence the namespace.
+
+    Args:
+        name (str): Migration name.
+        batch_size (int): Number of Pins read per batch.
+        batches (int): Number of batches committed so far.
+        started (datetime): When the migration was started.
+    """
+    task_name = '{}-{}-{}-{}'.format(
+        name,
+        re.sub(r'[^0-9A-Za-z_-]', '_', namespace_manager.get_namespace()),
+        started.strftime('%Y%m%d%H%M%S'),
+        batches)
+    try:
+        taskqueue.add(
+            name=task_name,
+            queue_name=QUEUE_MIGRATIONS,
+            url='/worker/migrations/{}'.format(name),
+            target='worker',
+            params={'batch_size': batch_size},
+            method='POST')
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        logging.info('Migration task %s was already enqueued.', task_name)
+
+
+def run_migration(name, batch_size=DEFAULT_BATCH_SIZE,
+                  time_budget=DEFAULT_TIME_BUDGET):
+    """Processes batches of Pins until the migration is done or the time
+    budget runs out, then re-enqueues itself if there is more to do.
+
+    The checkpoint is written after every batch, so a task that dies part way
+    through only repeats the batch it was working on. Transforms should
+    therefore be idempotent.
+
+    Args:
+        name (str): Migration name.
+        batch_size (int): Number of Pins read per batch.
+        time_budget (float): Seconds this call may keep starting new batches.
+
+    Returns:
+        MigrationState: The checkpoint after the last committed batch.
+    """
+    transform = get_migration(name)
+    state = MigrationState.get_or_insert(name)
+    if state.done:
+        return state
+
+    deadline = time.time() + time_budget
+    cursor = Cursor(urlsafe=state.cursor) if state.cursor else None
+    page_future = Pin.query().fetch_page_async(batch_size, start_cursor=cursor)
+    while True:
+        batch_start = time.time()
+        pins, cursor, more = page_future.get_result()
+        changed = [p for p in (transform(pin) for pin in pins) if p is not None]
+        # Read the next batch while this one is being written.
+        prefetch = more and time.time() < deadline
+        if prefetch:
+            page_future = Pin.query().fetch_page_async(
+                batch_size, start_cursor=cursor)
+        if changed:
+            ndb.put_multi(changed)
+
+        state.cursor = cursor.urlsafe() if cursor else state.cursor
+        state.done = not more
+        state.batches += 1
+        state.processed += len(pins)
+        state.written += len(changed)
+        state.elapsed += time.time() - batch_start
+        state.put()
+        logging.info(
+            'Migration %s: batch %d, %d read, %d written, %.1f pins/s.',
+            name, state.batches, state.processed, state.written,
+            state.throughput)
+
+        if not prefetch:
+            break
+
+    if more:
+        enqueue_migration(name, batch_size, state.batches, state.started)
+    else:
+        logging.info('Migration %s finished: %s', name, state.to_status())
+    return state
+
+
+@register_migration('resave')
+def resave(pin):
+    """Writes every Pin back unchanged. Useful after adding an index or a
+    property with a default value, so that existing entities pick it up.
+    """
+    return pin
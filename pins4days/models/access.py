@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+from google.appengine.ext import ndb
+
+
+class ChannelMembership(ndb.Model):
+
+    """The channels a Slack user belongs to, as last listed from Slack. See
+    pins4days.access. Lives in the workspace's namespace, and the entity's
+    key.id is the Slack user ID.
+
+    pins4days.access caches the channel IDs in memcache in a more compact
+    form, so ndb's own memcache copy is turned off.
+
+    Attributes:
+        channel_ids (StringProperty): The channel IDs.
+        updated (DateTimeProperty): When the channels were last listed.
+    """
+
+    _use_memcache = False
+
+    channel_ids = ndb.StringProperty('c', repeated=True, indexed=False)
+    updated = ndb.DateTimeProperty('up', auto_now=True, indexed=False)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+from google.appengine.ext import ndb
+
+from pins4days import paging
+from pins4days.sharding import ShardedQuery
+
+
+class ArchivedPin(ndb.Model):
+
+    """Stub left behind for a Pin that was moved to an archive blob. Only the
+    properties needed to find the Pin again are kept; the rest is read back
+    from the blob. See pins4days.archive. The entity's key.id is the Pin's
+    key id.
+
+    Attributes:
+        author_id (StringProperty): See Pin.author_id.
+        blob (StringProperty): Name of the archive blob holding the Pin.
+        channel_id (StringProperty): See Pin.channel_id.
+        created_ts (IntegerProperty): See Pin.created_ts.
+        length (IntegerProperty): Length of the Pin's record in the blob.
+        offset (IntegerProperty): Byte offset of the Pin's record in the
+        decompressed blob.
+    """
+
+    author_id = ndb.StringProperty('aid')
+    channel_id = ndb.StringProperty('cid')
+    created_ts = ndb.IntegerProperty('cts')
+    blob = ndb.StringProperty('b', indexed=False)
+    offset = ndb.IntegerProperty('o', indexed=False)
+    length = ndb.IntegerProperty('l', indexed=False)
+
+    @classmethod
+    def create(cls, pin, blob, offset, length):
+        """Creates the stub of a Pin but does not insert it into the DB.
+
+        Args:
+            pin (Pin): The archived Pin.
+            blob (str): Name of the archive blob.
+            offset (int): Byte offset of the Pin's record in the
+            decompressed blob.
+            length (int): Length of the Pin's record.
+
+        Returns:
+            ArchivedPin
+        """
+        return cls(
+            id=pin.key.id(),
+            author_id=pin.author_id,
+            channel_id=pin.channel_id,
+            created_ts=pin.created_ts,
+            blob=blob,
+            offset=offset,
+            length=length)
+
+    @classmethod
+    def _query(cls, filters, channel_ids, before):
+        if before is not None:
+            filters = [cls.created_ts < before] + filters
+        if channel_ids is None:
+            return cls.query(*filters).order(-cls.created_ts)
+        queries = [
+            cls.query(cls.channel_id.IN(batch), *filters).order(
+                -cls.created_ts, cls.key)
+            for batch in paging.channel_batches(channel_ids)
+        ]
+        return queries[0] if len(queries) == 1 else ShardedQuery(queries)
+
+    @classmethod
+    def query_user(cls, user_id, channel_ids=None, before=None):
+        """See Pin.query_user()."""
+        return cls._query([cls.author_id == user_id], channel_ids, before)
+
+    @classmethod
+    def query_all(cls, channel_ids=None, before=None):
+        """See Pin.query_all()."""
+        return cls._query([], channel_ids, before)
+
+    @classmethod
+    def query_created_between(cls, since, before, channel_id=None):
+        """See Pin.query_created_between()."""
+        filters = [cls.channel_id == channel_id] if channel_id else []
+        return cls.query(
+            cls.created_ts >= since, cls.created_ts < before,
+            *filters).order(-cls.created_ts)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+from google.appengine.ext import ndb
+
+
+class Digest(ndb.Model):
+
+    """Pin counts of a channel over one time bucket (a week or a month). See
+    pins4days.digests. The entity's key.id is built with build_key_id().
+
+    Attributes:
+        authors (JsonProperty): Number of pins per author ID.
+        channel_id (StringProperty): The channel the pins were pinned in.
+        count (IntegerProperty): Number of pins.
+        domains (JsonProperty): Number of attachment links per domain.
+        period (StringProperty): 'week' or 'month'.
+        pinners (JsonProperty): Number of pins per pinner ID.
+        start (IntegerProperty): Timestamp of the start of the bucket.
+    """
+
+    channel_id = ndb.StringProperty('cid')
+    period = ndb.StringProperty('p')
+    start = ndb.IntegerProperty('bs')
+    count = ndb.IntegerProperty('n', default=0, indexed=False)
+    authors = ndb.JsonProperty('au', compressed=True)
+    pinners = ndb.JsonProperty('pi', compressed=True)
+    domains = ndb.JsonProperty('dm', compressed=True)
+
+    @staticmethod
+    def build_key_id(period, label, channel_id):
+        """Creates the unique Digest ID of a channel's bucket.
+
+        Args:
+            period (str): 'week' or 'month'.
+            label (str): The bucket's label, e.g. '2018-05'.
+            channel_id (str): The channel.
+
+        Returns:
+            str
+        """
+        return ':'.join([period, label, channel_id])
+
+    @classmethod
+    def query_period(cls, period, since, channel_id=None):
+        """Creates the query for fetching the buckets of a period, newest
+        first.
+
+        Args:
+            period (str): 'week' or 'month'.
+            since (int): Only buckets starting at or after this timestamp are
+            fetched.
+            channel_id (str): Optional. Only fetch this channel's buckets.
+
+        Returns:
+            Query
+        """
+        query = cls.query(cls.period == period, cls.start >= since)
+        if channel_id:
+            query = query.filter(cls.channel_id == channel_id)
+        return query.order(-cls.start)
+
+
+class DigestMark(ndb.Model):
+
+    """Marks a pin as counted in a Digest, so that a pin that is stored twice
+    is only counted once. The entity has no properties: its key.id is the
+    Pin's key id, and its parent is the Digest's key, so that it is checked
+    and written in the Digest's transaction without ever being loaded with
+    the Digest. See pins4days.digests.
+    """
+    pass
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+from google.appengine.ext import ndb
+
+
+class Link(ndb.Model):
+
+    """The preview of a link, shared by every Attachment of that link. See
+    pins4days.links. The entity's key.id is the hash of the normalised link,
+    see pins4days.links.link_id().
+
+    Attributes:
+        fetched (DateTimeProperty): When the preview was last fetched from
+        the link itself. None if the preview is still the one Slack sent.
+        from_url (StringProperty): See Attachment.from_url.
+        image_url (StringProperty): See Attachment.image_url.
+        text (StringProperty): See Attachment.text.
+        updated (DateTimeProperty): When the preview was last written.
+        url (StringProperty): The normalised link.
+    """
+
+    url = ndb.StringProperty('u', indexed=False)
+    from_url = ndb.StringProperty('frurl', indexed=False)
+    image_url = ndb.StringProperty('imurl', indexed=False)
+    text = ndb.StringProperty('tx', indexed=False)
+    fetched = ndb.DateTimeProperty('ft', indexed=False)
+    updated = ndb.DateTimeProperty('up', auto_now=True, indexed=False)
+
+    @property
+    def has_preview(self):
+        """
+        Returns:
+            bool: True if there is an image or text to show.
+        """
+        return bool(self.image_url or self.text)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from google.appengine.ext import ndb
+
+
+class MigrationState(ndb.Model):
+
+    """Checkpoint for a running (or finished) Pin migration. The entity's
+    key.id is the name the migration was registered under.
+
+    Attributes:
+        batches (IntegerProperty): Number of batches that have been committed.
+        cursor (StringProperty): Websafe query cursor pointing just past the
+        last committed batch. None until the first batch is committed.
+        done (BooleanProperty): True once the whole Pin kind has been walked.
+        elapsed (FloatProperty): Seconds spent processing batches, summed
+        across every task that worked on this migration.
+        processed (IntegerProperty): Number of Pins read so far.
+        started (DateTimeProperty): When the migration was (re)started.
+        updated (DateTimeProperty): When the checkpoint was last written.
+        written (IntegerProperty): Number of Pins the transform changed and
+        that were written back.
+    """
+
+    cursor = ndb.StringProperty('cur', indexed=False)
+    done = ndb.BooleanProperty('done', default=False)
+    batches = ndb.IntegerProperty('b', default=0, indexed=False)
+    processed = ndb.IntegerProperty('p', default=0, indexed=False)
+    written = ndb.IntegerProperty('w', default=0, indexed=False)
+    elapsed = ndb.FloatProperty('el', default=0.0, indexed=False)
+    started = ndb.DateTimeProperty('st', auto_now_add=True)
+    updated = ndb.DateTimeProperty('up', auto_now=True)
+
+    @property
+    def throughput(self):
+        """Pins read per second of processing time.
+
+        Returns:
+            float
+        """
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def to_status(self):
+        """Builds a JSON friendly progress report.
+
+        Returns:
+            dict
+        """
+        return {
+            'name': self.key.id(),
+            'done': self.done,
+            'batches': self.batches,
+            'processed': self.processed,
+            'written': self.written,
+            'elapsed': round(self.elapsed, 3),
+            'throughput': round(self.throughput, 1),
+            'started': self.started.isoformat() if self.started else None,
+            'updated': self.updated.isoformat() if self.updated else None
+        }
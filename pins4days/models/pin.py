@@ -2,6 +2,11 @@
 
 from google.appengine.ext import ndb
 
+from pins4days import paging
+from pins4days import serializers
+from pins4days import sharding
+from pins4days.sharding import ShardedQuery
+
 
 class Attachment(ndb.Model):
 
@@ -45,10 +50,16 @@ class Pin(ndb.Model):
         created.
         pinned_ts (IntegerProperty): Timestamp of when the message was pinned.
         pinner_id (StringProperty): ID of the user that pinned the message.
+        shard_key (StringProperty): Only set when sharding is enabled. See
+        pins4days.sharding.
         text (TextProperty): Pinned message's text.
         ts (StringProperty):
+        updated (DateTimeProperty): When the Pin was last written. Versions
+        the Pin's cached JSON, see pins4days.serializers.
     """
 
+    _shards = 1
+
     text = ndb.TextProperty('tx')
     author_id = ndb.StringProperty('aid')
     pinner_id = ndb.StringProperty('pid')
@@ -57,6 +68,55 @@ class Pin(ndb.Model):
     created_ts = ndb.IntegerProperty('cts')
     attachments = ndb.StructuredProperty(Attachment, name='a', repeated=True)
     ts = ndb.StringProperty('ts') # ts along with the channel id can be used to recreate the permalink
+    shard_key = ndb.StringProperty('sk')
+    updated = ndb.DateTimeProperty('up', auto_now=True, indexed=False)
+
+    @classmethod
+    def set_shards(cls, shards):
+        """Sets the number of shards of the creation time ordering. See
+        pins4days.sharding. Call it once, before any Pins are written or
+        queried.
+
+        created_ts stays indexed whatever the number of shards. Switching
+        sharding on, or changing the number of shards, must be followed by
+        the 'resave' migration so that stored Pins get their new shard_key.
+
+        Args:
+            shards (int): Number of shards. 1 turns sharding off.
+        """
+        cls._shards = max(1, int(shards))
+
+    @classmethod
+    def is_sharded(cls):
+        """
+        Returns:
+            bool: True if the creation time ordering is sharded.
+        """
+        return cls._shards > 1
+
+    def to_dict(self, include=None, exclude=None):
+        """Same as Model.to_dict(), but leaves out the internal shard_key and
+        updated stamp."""
+        exclude = set(exclude or []) | set(['shard_key', 'updated'])
+        return super(Pin, self).to_dict(include=include, exclude=exclude)
+
+    def _pre_put_hook(self):
+        """Sets the Pin's shard_key if sharding is enabled, and clears it
+        otherwise."""
+        if self.is_sharded():
+            self.shard_key = sharding.shard_key(
+                self.key.id(), self.created_ts, self._shards)
+        else:
+            self.shard_key = None
+
+    def _post_put_hook(self, future):
+        """Invalidates cached responses. See pins4days.serializers."""
+        serializers.invalidate_async()
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        """Invalidates cached responses. See pins4days.serializers."""
+        serializers.invalidate_async()
 
     @staticmethod
     def build_key_id(channel_id, ts):
@@ -87,24 +147,127 @@ class Pin(ndb.Model):
         return cls(**kwargs)
 
     @classmethod
-    def query_user(cls, user_id):
+    def _query_sharded(cls, filters=(), since=None, before=None, reverse=True):
+        queries = []
+        for shard in range(cls._shards):
+            lower, upper = sharding.shard_range(shard, since, before)
+            query = cls.query(
+                cls.shard_key >= lower, cls.shard_key < upper, *filters)
+            queries.append(
+                query.order(-cls.shard_key if reverse else cls.shard_key))
+        return ShardedQuery(queries, reverse=reverse)
+
+    @classmethod
+    def _query_newest(cls, filters=(), before=None):
+        if cls.is_sharded():
+            return cls._query_sharded(filters, before=before)
+        if before is not None:
+            filters = [cls.created_ts < before] + list(filters)
+        return cls.query(*filters).order(-cls.created_ts)
+
+    @classmethod
+    def _query_channels(cls, channel_ids, filters=(), before=None):
+        # One IN query per batch of visible channels (and per shard), merged
+        # newest first. See pins4days.access and pins4days.paging.
+        queries = []
+        for batch in paging.channel_batches(channel_ids):
+            # Orders ties by key, as the merge of the IN's queries doesn't.
+            channel_filters = [cls.channel_id.IN(batch)] + list(filters)
+            if cls.is_sharded():
+                queries.extend(
+                    q.order(cls.key) for q in
+                    cls._query_sharded(channel_filters, before=before).queries)
+            else:
+                queries.append(
+                    cls._query_newest(channel_filters, before).order(cls.key))
+        if len(queries) == 1:
+            return queries[0]
+        return ShardedQuery(queries)
+
+    @classmethod
+    def query_user(cls, user_id, channel_ids=None, before=None):
         """Creates the query for fetching a user's pins in reverse chronological
         order.
 
         Args:
             user_id (str): The user's Slack ID.
+            channel_ids (iterable): Optional. Only pins from these channels.
+            See pins4days.access.
+            before (int): Optional. Only pins created before this timestamp.
+            See pins4days.paging.
 
         Returns:
-            Query
+            Query or ShardedQuery
         """
-        return cls.query(getattr(Pin, 'author_id') == user_id).order(-cls.created_ts)
+        filters = [cls.author_id == user_id]
+        if channel_ids is not None:
+            return cls._query_channels(channel_ids, filters, before)
+        return cls._query_newest(filters, before)
 
     @classmethod
-    def query_all(cls):
+    def query_all(cls, channel_ids=None, before=None):
         """Creates the query for fetching all pins in reverse chronological
         order.
 
+        Args:
+            channel_ids (iterable): Optional. Only pins from these channels.
+            See pins4days.access.
+            before (int): Optional. Only pins created before this timestamp.
+            See pins4days.paging.
+
+        Returns:
+            Query or ShardedQuery
+        """
+        if channel_ids is not None:
+            return cls._query_channels(channel_ids, before=before)
+        return cls._query_newest(before=before)
+
+    @classmethod
+    def query_created_before(cls, before):
+        """Creates the query for fetching the pins created before a
+        timestamp, oldest first.
+
+        Args:
+            before (int): The timestamp.
+
+        Returns:
+            Query or ShardedQuery
+        """
+        if cls.is_sharded():
+            return cls._query_sharded(before=before, reverse=False)
+        return cls.query(cls.created_ts < before).order(cls.created_ts)
+
+    @classmethod
+    def query_created_between(cls, since, before, channel_id=None):
+        """Creates the query for fetching the pins created in a time range,
+        newest first.
+
+        Args:
+            since (int): Only pins created at or after this timestamp.
+            before (int): Only pins created before this timestamp.
+            channel_id (str): Optional. Only pins from this channel.
+
+        Returns:
+            Query or ShardedQuery
+        """
+        filters = [cls.channel_id == channel_id] if channel_id else []
+        if cls.is_sharded():
+            return cls._query_sharded(filters, since=since, before=before)
+        return cls.query(
+            cls.created_ts >= since, cls.created_ts < before,
+            *filters).order(-cls.created_ts)
+
+    @classmethod
+    def query_created_since(cls, since):
+        """Creates the query for fetching the pins created at or after a
+        timestamp, oldest first.
+
+        Args:
+            since (int): The timestamp.
+
         Returns:
-            Query
+            Query or ShardedQuery
         """
-        return cls.query().order(-cls.created_ts)
+        if cls.is_sharded():
+            return cls._query_sharded(since=since, reverse=False)
+        return cls.query(cls.created_ts >= since).order(cls.created_ts)
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+from google.appengine.ext import ndb
+
+
+class ChannelRotation(ndb.Model):
+
+    """Pin rotation state of a channel, see pins4days.rotation. The entity's
+    key.id is the channel ID.
+
+    Attributes:
+        last_run (DateTimeProperty): When a rotation last finished.
+        lease_until (DateTimeProperty): While set and in the future, a
+        rotation of the channel is running and no other may start.
+        unpinned (IntegerProperty): Number of messages unpinned so far.
+    """
+
+    lease_until = ndb.DateTimeProperty('lu', indexed=False)
+    last_run = ndb.DateTimeProperty('lr', indexed=False)
+    unpinned = ndb.IntegerProperty('n', default=0, indexed=False)
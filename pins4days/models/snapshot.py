@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from google.appengine.ext import ndb
+
+
+class SnapshotPrefix(ndb.Model):
+
+    """The random part of the blob names of a workspace's snapshots, so that
+    the public snapshot files can't be found by guessing their names. See
+    pins4days.snapshots. Lives in the workspace's namespace, and there is one
+    entity, with the key.id 'prefix'.
+
+    Attributes:
+        token (StringProperty): 32 random hex digits.
+    """
+
+    token = ndb.StringProperty('t', indexed=False)
+
+    @classmethod
+    def get_token(cls, namespace=None):
+        """Gets the token of a namespace, creating it the first time.
+
+        Args:
+            namespace (str): Optional. Defaults to the current namespace.
+
+        Returns:
+            str
+        """
+        return cls.get_or_insert(
+            'prefix', namespace=namespace,
+            token=os.urandom(16).encode('hex')).token
+
+
+class SnapshotPage(ndb.Model):
+
+    """The current version of a past month's snapshot page. Past months are
+    written under names that include their version, a hash of their
+    contents, so that they can be cached for long. See pins4days.snapshots.
+    Lives in the workspace's namespace. The entity's key.id is built with
+    build_key_id().
+
+    Attributes:
+        version (StringProperty): The version in the names of the page's
+        files.
+    """
+
+    version = ndb.StringProperty('v', indexed=False)
+
+    @staticmethod
+    def build_key_id(channel_id, label):
+        """Creates the unique SnapshotPage ID of a page.
+
+        Args:
+            channel_id (str or None): The page's channel, or None for all
+            pins.
+            label (str): The page's month, as YYYY-MM.
+
+        Returns:
+            str
+        """
+        return ':'.join([channel_id or '', label])
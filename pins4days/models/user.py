@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 
 from google.appengine.ext import ndb
-from lib.pybcrypt import bcrypt
 
+from pins4days import passwords
 from exceptions import IncorrectPasswordException
 from exceptions import EntityDoesNotExistException
 
@@ -11,41 +11,39 @@ class User(ndb.Model):
 
     """Represents a Pins4Days app user.
 
+    Users always live in the default namespace, whichever workspace's
+    namespace is current. See pins4days.tenants.
+
     Attributes:
         password (StringProperty): The user's password. ENCRYPT BEFORE STORING!
         See User.encrypt_password() and User.create_with_encryption().
+        slack_user_id (StringProperty): Optional. The user's Slack user ID.
+        Decides which channels' pins the user sees when channel access
+        control is on. See pins4days.access.
+        slack_verified (BooleanProperty): True if team_id and slack_user_id
+        were confirmed by Slack. Unverified values are ignored. See
+        pins4days.identity.
+        team_id (StringProperty): Optional. The Slack team ID of the workspace
+        whose pins the user sees, on multi-workspace deployments.
     """
 
     # The User entity's key.id is set to the username to maintain unique
     # constraint.
     password = ndb.StringProperty('pw', required=True)
+    team_id = ndb.StringProperty('tid')
+    slack_user_id = ndb.StringProperty('suid')
+    slack_verified = ndb.BooleanProperty('sv', default=False)
 
-    @staticmethod
-    def compare_passwords(stored_pw, unencrypted_pw):
-        """Compares a stored password with an unencrypted password to see if
-        they match.
-
-        Args:
-            stored_pw (str): The password that is currently stored in the DB.
-            unencrypted_pw (str): An unencrypted password to compare to the
-            stored password.
+    compare_passwords = staticmethod(passwords.compare_passwords)
+    encrypt_password = staticmethod(passwords.encrypt_password)
 
-        Returns:
-            bool: Returns True if the passwords match. False, otherwise.
+    @property
+    def username(self):
         """
-        return bcrypt.hashpw(unencrypted_pw, stored_pw) == stored_pw
-
-    @staticmethod
-    def encrypt_password(password):
-        """Encrypts (bcrypt) a given password.
-
-        Args:
-            password (str): The password to encrypt.
-
         Returns:
-            str: The encrypted password.
+            str: The username, which is the User's key.id.
         """
-        return bcrypt.hashpw(password, bcrypt.gensalt())
+        return self.key.id()
 
     @classmethod
     def create_with_encryption(cls, **kwargs):
@@ -54,12 +52,19 @@ class User(ndb.Model):
 
         Args:
             **kwargs: The keyword args accepts by the User NDB model. These
-            are currently: password.
+            are currently: password. The Slack team and user IDs are only
+            ever set by link_slack_identity(), from an identity that Slack
+            confirmed.
+
+        Returns:
+            bool: True if the User was created.
         """
-        if not cls.get_by_id(kwargs['id']):
-            kwargs['password'] = cls.encrypt_password(kwargs['password'])
-            user = cls(**kwargs)
-            user.put()
+        if cls.get_by_id(kwargs['id'], namespace=''):
+            return False
+        kwargs['password'] = cls.encrypt_password(kwargs['password'])
+        user = cls(namespace='', **kwargs)
+        user.put()
+        return True
 
     @classmethod
     def update_password(cls, username, new_pw):
@@ -69,10 +74,32 @@ class User(ndb.Model):
             username (User): The user that will get the new password.
             new_pw (str): The new password, unencrypted.
         """
-        user = ndb.Key(cls, username).get()
+        user = ndb.Key(cls, username, namespace='').get()
         user.password = cls.encrypt_password(new_pw)
         user.put()
 
+    @classmethod
+    def link_slack_identity(cls, username, team_id, slack_user_id):
+        """Stores the Slack identity that Slack confirmed for an existing
+        User. See pins4days.identity.
+
+        Args:
+            username (str): The username.
+            team_id (str): The user's Slack team ID.
+            slack_user_id (str): The user's Slack user ID.
+
+        Returns:
+            User or None: The updated User, or None if it doesn't exist.
+        """
+        user = ndb.Key(cls, username, namespace='').get()
+        if user is None:
+            return None
+        user.team_id = team_id
+        user.slack_user_id = slack_user_id
+        user.slack_verified = True
+        user.put()
+        return user
+
     @classmethod
     def login(cls, username, submitted_pw):
         """Essentially looks for an existing User based on the given username
@@ -91,7 +118,7 @@ class User(ndb.Model):
             IncorrectPasswordException: Thrown is the User exists but the wrong password
             is given.
         """
-        user = cls.get_by_id(username)
+        user = cls.get_by_id(username, namespace='')
         if user is None:
             raise EntityDoesNotExistException(
                 "User with username '{}' does not exist.".format(username))
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Keyset paging of listings that are ordered newest first.
+
+Listings can merge many queries: one per shard (see pins4days.sharding), one
+per visible channel (see pins4days.access, an IN filter runs a query per
+value), or both. Skipping pages with an
+offset makes every one of those queries read all the skipped pins again, so
+a deep page of a user with many channels reads channels x shards x
+(offset + limit) pins.
+
+Pages are therefore fetched after a cursor instead: the created_ts and key
+id of the last pin read, and the number of pins read so far that share that
+created_ts. Every query only reads pins created up to that timestamp, and
+about limit of them, whatever the page. Within a second, pins are ordered by
+key id, as the datastore orders them within a query.
+
+Channel listings filter on the visible channels with IN, in batches of up
+to MAX_IN_VALUES channels (see channel_batches()), since that is as many
+values as one IN filter takes. Every pin read is visible, so pages are
+always full, however many channels a user is in.
+
+Attributes:
+    MAX_IN_VALUES (int): Most channels in one IN filter.
+"""
+
+import base64
+import json
+
+from google.appengine.ext import ndb
+
+
+MAX_IN_VALUES = 30
+
+
+def channel_batches(channel_ids):
+    """Splits channels into the batches of a listing's IN filters.
+
+    Args:
+        channel_ids (iterable): The channels.
+
+    Returns:
+        list: Sorted lists of at most MAX_IN_VALUES channels. Empty if
+        there are no channels.
+    """
+    channel_ids = sorted(frozenset(channel_ids))
+    return [
+        channel_ids[i:i + MAX_IN_VALUES]
+        for i in range(0, len(channel_ids), MAX_IN_VALUES)
+    ]
+
+
+def _position(entity):
+    # Sorts newest first, then by key id.
+    return -(entity.created_ts or 0), entity.key.id()
+
+
+def encode_cursor(position, ties):
+    """
+    Args:
+        position (tuple): The position of the last entity read.
+        ties (int): Number of entities read so far with its created_ts.
+
+    Returns:
+        str: A URL-safe cursor.
+    """
+    return base64.urlsafe_b64encode(
+        json.dumps([-position[0], position[1], ties]))
+
+
+def decode_cursor(cursor):
+    """
+    Args:
+        cursor (str): A cursor, as returned by encode_cursor().
+
+    Returns:
+        tuple: (position, ties), see encode_cursor().
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        created_ts, key_id, ties = json.loads(
+            base64.urlsafe_b64decode(str(cursor)))
+        return (-int(created_ts), key_id), int(ties)
+    except (TypeError, ValueError, UnicodeEncodeError):
+        raise ValueError('Invalid cursor.')
+
+
+@ndb.tasklet
+def _fetch_tier_async(query, size, position):
+    # Reads until something after position turns up or the query runs out.
+    # Only reads more than once if the tier has more entities at the
+    # cursor's timestamp than the cursor counted, i.e. ones that another
+    # tier listed instead.
+    while True:
+        entities = yield query.fetch_async(size)
+        if (len(entities) < size or position is None or
+                _position(entities[-1]) > position):
+            raise ndb.Return(entities)
+        size *= 2
+
+
+@ndb.tasklet
+def fetch_page_async(tiers, limit, cursor=None):
+    """Fetches a page of a listing, newest first.
+
+    A listing has one or more tiers, e.g. live and archived pins (see
+    pins4days.archive), whose results are merged. Copies of an entity with
+    the same key id in several tiers are listed once, from the first tier.
+
+    Args:
+        tiers (list): Query builders, e.g. Pin.query_all or
+        functools.partial(Pin.query_all, channel_ids). Each is called with
+        before=None, or the created_ts the entities must be older than,
+        and returns a Query or ShardedQuery ordered newest first.
+        limit (int): Page size.
+        cursor (str): Optional. The cursor returned with the previous page.
+
+    Returns:
+        Future: Resolves to a tuple (list, str): the page and the cursor of
+        the next page, or None if this is the last one.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    position, ties = decode_cursor(cursor) if cursor else (None, 0)
+    before = None if position is None else 1 - position[0]
+
+    read, candidates, key_ids = [], [], set()
+    # The position up to which the results of every tier are complete.
+    frontier = None
+    for build_query in tiers:
+        query = build_query(before=before)
+        # One more than needed, so that the last page has no cursor.
+        size = limit + ties + 1
+        entities = yield _fetch_tier_async(query, size, position)
+        read.extend(entities)
+        for entity in entities:
+            if position is not None and _position(entity) <= position:
+                continue
+            if entity.key.id() in key_ids:
+                continue
+            key_ids.add(entity.key.id())
+            candidates.append((_position(entity), entity))
+        if len(entities) >= size:
+            end = _position(entities[-1])
+            frontier = end if frontier is None else min(frontier, end)
+
+    candidates.sort(key=lambda c: c[0])
+    page, last = [], frontier
+    for i, (candidate, entity) in enumerate(candidates):
+        if frontier is not None and candidate > frontier:
+            break
+        page.append(entity)
+        if len(page) == limit:
+            if frontier is not None or i < len(candidates) - 1:
+                last = candidate
+            break
+    if last is None:
+        raise ndb.Return((page, None))
+
+    ties = len([
+        e for e in read
+        if _position(e)[0] == last[0] and _position(e) <= last and (
+            position is None or _position(e) > position)
+    ]) + (ties if position is not None and position[0] == last[0] else 0)
+    raise ndb.Return((page, encode_cursor(last, ties)))
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Password hashing (bcrypt), shared by every storage backend. See
+pins4days.storage.
+"""
+
+from lib.pybcrypt import bcrypt
+
+
+def compare_passwords(stored_pw, unencrypted_pw):
+    """Compares a stored password with an unencrypted password to see if
+    they match.
+
+    Args:
+        stored_pw (str): The password that is currently stored in the DB.
+        unencrypted_pw (str): An unencrypted password to compare to the
+        stored password.
+
+    Returns:
+        bool: Returns True if the passwords match. False, otherwise.
+    """
+    return bcrypt.hashpw(unencrypted_pw, stored_pw) == stored_pw
+
+
+def encrypt_password(password):
+    """Encrypts (bcrypt) a given password.
+
+    Args:
+        password (str): The password to encrypt.
+
+    Returns:
+        str: The encrypted password.
+    """
+    return bcrypt.hashpw(password, bcrypt.gensalt())
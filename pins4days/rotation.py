@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""Automatic unpinning of the oldest pins of full channels.
+
+Slack channels can hold at most 100 pins. When the 'rotate_pins_at' app
+config (or workspace setting, see pins4days.tenants) is set, every pin event
+of a channel that has at least that many pins schedules a rotation of the
+channel on the worker service. The rotation:
+
+1. takes the channel's lease, so that only one rotation per channel runs at
+   a time and concurrent pin events can't unpin the same messages twice,
+2. lists the channel's pins from Slack and picks the oldest messages beyond
+   the 'rotate_pins_keep' newest pins,
+3. makes sure each of them is stored as a Pin (storing it first if needed,
+   and reading it back from the datastore),
+4. unpins them from Slack, at most 'rotate_pins_per_minute' per task, and
+   schedules another task for the rest (a reschedule, see schedule()).
+
+Only messages that are confirmed to be stored are ever unpinned, so nothing
+is lost from Pins4Days. Files and other non-message pins are never unpinned.
+
+Attributes:
+    DEFAULT_KEEP_MARGIN (int): Pins freed by a rotation if
+    'rotate_pins_keep' isn't set.
+    DEFAULT_PER_MINUTE (int): Messages unpinned per task if
+    'rotate_pins_per_minute' isn't set. Slack allows about 20 pins.remove
+    calls per minute.
+    LEASE_SECONDS (int): How long a rotation holds its channel's lease.
+    ROTATION_DELAY (int): Seconds between a pin event and the rotation it
+    schedules, which gives the event's own pin time to be stored.
+"""
+
+import logging
+import re
+import time
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.api import namespace_manager
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from pins4days.constants import QUEUE_ROTATION
+from pins4days.event import PinnedMessage
+from pins4days.ingest import store_async
+from pins4days.models.archive import ArchivedPin
+from pins4days.models.rotation import ChannelRotation
+from pins4days.utils import get_channel_pins_async
+from pins4days.utils import remove_channel_pin_async
+from pins4days.utils import SlackRateLimitedException
+
+
+DEFAULT_KEEP_MARGIN = 10
+DEFAULT_PER_MINUTE = 20
+LEASE_SECONDS = 5 * 60
+ROTATION_DELAY = 30
+
+
+def is_enabled(tenant):
+    """
+    Args:
+        tenant (Tenant): The workspace.
+
+    Returns:
+        bool: True if the workspace's channels are rotated.
+    """
+    return bool(tenant.setting('rotate_pins_at'))
+
+
+def keep_count(tenant):
+    """
+    Args:
+        tenant (Tenant): The workspace.
+
+    Returns:
+        int: Number of newest pins a rotation leaves pinned.
+    """
+    rotate_at = int(tenant.setting('rotate_pins_at'))
+    keep = tenant.setting('rotate_pins_keep', rotate_at - DEFAULT_KEEP_MARGIN)
+    return max(0, min(int(keep), rotate_at - 1))
+
+
+def should_rotate(tenant, event):
+    """Decides whether a pin event should schedule a rotation, going by the
+    channel's pin count that Slack sends with the event.
+
+    Args:
+        tenant (Tenant): The workspace.
+        event (dict): The Slack events API request body.
+
+    Returns:
+        bool
+    """
+    if not is_enabled(tenant):
+        return False
+    inner = event.get('event') or {}
+    if inner.get('type') != 'pin_added':
+        return False
+    pin_count = inner.get('pin_count')
+    return pin_count is None or pin_count >= int(tenant.setting('rotate_pins_at'))
+
+
+def event_channel(event):
+    """
+    Args:
+        event (dict): A pin_added events API request body.
+
+    Returns:
+        str: The channel the message was pinned in.
+    """
+    inner = event['event']
+    return inner.get('channel_id') or inner['item']['channel']
+
+
+def schedule(channel_id, team_id, countdown=ROTATION_DELAY, attempt=0):
+    """Schedules a rotation of a channel in the current namespace. Tasks are
+    named after the channel, the minute they run in and their attempt, so a
+    burst of pin events only schedules one rotation.
+
+    A rotation that has more to unpin reschedules itself with the next
+    attempt. Its name therefore never matches a task that already ran, even
+    if it runs in the same minute, and a retried task still can't schedule
+    its successor twice.
+
+    Args:
+        channel_id (str): The channel.
+        team_id (str or None): The channel's Slack team ID.
+        countdown (int): Seconds before the rotation runs.
+        attempt (int): 0 for rotations scheduled by pin events, otherwise
+        the number of tasks the rotation has taken so far.
+    """
+    namespace = namespace_manager.get_namespace() or '_'
+    task_name = 'rotate-{}-{}-{}-{}'.format(
+        re.sub(r'[^0-9A-Za-z_-]', '_', namespace),
+        re.sub(r'[^0-9A-Za-z_-]', '_', channel_id),
+        int(time.time() + countdown) // 60,
+        attempt)
+    try:
+        taskqueue.add(
+            name=task_name,
+            queue_name=QUEUE_ROTATION,
+            url='/worker/rotation',
+            target='worker',
+            method='POST',
+            countdown=countdown,
+            params={
+                'channel_id': channel_id,
+                'team_id': team_id or '',
+                'attempt': attempt,
+            })
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        logging.info('Rotation task %s was already scheduled.', task_name)
+
+
+@ndb.transactional
+def acquire_lease(channel_id, seconds=LEASE_SECONDS):
+    """Takes a channel's lease, unless another rotation holds it.
+
+    Args:
+        channel_id (str): The channel.
+        seconds (int): How long the lease is held unless released earlier.
+
+    Returns:
+        bool: True if the lease was taken.
+    """
+    rotation = ChannelRotation.get_by_id(channel_id) or ChannelRotation(
+        id=channel_id)
+    now = datetime.utcnow()
+    if rotation.lease_until and rotation.lease_until > now:
+        return False
+    rotation.lease_until = now + timedelta(seconds=seconds)
+    rotation.put()
+    return True
+
+
+@ndb.transactional
+def release_lease(channel_id, unpinned=0):
+    """Releases a channel's lease.
+
+    Args:
+        channel_id (str): The channel.
+        unpinned (int): Number of messages the rotation unpinned.
+    """
+    rotation = ChannelRotation.get_by_id(channel_id) or ChannelRotation(
+        id=channel_id)
+    rotation.lease_until = None
+    rotation.last_run = datetime.utcnow()
+    rotation.unpinned += unpinned
+    rotation.put()
+
+
+def plan_rotation(items, rotate_at, keep):
+    """Picks the messages to unpin from a channel.
+
+    Args:
+        items (list): The channel's pins, as listed by Slack's pins.list.
+        rotate_at (int): Pin count at which the channel is rotated.
+        keep (int): Number of pins to leave pinned.
+
+    Returns:
+        list: The oldest pinned message items, oldest first. Empty if the
+        channel has fewer than rotate_at pins.
+    """
+    if len(items) < rotate_at:
+        return []
+    messages = sorted(
+        (i for i in items if i.get('type') == 'message'),
+        key=lambda i: i.get('created', 0))
+    return messages[:max(0, len(items) - keep)]
+
+
+def _stored_keys(keys):
+    pins = ndb.get_multi(keys, use_cache=False, use_memcache=False)
+    missing = [k for k, p in zip(keys, pins) if p is None]
+    stubs = ndb.get_multi(
+        [ndb.Key(ArchivedPin, k.id()) for k in missing],
+        use_cache=False, use_memcache=False)
+    archived = set(k for k, s in zip(missing, stubs) if s is not None)
+    return set(k for k, p in zip(keys, pins) if p is not None) | archived
+
+
+def confirm_stored(items):
+    """Makes sure pinned message items are stored as Pins (or archived), and
+    stores those that aren't. Every Pin is read back from the datastore,
+    bypassing the caches.
+
+    Args:
+        items (list): Message items, as listed by Slack's pins.list.
+
+    Returns:
+        list: The items that are stored, in the same order.
+    """
+    pins = []
+    for item in items:
+        try:
+            pins.append(PinnedMessage.factory(item))
+        except (KeyError, NotImplementedError):
+            logging.warning('Not rotating unrecognized pin %s.', item)
+            pins.append(None)
+
+    keys = [p.key for p in pins if p is not None]
+    stored = _stored_keys(keys)
+    missing = [p for p in pins if p is not None and p.key not in stored]
+    if missing:
+        store_async(missing).get_result()
+        stored |= _stored_keys([p.key for p in missing])
+    return [
+        item for item, pin in zip(items, pins)
+        if pin is not None and pin.key in stored
+    ]
+
+
+def rotate(tenant, channel_id, attempt=0):
+    """Rotates a channel. See the module docstring.
+
+    Args:
+        tenant (Tenant): The channel's workspace.
+        channel_id (str): The channel.
+        attempt (int): The task's attempt, see schedule().
+
+    Returns:
+        int: Number of messages unpinned, or None if another rotation holds
+        the channel's lease.
+    """
+    if not acquire_lease(channel_id):
+        return None
+
+    unpinned = 0
+    try:
+        token = tenant.setting('slack_user_token')
+        rotate_at = int(tenant.setting('rotate_pins_at'))
+        per_minute = int(
+            tenant.setting('rotate_pins_per_minute', DEFAULT_PER_MINUTE))
+        listing = get_channel_pins_async(channel_id, token).get_result()
+        planned = plan_rotation(
+            listing.get('items', []), rotate_at, keep_count(tenant))
+        batch = confirm_stored(planned[:per_minute])
+
+        futures = [
+            remove_channel_pin_async(channel_id, item['message']['ts'], token)
+            for item in batch
+        ]
+        retry_after = None
+        for item, future in zip(batch, futures):
+            try:
+                response = future.get_result()
+            except SlackRateLimitedException as e:
+                retry_after = max(retry_after, e.retry_after)
+                continue
+            if response.get('ok') or response.get('error') == 'no_pin':
+                unpinned += 1
+            else:
+                logging.warning(
+                    'Could not unpin %s from %s: %s.', item['message']['ts'],
+                    channel_id, response.get('error'))
+
+        if retry_after is not None or len(planned) > per_minute:
+            schedule(
+                channel_id, tenant.team_id, countdown=retry_after or 60,
+                attempt=attempt + 1)
+    finally:
+        release_lease(channel_id, unpinned)
+
+    logging.info('Unpinned %d messages from %s.', unpinned, channel_id)
+    return unpinned
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Fast JSON serialisation of Pins for API responses.
+
+Pin.to_dict() introspects every property of the Pin and its Attachments on
+each call, and jsonify() then pretty-prints the result. The serializer below
+reads a fixed whitelist of fields with precompiled attribute getters and
+encodes them with compact separators.
+
+Encoded pins can optionally be cached in memcache. A Pin's cache key includes
+its version, the time it was last written (Pin.updated), so a write never has
+to drop the old entry: readers of the new version simply miss it, and it
+expires on its own. Nothing written concurrently can bring stale JSON back
+under the new version's key. The key also includes the version of the link
+previews the Pin was rendered with (see pins4days.links.resolve_async()), as
+refreshing a preview doesn't write the Pin.
+
+Whole responses can be cached too, under a key built with
+response_cache_key(). Those keys include a generation number that is bumped
+whenever any Pin is written, so cached responses never outlive a write. The
+generation only lives in memcache. Whenever it's missing, e.g. after an
+eviction, it starts again from the current time in microseconds rather than
+from 0, so it never goes back to a generation whose responses may still be
+cached.
+
+Attributes:
+    ATTACHMENT_FIELDS (tuple): Attachment properties included in responses.
+    CACHE_KEY_PREFIX (str): Prefix of the memcache keys of encoded Pins.
+    CACHE_TTL (int): Seconds an encoded Pin or response stays cached.
+    GENERATION_KEY (str): Memcache key of the Pin generation number.
+    PIN_FIELDS (tuple): Pin properties included in responses, apart from
+    attachments.
+"""
+
+import calendar
+import json
+import time
+from operator import attrgetter
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+
+PIN_FIELDS = (
+    'text', 'author_id', 'pinner_id', 'channel_id', 'pinned_ts', 'created_ts',
+    'ts')
+ATTACHMENT_FIELDS = ('from_url', 'image_url', 'original_url', 'text')
+
+CACHE_KEY_PREFIX = 'pinjson:'
+CACHE_TTL = 24 * 60 * 60
+GENERATION_KEY = 'pins:generation'
+
+_get_pin_fields = attrgetter(*PIN_FIELDS)
+_get_attachment_fields = attrgetter(*ATTACHMENT_FIELDS)
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+
+def serialize_pin(pin):
+    """Builds the JSON friendly dict of a Pin. Same contents as
+    Pin.to_dict().
+
+    Args:
+        pin (Pin): The Pin.
+
+    Returns:
+        dict
+    """
+    data = dict(zip(PIN_FIELDS, _get_pin_fields(pin)))
+    data['attachments'] = [
+        dict(zip(ATTACHMENT_FIELDS, _get_attachment_fields(a)))
+        for a in pin.attachments
+    ]
+    return data
+
+
+def encode_pin(pin):
+    """Encodes a Pin as compact JSON.
+
+    Args:
+        pin (Pin): The Pin.
+
+    Returns:
+        str
+    """
+    return _encode(serialize_pin(pin))
+
+
+def version_of(pin):
+    """
+    Args:
+        pin (Pin): The Pin.
+
+    Returns:
+        int: The Pin's version, microseconds since the epoch when it was last
+        written. 0 if it was written before versions were stamped, or was
+        never written.
+    """
+    updated = getattr(pin, 'updated', None)
+    if updated is None:
+        return 0
+    return calendar.timegm(updated.timetuple()) * 1000000 + updated.microsecond
+
+
+def links_version_of(pin):
+    """
+    Args:
+        pin (Pin): The Pin.
+
+    Returns:
+        int: The version of the newest Link whose preview was filled into
+        the Pin's Attachments by pins4days.links.resolve_async(). 0 if none
+        was.
+    """
+    return getattr(pin, 'links_version', 0)
+
+
+def cache_key(key_id, version=0, links_version=0):
+    """Builds the memcache key of an encoded Pin.
+
+    Args:
+        key_id (str): The Pin's key id.
+        version (int): The Pin's version, see version_of().
+        links_version (int): The version of its previews, see
+        links_version_of().
+
+    Returns:
+        str
+    """
+    return '{}{}:{}:{}'.format(CACHE_KEY_PREFIX, key_id, version, links_version)
+
+
+def _generation_seed():
+    return int(time.time() * 1000000)
+
+
+def invalidate_async():
+    """Bumps the generation number so that cached responses are dropped.
+    Goes through the ndb context so that the memcache calls of a put_multi()
+    are batched.
+
+    Returns:
+        Future
+    """
+    return ndb.get_context().memcache_incr(
+        GENERATION_KEY, initial_value=_generation_seed())
+
+
+def current_generation():
+    """Reads the generation number, starting it from the current time if it
+    is missing.
+
+    Returns:
+        int
+    """
+    generation = memcache.get(GENERATION_KEY)
+    if generation is None:
+        memcache.add(GENERATION_KEY, _generation_seed())
+        generation = memcache.get(GENERATION_KEY) or _generation_seed()
+    return generation
+
+
+def response_cache_key(*parts):
+    """Builds a memcache key for a cached response that lists Pins.
+
+    Args:
+        *parts: Whatever identifies the response, e.g. its query params.
+
+    Returns:
+        str
+    """
+    return 'pinresp:{}:{}'.format(
+        current_generation(),
+        ':'.join(unicode(p) for p in parts).encode('utf-8'))
+
+
+def encode_pins(pins, cache=False):
+    """Encodes a list of Pins as a JSON array.
+
+    Args:
+        pins (list): The Pins.
+        cache (bool): If True, reuse cached encoded Pins and cache the ones
+        that had to be encoded.
+
+    Returns:
+        str
+    """
+    if not cache:
+        return '[' + ','.join(encode_pin(p) for p in pins) + ']'
+
+    keys = [
+        cache_key(p.key.id(), version_of(p), links_version_of(p)) for p in pins
+    ]
+    cached = memcache.get_multi(keys)
+    missing = {}
+    encoded = []
+    for key, pin in zip(keys, pins):
+        if key not in cached:
+            cached[key] = missing[key] = encode_pin(pin)
+        encoded.append(cached[key])
+    context = ndb.get_context()
+    for key, value in missing.items():
+        context.memcache_add(key, value, time=CACHE_TTL)
+    return '[' + ','.join(encoded) + ']'
+
+
+def encode_pins_response(pins, cache=False):
+    """Encodes the body of a GET /api/pins response.
+
+    Args:
+        pins (list): The Pins.
+        cache (bool): See encode_pins().
+
+    Returns:
+        str
+    """
+    return '{"data":{"pins":' + encode_pins(pins, cache=cache) + '}}'
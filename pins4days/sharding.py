@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""Sharded ordering of Pins by creation time.
+
+Pins are listed newest first, so every new Pin lands at the same end of the
+created_ts index. During a large backfill that end becomes a datastore
+hotspot and caps write throughput.
+
+When the 'pin_shards' app config is above 1 (see Pin.set_shards()), each
+Pin also gets a shard_key, e.g. '03:1525829853': a shard number derived from
+the Pin's key id, followed by its zero padded created_ts. New Pins are spread
+over the shards, so the shard_key indexes that listings use are written at
+as many places as there are shards. Each shard keeps its Pins in creation
+order, and the Pin query helpers (Pin.query_all(), Pin.query_user(), ...)
+run one query per shard and merge their results (see ShardedQuery).
+
+created_ts stays indexed either way, as range scans by creation time (see
+pins4days.digests and pins4days.archive) need it. Only the listings move
+off its index; its own single-property index keeps one tail.
+
+Existing Pins get their shard_key when they are written again, e.g. by the
+'resave' migration (see pins4days.migration). Sharded queries don't see Pins
+without one, so the migration must be run right after sharding is switched
+on, and after the number of shards changes, since a Pin's shard depends on
+it. Switching sharding off needs no migration: the unsharded queries use the
+created_ts index, which every Pin is in. Stale shard_keys are cleared the
+next time each Pin is written.
+
+Attributes:
+    TS_DIGITS (int): Width of the zero padded created_ts in a shard_key.
+"""
+
+import heapq
+import zlib
+
+from google.appengine.ext import ndb
+
+
+TS_DIGITS = 10
+
+
+def shard_of(key_id, shards):
+    """
+    Args:
+        key_id (str): A Pin's key id.
+        shards (int): Number of shards.
+
+    Returns:
+        int: The Pin's shard, stable for the lifetime of the Pin.
+    """
+    return (zlib.crc32(key_id.encode('utf-8')) & 0xffffffff) % shards
+
+
+def shard_prefix(shard):
+    """
+    Args:
+        shard (int): A shard.
+
+    Returns:
+        str: The prefix of the shard_keys of the shard's Pins.
+    """
+    return '{:02d}:'.format(shard)
+
+
+def shard_key(key_id, created_ts, shards):
+    """Builds a Pin's shard_key.
+
+    Args:
+        key_id (str): The Pin's key id.
+        created_ts (int or None): The Pin's created_ts.
+        shards (int): Number of shards.
+
+    Returns:
+        str
+    """
+    return shard_prefix(shard_of(key_id, shards)) + '{:0{}d}'.format(
+        created_ts or 0, TS_DIGITS)
+
+
+def shard_range(shard, since=None, before=None):
+    """Builds the shard_key range of a shard's Pins.
+
+    Args:
+        shard (int): The shard.
+        since (int): Optional. Only Pins created at or after this timestamp.
+        before (int): Optional. Only Pins created before this timestamp.
+
+    Returns:
+        tuple: (str, str) the inclusive lower and exclusive upper bound.
+    """
+    prefix = shard_prefix(shard)
+    lower = prefix + ('{:0{}d}'.format(since, TS_DIGITS) if since else '')
+    if before is None:
+        # ';' is the character right after ':'.
+        upper = prefix[:-1] + ';'
+    else:
+        upper = prefix + '{:0{}d}'.format(before, TS_DIGITS)
+    return lower, upper
+
+
+class ShardedQuery(object):
+
+    """One query per shard, read back as if it were a single query ordered
+    by creation time. Supports the parts of the ndb Query API that the app
+    uses. Results are always entities, since the merge needs their
+    created_ts; keys_only and projections aren't supported.
+
+    Also merges the channel batch queries of permission-aware listings (see
+    pins4days.access and pins4days.paging), which are each ordered by
+    created_ts instead.
+    Listings page through it with a cursor (see pins4days.paging), so that
+    each query only reads about a page of results.
+
+    Attributes:
+        queries (list): The shard queries, each ordered by shard_key.
+        reverse (bool): True if the shard queries are ordered newest first.
+    """
+
+    def __init__(self, queries, reverse=True):
+        """
+        Args:
+            queries (list): The shard queries, each ordered by shard_key.
+            reverse (bool): True if they are ordered newest first.
+        """
+        self.queries = queries
+        self.reverse = reverse
+
+    def _decorate(self, shard, entities):
+        # Ties are ordered by key id, as within a single query (see
+        # pins4days.paging). The shard and position keep entities from ever
+        # being compared.
+        sign = -1 if self.reverse else 1
+        for position, entity in enumerate(entities):
+            yield (sign * (entity.created_ts or 0), entity.key.id(), shard,
+                   position, entity)
+
+    def _merge(self, results):
+        merged = heapq.merge(*[
+            self._decorate(shard, entities)
+            for shard, entities in enumerate(results)
+        ])
+        return (entity for _, _, _, _, entity in merged)
+
+    @ndb.tasklet
+    def fetch_async(self, limit=None, offset=0, **options):
+        """k-way merges the first offset + limit results of every shard.
+
+        Args:
+            limit (int): Maximum number of results.
+            offset (int): Number of results to skip.
+            **options: Passed on to every shard query, e.g. batch_size.
+
+        Returns:
+            Future: Resolves to a list.
+        """
+        shard_limit = None if limit is None else offset + limit
+        results = yield [
+            q.fetch_async(shard_limit, **options) for q in self.queries
+        ]
+        merged = list(self._merge(results))
+        end = None if limit is None else offset + limit
+        raise ndb.Return(merged[offset:end])
+
+    def fetch(self, limit=None, offset=0, **options):
+        """See fetch_async()."""
+        return self.fetch_async(limit, offset, **options).get_result()
+
+    @ndb.tasklet
+    def count_async(self, limit=None, **options):
+        """Counts the results of every shard.
+
+        Returns:
+            Future: Resolves to an int.
+        """
+        counts = yield [q.count_async(limit, **options) for q in self.queries]
+        raise ndb.Return(sum(counts))
+
+    def count(self, limit=None, **options):
+        """See count_async()."""
+        return self.count_async(limit, **options).get_result()
+
+    def iter(self, **options):
+        """Iterates over the merged results of every shard, reading each shard
+        in batches.
+
+        Args:
+            **options: Passed on to every shard query, e.g. batch_size.
+
+        Returns:
+            iterator
+        """
+        return self._merge([q.iter(**options) for q in self.queries])
+
+    def __iter__(self):
+        return self.iter()
@@ -0,0 +1,604 @@
+# -*- coding: utf-8 -*-
+"""Pre-rendered static snapshots of pin listings.
+
+When the 'snapshots' app config (or workspace setting, see pins4days.tenants)
+is set, the worker service renders pin listings into static HTML and JSON
+files in the blob store (see pins4days.blobs), under 'snapshots/<token>/',
+where the token is random and different for every workspace (see
+SnapshotPrefix):
+
+- index.html and index.json: the months and channels that have pins, read
+  from the monthly digests (see pins4days.digests),
+- all/latest.html and all/latest.json: the FEED_SIZE newest pins,
+- all/<YYYY-MM>.html and .json: every pin created in the current month,
+- channels/<channel_id>/<YYYY-MM>.html and .json: a channel's pins of the
+  current month,
+- all/<YYYY-MM>.<version>.html and .json, and the same under
+  channels/<channel_id>/: the pages of past months.
+
+The version of a past month's page is a hash of its contents, so its files
+never change: pinning an old message, or refreshing a link preview, renders
+the page under a new name. Those files are cached for the 'snapshot_ttl' app
+config (seconds, default HISTORICAL_TTL); the feed, the index and the current
+month, whose names stay the same, for RECENT_TTL. The current version of
+each past page is kept in a SnapshotPage entity, and a new version schedules
+a render of the feed and the index, which link to it. Replaced versions stay
+in the blob store, so that cached links to them keep working.
+
+Files are gzip-compressed once, when they are written (see
+pins4days.compression), and are publicly readable, so only the token keeps
+them private. Pages only link to each other relatively, so once a reader is
+on a snapshot, browsing old pages is served straight from Cloud Storage,
+without any instance time or datastore reads. Month pages link to other past
+months through the index, so that a new version of one page never changes
+another. With a local blob directory, main serves the files itself under
+/snapshots/ with the same Cache-Control headers.
+
+Storing pins (see pins4days.ingest.store_async()) schedules a render of every
+page the pins appear on, plus the feed and the index, with a single batch of
+named tasks. The tasks coalesce per page for RENDER_DELAY seconds, so a burst
+of pins renders a page once. A nightly cron job renders every page again.
+
+Snapshots are public, so they are never rendered for workspaces with channel
+access control on (see pins4days.access).
+
+Attributes:
+    FEED (str): Label of the page with the newest pins.
+    FEED_SIZE (int): Number of pins on the feed.
+    HISTORICAL_TTL (int): Seconds past months are cached if 'snapshot_ttl'
+    isn't set.
+    RECENT_TTL (int): Seconds the feed, the index and the current month are
+    cached.
+    RENDER_DELAY (int): Seconds between storing a pin and rendering its pages.
+    VERSION_DIGITS (int): Length of the versions of past months' pages.
+"""
+
+import calendar
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+import jinja2
+from google.appengine.api import namespace_manager
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from pins4days import access
+from pins4days import archive
+from pins4days import compression
+from pins4days import links
+from pins4days.blobs import get_blob_store
+from pins4days.blobs import GcsBlobStore
+from pins4days.constants import QUEUE_SNAPSHOTS
+from pins4days.digests import bucket_label
+from pins4days.digests import bucket_start
+from pins4days.digests import next_start
+from pins4days.digests import PERIOD_MONTH
+from pins4days.models.archive import ArchivedPin
+from pins4days.models.digest import Digest
+from pins4days.models.pin import Pin
+from pins4days.models.snapshot import SnapshotPage
+from pins4days.models.snapshot import SnapshotPrefix
+from pins4days.serializers import encode_pins_response
+from pins4days.tenants import get_namespace_tenant
+from pins4days.tenants import UnknownTenantException
+
+
+FEED = 'latest'
+FEED_SIZE = 50
+HISTORICAL_TTL = 365 * 24 * 60 * 60
+RECENT_TTL = 5 * 60
+RENDER_DELAY = 60
+VERSION_DIGITS = 12
+
+ROOT_PATH = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+GCS_BASE_URL = 'https://storage.googleapis.com/{}/'
+CONTENT_TYPES = {'html': 'text/html', 'json': 'application/json'}
+
+_MONTH = re.compile(r'^\d{4}-\d{2}$')
+_VERSIONED_NAME = re.compile(
+    r'\.[0-9a-f]{%d}\.(?:html|json)$' % VERSION_DIGITS)
+_environment = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(os.path.join(ROOT_PATH, 'templates')),
+    autoescape=True)
+_state = {}
+
+
+def init_app(app):
+    """Renders snapshots of the pins that an app stores, if its app config
+    turns them on.
+
+    Args:
+        app (Flask): The app.
+    """
+    _state['app_config'] = app.config
+
+
+def is_enabled(tenant):
+    """
+    Args:
+        tenant (Tenant): The workspace.
+
+    Returns:
+        bool: True if the workspace's listings are rendered to snapshots.
+    """
+    return bool(tenant.setting('snapshots')) and not access.is_enabled(tenant)
+
+
+def current_tenant(app_config):
+    """
+    Args:
+        app_config (dict): The app config.
+
+    Returns:
+        Tenant or None: The workspace of the current namespace, or None if no
+        workspace uses it.
+    """
+    try:
+        return get_namespace_tenant(
+            app_config, namespace_manager.get_namespace())
+    except UnknownTenantException:
+        return None
+
+
+def month_label(created_ts):
+    """
+    Args:
+        created_ts (int): A Pin's created_ts.
+
+    Returns:
+        str: The Pin's month, as YYYY-MM.
+    """
+    return bucket_label(PERIOD_MONTH, bucket_start(PERIOD_MONTH, created_ts))
+
+
+def month_start(label):
+    """
+    Args:
+        label (str): A month, as YYYY-MM.
+
+    Returns:
+        int: Timestamp of the start of the month.
+    """
+    return calendar.timegm(time.strptime(label, '%Y-%m'))
+
+
+def _month_of(pin):
+    return month_label(pin.created_ts) if pin.created_ts else None
+
+
+def is_past_month(label, now=None):
+    """
+    Args:
+        label (str): FEED, 'index', or a month as YYYY-MM.
+        now (int): Optional. The current timestamp.
+
+    Returns:
+        bool: True if the label is a month before the current one, whose
+        pages have versioned names.
+    """
+    return bool(_MONTH.match(label)) and label < month_label(
+        int(now or time.time()))
+
+
+def page_path(channel_id, label, extension, version=None):
+    """
+    Args:
+        channel_id (str or None): The page's channel, or None for all pins.
+        label (str): FEED, or the page's month as YYYY-MM.
+        extension (str): 'html' or 'json'.
+        version (str): Optional. The version of a past month's page.
+
+    Returns:
+        str: The page's path, relative to its namespace's snapshots.
+    """
+    scope = 'channels/{}'.format(channel_id) if channel_id else 'all'
+    if version:
+        label = '{}.{}'.format(label, version)
+    return '{}/{}.{}'.format(scope, label, extension)
+
+
+def get_versions(pages):
+    """Reads the current versions of past months' pages, with one batched
+    read.
+
+    Args:
+        pages (iterable): (channel_id, label) tuples, see page_path().
+
+    Returns:
+        dict: Versions by (channel_id, label), for the pages that have one.
+    """
+    pages = list(pages)
+    stored = ndb.get_multi([
+        ndb.Key(SnapshotPage, SnapshotPage.build_key_id(channel_id, label))
+        for channel_id, label in pages
+    ])
+    return dict(
+        (page, entity.version)
+        for page, entity in zip(pages, stored) if entity is not None)
+
+
+def _linker(root, now, versions=None):
+    # Builds the relative URL of a page. Without versions, past months are
+    # linked through their entry in the index; pages of past months use
+    # that, so they never need to change when another page gets a new
+    # version. A past month without a version yet is still under the name
+    # it was rendered under while it was the current month.
+    def link(channel_id, label):
+        if is_past_month(label, now):
+            if versions is None:
+                return '{}index.html#{}'.format(root, label)
+            return root + page_path(
+                channel_id, label, 'html', versions.get((channel_id, label)))
+        return root + page_path(channel_id, label, 'html')
+    return link
+
+
+def blob_name(path, namespace=None):
+    """
+    Args:
+        path (str): A snapshot's path, e.g. from page_path().
+        namespace (str): Optional. Defaults to the current namespace.
+
+    Returns:
+        str: The snapshot's blob name.
+    """
+    return 'snapshots/{}/{}'.format(SnapshotPrefix.get_token(namespace), path)
+
+
+def public_url(app_config, name):
+    """Builds the public URL of a blob. 'snapshot_base_url' in the app
+    config overrides the blob store's own base URL, e.g. for a CDN.
+
+    Args:
+        app_config (dict): The app config.
+        name (str): The blob's name, e.g. from blob_name().
+
+    Returns:
+        str
+    """
+    base_url = app_config.get('snapshot_base_url')
+    if not base_url:
+        store = get_blob_store(app_config)
+        if isinstance(store, GcsBlobStore):
+            base_url = GCS_BASE_URL.format(store.bucket)
+        else:
+            # Served by main's /snapshots/ route, see read().
+            base_url = '/'
+    return base_url + name
+
+
+def snapshot_url(app_config, path='index.html', namespace=None):
+    """
+    Args:
+        app_config (dict): The app config.
+        path (str): A snapshot's path. Defaults to the index.
+        namespace (str): Optional. Defaults to the current namespace.
+
+    Returns:
+        str: The public URL of the snapshot.
+    """
+    return public_url(app_config, blob_name(path, namespace))
+
+
+def cache_ttl(app_config, path):
+    """
+    Args:
+        app_config (dict): The app config.
+        path (str): A snapshot's path or blob name.
+
+    Returns:
+        int: Seconds the snapshot may be cached for: long for the versioned
+        pages of past months, which never change.
+    """
+    if _VERSIONED_NAME.search(path):
+        return int(app_config.get('snapshot_ttl', HISTORICAL_TTL))
+    return RECENT_TTL
+
+
+def _write(store, name, body, extension, ttl):
+    store.write(
+        name,
+        compression.compress(body),
+        content_type=CONTENT_TYPES[extension],
+        options={
+            'content-encoding': compression.GZIP,
+            'cache-control': 'public, max-age={}'.format(ttl),
+            'x-goog-acl': 'public-read'
+        })
+
+
+def read(app_config, name):
+    """Reads a snapshot. Used to serve snapshots from a local blob
+    directory; snapshots in Cloud Storage are served by Cloud Storage.
+
+    Args:
+        app_config (dict): The app config.
+        name (str): The snapshot's blob name, e.g. from blob_name().
+
+    Returns:
+        tuple: (str, str, int) the gzipped snapshot, its content type and
+        cache TTL, or None if it doesn't exist.
+    """
+    parts = name.split('/')
+    extension = parts[-1].rpartition('.')[2]
+    if (parts[0] != 'snapshots' or '..' in parts or '' in parts or
+            extension not in CONTENT_TYPES):
+        return None
+    try:
+        data = get_blob_store(app_config).read(name)
+    except (IOError, OSError):
+        return None
+    return data, CONTENT_TYPES[extension], cache_ttl(app_config, name)
+
+
+def render_task(channel_id, label, countdown=RENDER_DELAY):
+    """Builds the task that renders a page in the current namespace. Tasks
+    are named after the page and the RENDER_DELAY window they run in, so
+    pages are rendered at most once per window, after every pin stored
+    before it.
+
+    Args:
+        channel_id (str or None): The page's channel, or None for all pins.
+        label (str): FEED, or the page's month as YYYY-MM.
+        countdown (int): Seconds before the render runs.
+
+    Returns:
+        Task
+    """
+    namespace = namespace_manager.get_namespace() or '_'
+    task_name = 'snapshot-{}-{}-{}-{}'.format(
+        re.sub(r'[^0-9A-Za-z_-]', '_', namespace),
+        re.sub(r'[^0-9A-Za-z_-]', '_', channel_id or '_all'),
+        label,
+        int(time.time() + countdown) // RENDER_DELAY)
+    return taskqueue.Task(
+        name=task_name,
+        url='/worker/snapshots/render',
+        target='worker',
+        method='POST',
+        countdown=countdown,
+        params={'channel_id': channel_id or '', 'label': label})
+
+
+def enqueue_renders(pages, countdown=RENDER_DELAY):
+    """Enqueues renders of pages in the current namespace, up to
+    MAX_TASKS_PER_ADD in a single taskqueue call. See render_task().
+
+    Args:
+        pages (iterable): (channel_id, label) tuples, see render_task().
+        countdown (int): Seconds before the renders run.
+    """
+    tasks = [
+        render_task(channel_id, label, countdown)
+        for channel_id, label in sorted(pages)
+    ]
+    queue = taskqueue.Queue(QUEUE_SNAPSHOTS)
+    for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+        try:
+            queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            # The rest of the batch is still added.
+            pass
+
+
+def schedule(pins):
+    """Schedules renders of the pages that newly stored Pins appear on, if
+    the current workspace has snapshots turned on. The feed render also
+    renders the index.
+
+    Args:
+        pins (list): The Pins.
+    """
+    app_config = _state.get('app_config')
+    if app_config is None:
+        return
+    tenant = current_tenant(app_config)
+    if tenant is None or not is_enabled(tenant):
+        return
+
+    pages = set([(None, FEED)])
+    for pin in pins:
+        label = _month_of(pin)
+        if label:
+            pages.add((None, label))
+            pages.add((pin.channel_id, label))
+    enqueue_renders(pages)
+
+
+def list_months(channel_id=None):
+    """Lists the months that have pins, from the monthly digests.
+
+    Args:
+        channel_id (str): Optional. Only this channel's months.
+
+    Returns:
+        list: (str, int, dict) tuples of the month as YYYY-MM, its number of
+        pins, and the number of pins per channel, newest first.
+    """
+    months = {}
+    for digest in Digest.query_period(PERIOD_MONTH, 0, channel_id):
+        label = bucket_label(PERIOD_MONTH, digest.start)
+        count, channels = months.setdefault(label, (0, {}))
+        channels[digest.channel_id] = digest.count
+        months[label] = (count + digest.count, channels)
+    return [
+        (label, count, channels)
+        for label, (count, channels) in sorted(months.items(), reverse=True)
+    ]
+
+
+def fetch_month(app_config, label, channel_id=None):
+    """Fetches every Pin created in a month, live or archived, newest first,
+    with their link previews.
+
+    Args:
+        app_config (dict): The app config.
+        label (str): The month, as YYYY-MM.
+        channel_id (str): Optional. Only this channel's Pins.
+
+    Returns:
+        list: The Pins.
+    """
+    start = month_start(label)
+    end = next_start(PERIOD_MONTH, start)
+    pins = Pin.query_created_between(start, end, channel_id).fetch()
+    if archive.is_enabled(app_config):
+        live = set(p.key.id() for p in pins)
+        stubs = [
+            s for s in ArchivedPin.query_created_between(
+                start, end, channel_id).fetch()
+            if s.key.id() not in live
+        ]
+        pins = sorted(
+            pins + archive.hydrate(stubs, get_blob_store(app_config)),
+            key=lambda p: p.created_ts or 0, reverse=True)
+    return links.resolve_async(pins).get_result()
+
+
+def fetch_feed(app_config):
+    """Fetches the FEED_SIZE newest Pins, with their link previews.
+
+    Args:
+        app_config (dict): The app config.
+
+    Returns:
+        list: The Pins.
+    """
+    if archive.is_enabled(app_config):
+        pins, _ = archive.fetch_page_async(
+            Pin.query_all, ArchivedPin.query_all, FEED_SIZE, None,
+            get_blob_store(app_config)).get_result()
+    else:
+        pins = Pin.query_all().fetch(FEED_SIZE)
+    return links.resolve_async(pins).get_result()
+
+
+def _stylesheet():
+    with open(os.path.join(ROOT_PATH, 'static', 'style.css')) as f:
+        return f.read().decode('utf-8')
+
+
+def render_page(app_config, channel_id, label, now=None):
+    """Renders a page to HTML and JSON snapshots in the current namespace.
+    A past month's page is only written if its contents changed, under its
+    new version, and then the feed and the index are rendered again.
+
+    Args:
+        app_config (dict): The app config.
+        channel_id (str or None): The page's channel, or None for all pins.
+        label (str): FEED, or the page's month as YYYY-MM.
+        now (int): Optional. The current timestamp.
+
+    Returns:
+        int: Number of Pins on the page.
+    """
+    now = int(now or time.time())
+    months = [m[0] for m in list_months(channel_id)]
+    root = '../../' if channel_id else '../'
+    if label == FEED:
+        pins = fetch_feed(app_config)
+        title = 'latest pins'
+        newer, older = None, months[0] if months else None
+        linked = set((p.channel_id, _month_of(p)) for p in pins)
+        linked.add((None, older))
+        link = _linker(root, now, get_versions(
+            (c, m) for c, m in linked if m and is_past_month(m, now)))
+    else:
+        pins = fetch_month(app_config, label, channel_id)
+        title = '{} in {}'.format(label, channel_id or 'all channels')
+        newer = min([m for m in months if m > label] or [None])
+        older = max([m for m in months if m < label] or [None])
+        if newer is None and not channel_id:
+            newer = FEED
+        link = _linker(root, now)
+
+    html = _environment.get_template('snapshot.html').render(
+        title=title,
+        pins=pins,
+        root=root,
+        newer_url=newer and link(channel_id, newer),
+        older_url=older and link(channel_id, older),
+        month_of=_month_of,
+        page_url=link,
+        stylesheet=_stylesheet()).encode('utf-8')
+    body = encode_pins_response(pins)
+    store = get_blob_store(app_config)
+    version = None
+    if is_past_month(label, now):
+        version = hashlib.sha1(html + '\0' + body).hexdigest()[:VERSION_DIGITS]
+        page = SnapshotPage.get_or_insert(
+            SnapshotPage.build_key_id(channel_id, label))
+        if page.version == version:
+            return len(pins)
+    for extension, data in (('html', html), ('json', body)):
+        path = page_path(channel_id, label, extension, version)
+        _write(store, blob_name(path), data, extension,
+               cache_ttl(app_config, path))
+    if version:
+        page.version = version
+        page.put()
+        enqueue_renders([(None, FEED)])
+    return len(pins)
+
+
+def render_index(app_config, now=None):
+    """Renders the index of months and channels to HTML and JSON snapshots
+    in the current namespace. It links to the current version of every
+    page.
+
+    Args:
+        app_config (dict): The app config.
+        now (int): Optional. The current timestamp.
+
+    Returns:
+        int: Number of months listed.
+    """
+    now = int(now or time.time())
+    listed = list_months()
+    versions = get_versions(
+        (c, label)
+        for label, _, channels in listed if is_past_month(label, now)
+        for c in [None] + sorted(channels))
+    link = _linker('', now, versions)
+    months = [
+        {
+            'label': label,
+            'count': count,
+            'path': link(None, label),
+            'channels': [
+                {'channel_id': c, 'count': n, 'path': link(c, label)}
+                for c, n in sorted(channels.items())
+            ]
+        }
+        for label, count, channels in listed
+    ]
+    html = _environment.get_template('snapshot_index.html').render(
+        months=months, stylesheet=_stylesheet())
+    store = get_blob_store(app_config)
+    _write(store, blob_name('index.html'), html.encode('utf-8'), 'html',
+           RECENT_TTL)
+    _write(store, blob_name('index.json'),
+           json.dumps({'data': {'months': months}}, separators=(',', ':')),
+           'json', RECENT_TTL)
+    return len(months)
+
+
+def rebuild():
+    """Enqueues a render of every page of the current namespace. Called by
+    the worker's nightly cron job.
+
+    Returns:
+        int: Number of renders enqueued.
+    """
+    pages = set([(None, FEED)])
+    for label, _, channels in list_months():
+        pages.add((None, label))
+        pages.update((channel_id, label) for channel_id in channels)
+    enqueue_renders(pages, countdown=0)
+    logging.info('Enqueued %d snapshot renders.', len(pages))
+    return len(pages)
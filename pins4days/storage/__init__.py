@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Pluggable storage of Users.
+
+The app reads and writes Users through a repository (see
+pins4days.storage.base) instead of the ndb models:
+
+- NdbRepository (pins4days.storage.ndb_repository, the default) wraps the
+  User model, i.e. the datastore on App Engine.
+- SqliteRepository (pins4days.storage.sqlite_repository) keeps Users in an
+  indexed SQLite database. It doesn't need the App Engine SDK, which makes it
+  suitable for fast tests and local development. The 'user_storage' app
+  config picks it (see init_app()).
+
+Pins aren't stored through repositories: listings need archived pins,
+sharding, channel access control and link previews, which only the ndb
+models support.
+
+Repository modules are only imported when they are used, so importing this
+package never imports the App Engine SDK.
+
+Attributes:
+    BACKENDS (tuple): The values of the 'user_storage' app config.
+"""
+
+BACKENDS = ('ndb', 'sqlite')
+
+_repository = None
+
+
+def get_repository():
+    """Gets the repository in use. Defaults to an NdbRepository.
+
+    Returns:
+        Repository
+    """
+    global _repository
+    if _repository is None:
+        from pins4days.storage.ndb_repository import NdbRepository
+        _repository = NdbRepository()
+    return _repository
+
+
+def set_repository(repository):
+    """Sets the repository to use, e.g. a SqliteRepository.
+
+    Args:
+        repository (Repository): The repository. None restores the default.
+    """
+    global _repository
+    _repository = repository
+
+
+def init_app(app):
+    """Picks the repository from the app config: 'user_storage' is 'ndb'
+    (the default) or 'sqlite', in which case 'user_storage_path' is the
+    database file (default: an in-memory database).
+
+    Args:
+        app (Flask): The app.
+
+    Raises:
+        ValueError: If 'user_storage' is unknown.
+    """
+    backend = app.config.get('user_storage', 'ndb')
+    if backend not in BACKENDS:
+        raise ValueError("Unknown user_storage '{}'.".format(backend))
+    if backend == 'sqlite':
+        from pins4days.storage.sqlite_repository import SqliteRepository
+        set_repository(SqliteRepository(
+            app.config.get('user_storage_path', ':memory:')))
+    else:
+        set_repository(None)
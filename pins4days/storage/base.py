@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""The repository interface that every storage backend implements. See
+pins4days.storage.
+
+Users are returned as whatever objects the backend uses (an ndb model for
+NdbRepository, plain records for SqliteRepository), but they always have the
+attributes of pins4days.models.user.User, plus a username.
+"""
+
+
+class UserRepository(object):
+
+    """Stores Users and checks their passwords."""
+
+    def get(self, username):
+        """
+        Args:
+            username (str): The username.
+
+        Returns:
+            The User, or None if it doesn't exist.
+        """
+        raise NotImplementedError
+
+    def create_with_encryption(self, username, password):
+        """Creates a User, encrypting their password, unless the username is
+        taken. See User.create_with_encryption().
+
+        Args:
+            username (str): The username.
+            password (str): The password, unencrypted.
+
+        Returns:
+            bool: True if the User was created.
+        """
+        raise NotImplementedError
+
+    def link_slack_identity(self, username, team_id, slack_user_id):
+        """Stores a Slack identity that Slack confirmed. See
+        User.link_slack_identity().
+
+        Args:
+            username (str): The username.
+            team_id (str): The user's Slack team ID.
+            slack_user_id (str): The user's Slack user ID.
+
+        Returns:
+            The updated User, or None if it doesn't exist.
+        """
+        raise NotImplementedError
+
+    def login(self, username, submitted_pw):
+        """Looks up a User and checks their password. See User.login().
+
+        Args:
+            username (str): The username.
+            submitted_pw (str): The submitted password.
+
+        Returns:
+            The User.
+
+        Raises:
+            EntityDoesNotExistException: Thrown if the User does not exist.
+            IncorrectPasswordException: Thrown if the password is wrong.
+        """
+        raise NotImplementedError
+
+
+class Repository(object):
+
+    """A storage backend.
+
+    Attributes:
+        users (UserRepository): Where Users are stored.
+    """
+
+    def __init__(self, users):
+        """
+        Args:
+            users (UserRepository): Where Users are stored.
+        """
+        self.users = users
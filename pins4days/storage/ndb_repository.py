@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""Storage backend that wraps the ndb models. See pins4days.storage."""
+
+from pins4days.models.user import User
+from pins4days.storage.base import Repository
+from pins4days.storage.base import UserRepository
+
+
+class NdbUserRepository(UserRepository):
+
+    """Stores Users in the datastore's default namespace."""
+
+    def get(self, username):
+        return User.get_by_id(username, namespace='')
+
+    def create_with_encryption(self, username, password):
+        return User.create_with_encryption(id=username, password=password)
+
+    def link_slack_identity(self, username, team_id, slack_user_id):
+        return User.link_slack_identity(username, team_id, slack_user_id)
+
+    def login(self, username, submitted_pw):
+        return User.login(username, submitted_pw)
+
+
+class NdbRepository(Repository):
+
+    """The datastore backend."""
+
+    def __init__(self):
+        super(NdbRepository, self).__init__(NdbUserRepository())
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Storage backend on an indexed SQLite database. See pins4days.storage.
+
+Doesn't import the App Engine SDK. Users are plain records with the same
+attributes as the ndb model.
+"""
+
+import sqlite3
+import threading
+
+from pins4days.models.exceptions import EntityDoesNotExistException
+from pins4days.models.exceptions import IncorrectPasswordException
+from pins4days.passwords import compare_passwords
+from pins4days.passwords import encrypt_password
+from pins4days.storage.base import Repository
+from pins4days.storage.base import UserRepository
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    team_id TEXT,
+    slack_user_id TEXT,
+    slack_verified INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class UserRecord(object):
+
+    """A User stored in SQLite. See pins4days.models.user.User."""
+
+    def __init__(self, username, password, team_id=None, slack_user_id=None,
+                 slack_verified=False):
+        self.username = username
+        self.password = password
+        self.team_id = team_id
+        self.slack_user_id = slack_user_id
+        self.slack_verified = bool(slack_verified)
+
+
+class SqliteUserRepository(UserRepository):
+
+    """Stores Users in SQLite. See SqliteRepository."""
+
+    def __init__(self, database):
+        self.database = database
+
+    def get(self, username):
+        rows = self.database.fetchall(
+            'SELECT username, password, team_id, slack_user_id, slack_verified '
+            'FROM users WHERE username = ?',
+            (username,))
+        return UserRecord(*rows[0]) if rows else None
+
+    def create_with_encryption(self, username, password):
+        if self.get(username) is not None:
+            return False
+        return self.database.execute(
+            'INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)',
+            (username, encrypt_password(password))) == 1
+
+    def link_slack_identity(self, username, team_id, slack_user_id):
+        self.database.execute(
+            'UPDATE users SET team_id = ?, slack_user_id = ?, slack_verified = 1 '
+            'WHERE username = ?',
+            (team_id, slack_user_id, username))
+        return self.get(username)
+
+    def login(self, username, submitted_pw):
+        user = self.get(username)
+        if user is None:
+            raise EntityDoesNotExistException(
+                "User with username '{}' does not exist.".format(username))
+        if not compare_passwords(user.password, submitted_pw):
+            raise IncorrectPasswordException
+        return user
+
+
+class Database(object):
+
+    """A SQLite connection that can be shared between threads. Every
+    statement runs in its own transaction.
+
+    Attributes:
+        path (str): The database file, or ':memory:'.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The database file, or ':memory:'.
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.executescript(SCHEMA)
+
+    def execute(self, sql, params=()):
+        """Runs a statement.
+
+        Args:
+            sql (str): The statement.
+            params (tuple): Its parameters.
+
+        Returns:
+            int: Number of rows changed.
+        """
+        with self._lock, self._connection:
+            return self._connection.execute(sql, params).rowcount
+
+    def executemany(self, sql, rows):
+        """Runs a statement once per row, in a single transaction.
+
+        Args:
+            sql (str): The statement.
+            rows (list): The parameters of each run.
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(sql, rows)
+
+    def fetchall(self, sql, params=()):
+        """Runs a query.
+
+        Args:
+            sql (str): The query.
+            params (tuple): Its parameters.
+
+        Returns:
+            list: The rows.
+        """
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def close(self):
+        """Closes the connection."""
+        self._connection.close()
+
+
+class SqliteRepository(Repository):
+
+    """The SQLite backend.
+
+    Attributes:
+        database (Database): The database.
+    """
+
+    def __init__(self, path=':memory:'):
+        """
+        Args:
+            path (str): The database file. Defaults to an in-memory database.
+        """
+        self.database = Database(path)
+        super(SqliteRepository, self).__init__(
+            SqliteUserRepository(self.database))
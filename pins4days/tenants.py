@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Multi-workspace (multi-tenant) support.
+
+A deployment serves a single Slack workspace unless the 'teams' app config is
+set. 'teams' maps each Slack team ID to that workspace's settings, which
+override the top-level app config values of the same name:
+
+    flask_app_config:
+      slack_signing_secret: "..."
+      teams:
+        T0123:
+          slack_user_token: "..."
+          slack_verification_token: "..."
+          max_pins_per_minute: 600
+
+Each workspace's pins are stored in its own datastore namespace. Memcache is
+namespaced the same way, so every cache key (encoded pins, cached responses,
+the pin generation number) is automatically prefixed per workspace. Users are
+global and always live in the default namespace. A user's workspace is the
+Slack team ID that Slack confirmed for them, see pins4days.identity.
+
+Attributes:
+    DEFAULT_MAX_PINS_PER_MINUTE (int): Pins a workspace may enqueue per
+    minute before its tasks get delayed, if 'max_pins_per_minute' isn't set.
+    NAMESPACE_HEADER (str): The task queue request header that carries the
+    namespace a task was enqueued in.
+"""
+
+import re
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import namespace_manager
+
+
+DEFAULT_MAX_PINS_PER_MINUTE = 1200
+NAMESPACE_HEADER = 'X-AppEngine-Current-Namespace'
+
+_QUOTA_WINDOW = 60
+
+
+class UnknownTenantException(Exception):
+    """Should be thrown when a request is for a workspace that isn't
+    configured.
+    """
+    pass
+
+
+class Tenant(object):
+
+    """A Slack workspace served by this deployment.
+
+    Attributes:
+        app_config (dict): The app config.
+        namespace (str): The datastore and memcache namespace of the
+        workspace. Empty for the single workspace of a single-tenant
+        deployment.
+        team_id (str or None): The Slack team ID. None for single-tenant
+        deployments.
+    """
+
+    def __init__(self, team_id, app_config):
+        """
+        Args:
+            team_id (str or None): The Slack team ID.
+            app_config (dict): The app config.
+        """
+        self.team_id = team_id
+        self.app_config = app_config
+        self.namespace = namespace_for(team_id)
+
+    def setting(self, key, default=None):
+        """Looks up a setting, preferring the workspace's own value.
+
+        Args:
+            key (str): The setting.
+            default: Returned if the setting isn't set anywhere.
+
+        Returns:
+            The setting's value.
+        """
+        team_config = (self.app_config.get('teams') or {}).get(self.team_id) or {}
+        if key in team_config:
+            return team_config[key]
+        return self.app_config.get(key, default)
+
+    def activate(self):
+        """Makes the workspace's namespace the current namespace."""
+        namespace_manager.set_namespace(self.namespace)
+
+    def enqueue_delay(self, count):
+        """Counts pins against the workspace's per-minute quota, and works out
+        how long their tasks should be delayed so that the workspace stays
+        within its quota. A noisy workspace only delays its own pins.
+
+        Args:
+            count (int): Number of pins about to be enqueued.
+
+        Returns:
+            int: Task countdown in seconds.
+        """
+        limit = self.setting('max_pins_per_minute', DEFAULT_MAX_PINS_PER_MINUTE)
+        window = int(time.time()) // _QUOTA_WINDOW
+        key = 'quota:{}:{}'.format(self.team_id or '', window)
+        used = memcache.incr(
+            key, count, namespace='', initial_value=0) or count
+        windows_ahead = (used - 1) // limit
+        return windows_ahead * _QUOTA_WINDOW
+
+
+def is_multi_tenant(app_config):
+    """
+    Args:
+        app_config (dict): The app config.
+
+    Returns:
+        bool: True if the deployment serves more than one workspace.
+    """
+    return bool(app_config.get('teams'))
+
+
+def namespace_for(team_id):
+    """Builds the namespace of a workspace.
+
+    Args:
+        team_id (str or None): The Slack team ID.
+
+    Returns:
+        str: Empty (the default namespace) if team_id is None.
+    """
+    if not team_id:
+        return ''
+    return 'team-' + re.sub(r'[^0-9A-Za-z._-]', '_', team_id)
+
+
+def list_namespaces(app_config):
+    """Lists the namespaces of every workspace the deployment serves, e.g. for
+    cron jobs that must run once per workspace.
+
+    Args:
+        app_config (dict): The app config.
+
+    Returns:
+        list: The namespaces, [''] for single-tenant deployments.
+    """
+    if not is_multi_tenant(app_config):
+        return ['']
+    return sorted(namespace_for(team_id) for team_id in app_config['teams'])
+
+
+def get_namespace_tenant(app_config, namespace):
+    """Finds the workspace whose pins are stored in a namespace, e.g. in a
+    task that only knows its namespace.
+
+    Args:
+        app_config (dict): The app config.
+        namespace (str): The namespace.
+
+    Returns:
+        Tenant
+
+    Raises:
+        UnknownTenantException: Thrown if no workspace uses the namespace.
+    """
+    if not is_multi_tenant(app_config):
+        if namespace:
+            raise UnknownTenantException(
+                "Namespace '{}' is not configured.".format(namespace))
+        return Tenant(None, app_config)
+    for team_id in app_config['teams']:
+        if namespace_for(team_id) == namespace:
+            return Tenant(team_id, app_config)
+    raise UnknownTenantException(
+        "Namespace '{}' is not configured.".format(namespace))
+
+
+def get_tenant(app_config, team_id):
+    """Finds the workspace a request is for.
+
+    Single-tenant deployments always return their only workspace.
+
+    Args:
+        app_config (dict): The app config.
+        team_id (str or None): The Slack team ID sent with the request.
+
+    Returns:
+        Tenant
+
+    Raises:
+        UnknownTenantException: Thrown if the deployment is multi-tenant and
+        team_id isn't one of its workspaces.
+    """
+    if not is_multi_tenant(app_config):
+        return Tenant(None, app_config)
+    if team_id not in app_config['teams']:
+        raise UnknownTenantException(
+            "Team '{}' is not configured.".format(team_id))
+    return Tenant(team_id, app_config)
@@ -5,12 +5,29 @@
 from config import AppConfig
 import os
 import json
+import urllib
 
 from google.appengine.api import urlfetch
+from google.appengine.ext import ndb
 from werkzeug.urls import Href
 
 from pins4days.constants import LOCAL_APP_CONFIG_PATH_KEY
 from pins4days.constants import REMOTE_APP_CONFIG_PATH_KEY
+from pins4days.constants import SLACK_OAUTH_URL
+
+
+class SlackRateLimitedException(Exception):
+    """Should be thrown when Slack rejects a request because of its rate
+    limits.
+
+    Attributes:
+        retry_after (int): Seconds to wait before trying again.
+    """
+
+    def __init__(self, retry_after):
+        super(SlackRateLimitedException, self).__init__(
+            'Rate limited, retry after {}s'.format(retry_after))
+        self.retry_after = retry_after
 
 
 def load_config():
@@ -36,13 +53,130 @@ def get_channel_pins(channel_id, token):
     Returns:
         str: Response as a JSON string.
 
+    Raises:
+        Exception: Description
+    """
+    return get_channel_pins_async(channel_id, token).get_result()
+
+
+@ndb.tasklet
+def get_channel_pins_async(channel_id, token):
+    """Asynchronous version of get_channel_pins(). The fetch goes through the
+    ndb context so it can run alongside datastore, memcache and task queue
+    RPCs.
+
+    Args:
+        channel_id (str): Slack channel ID.
+        token (str): Slack user token.
+
+    Returns:
+        Future: Resolves to the response as a dict.
+
     Raises:
         Exception: Description
     """
     href = Href('https://slack.com/api/pins.list')
     url = href({'channel': channel_id, 'token': token})
-    result = urlfetch.fetch(url)
+    result = yield ndb.get_context().urlfetch(url)
+    if result.status_code == 200:
+        raise ndb.Return(json.loads(result.content))
+
+    raise Exception('resultz {} {}'.format(result.status_code, result.content))
+
+
+@ndb.tasklet
+def remove_channel_pin_async(channel_id, ts, token):
+    """Unpins a message from a channel.
+
+    Args:
+        channel_id (str): Slack channel ID.
+        ts (str): The message's timestamp.
+        token (str): Slack user token.
+
+    Returns:
+        Future: Resolves to the response as a dict.
+
+    Raises:
+        SlackRateLimitedException: Thrown if Slack's rate limit was hit.
+        Exception: Thrown for any other unsuccessful response status.
+    """
+    payload = urllib.urlencode(
+        {'channel': channel_id, 'timestamp': ts, 'token': token})
+    result = yield ndb.get_context().urlfetch(
+        'https://slack.com/api/pins.remove',
+        payload=payload,
+        method='POST',
+        headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    if result.status_code == 429:
+        raise SlackRateLimitedException(
+            int(result.headers.get('retry-after', 60)))
+    if result.status_code == 200:
+        raise ndb.Return(json.loads(result.content))
+
+    raise Exception('resultz {} {}'.format(result.status_code, result.content))
+
+
+@ndb.tasklet
+def get_user_conversations_async(user_id, token, types, cursor=None):
+    """Fetches a page of the conversations a user is a member of.
+
+    Args:
+        user_id (str): Slack user ID.
+        token (str): Slack user token.
+        types (str): Comma separated conversation types, e.g.
+        'public_channel,private_channel'.
+        cursor (str): Optional. The next_cursor of the previous page.
+
+    Returns:
+        Future: Resolves to the response as a dict.
+
+    Raises:
+        SlackRateLimitedException: Thrown if Slack's rate limit was hit.
+        Exception: Thrown for any other unsuccessful response status.
+    """
+    href = Href('https://slack.com/api/users.conversations')
+    params = {'user': user_id, 'token': token, 'types': types, 'limit': 1000}
+    if cursor:
+        params['cursor'] = cursor
+    result = yield ndb.get_context().urlfetch(href(params))
+    if result.status_code == 429:
+        raise SlackRateLimitedException(
+            int(result.headers.get('retry-after', 60)))
+    if result.status_code == 200:
+        raise ndb.Return(json.loads(result.content))
+
+    raise Exception('resultz {} {}'.format(result.status_code, result.content))
+
+
+@ndb.tasklet
+def get_oauth_access_async(code, client_id, client_secret, redirect_uri):
+    """Exchanges an OAuth code for an access token and, for "Sign in with
+    Slack", the identity of the user who authorized it.
+
+    Args:
+        code (str): The code Slack redirected the user back with.
+        client_id (str): The Slack app's client ID.
+        client_secret (str): The Slack app's client secret.
+        redirect_uri (str): The redirect URI the code was issued for.
+
+    Returns:
+        Future: Resolves to the response as a dict.
+
+    Raises:
+        Exception: Thrown for any unsuccessful response status.
+    """
+    payload = urllib.urlencode({
+        'code': code,
+        'client_id': client_id,
+        'client_secret': client_secret,
+        'redirect_uri': redirect_uri,
+    })
+    result = yield ndb.get_context().urlfetch(
+        SLACK_OAUTH_URL,
+        payload=payload,
+        method='POST',
+        headers={'Content-Type': 'application/x-www-form-urlencoded'})
     if result.status_code == 200:
-        return json.loads(result.content)
+        raise ndb.Return(json.loads(result.content))
 
     raise Exception('resultz {} {}'.format(result.status_code, result.content))
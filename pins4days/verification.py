@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Verifies that requests to the events endpoint really come from Slack.
+
+Slack signs every request with the app's signing secret. See:
+https://api.slack.com/authentication/verifying-requests-from-slack
+
+The signature is checked over the raw body, before it is parsed, so forged
+or replayed requests are turned away without any JSON parsing or datastore
+work. All comparisons are constant-time.
+
+Attributes:
+    MAX_REQUEST_AGE (int): Seconds a signed request stays valid. Older (or
+    too far in the future) timestamps are rejected as replays.
+    SIGNATURE_VERSION (str): The signature scheme version Slack uses.
+"""
+
+import hashlib
+import hmac
+import time
+
+
+SIGNATURE_VERSION = 'v0'
+MAX_REQUEST_AGE = 5 * 60
+
+_PREFIX = SIGNATURE_VERSION + ':'
+_SIGNATURE_LENGTH = len(SIGNATURE_VERSION) + 1 + 64
+
+
+def _bytes(value):
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+def verify_signature(signing_secret, timestamp, body, signature, now=None):
+    """Checks the X-Slack-Signature of a request.
+
+    Args:
+        signing_secret (str): The Slack app's signing secret.
+        timestamp (str): The X-Slack-Request-Timestamp header.
+        body (str): The raw request body.
+        signature (str): The X-Slack-Signature header.
+        now (float): Optional. The current time, for testing.
+
+    Returns:
+        bool: True if the signature is valid and the request is recent.
+    """
+    if not timestamp or not signature or len(signature) != _SIGNATURE_LENGTH:
+        return False
+    try:
+        age = abs((now or time.time()) - int(timestamp))
+    except ValueError:
+        return False
+    if age > MAX_REQUEST_AGE:
+        return False
+
+    # Feed the parts to the HMAC one by one rather than concatenating them,
+    # so that the body isn't copied.
+    mac = hmac.new(_bytes(signing_secret), _PREFIX, hashlib.sha256)
+    mac.update(_bytes(timestamp))
+    mac.update(':')
+    mac.update(body)
+    expected = SIGNATURE_VERSION + '=' + mac.hexdigest()
+    return hmac.compare_digest(expected, _bytes(signature))
+
+
+def verify_token(verification_token, token):
+    """Checks the deprecated verification token sent in the request body.
+
+    Args:
+        verification_token (str or None): The Slack app's verification token.
+        token (str): The token sent in the request.
+
+    Returns:
+        bool: True if the tokens match. Always False if no verification token
+        is configured.
+    """
+    if not verification_token or not isinstance(token, basestring):
+        return False
+    return hmac.compare_digest(_bytes(verification_token), _bytes(token))
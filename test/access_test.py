@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+
+from google.appengine.api import memcache
+from google.appengine.api import namespace_manager
+from google.appengine.ext import ndb
+
+from datastore_test_case import DatastoreTestCase
+from pins4days import access
+from pins4days.models.access import ChannelMembership
+from pins4days.models.archive import ArchivedPin
+from pins4days.models.pin import Pin
+from pins4days.models.user import User
+from pins4days.tenants import get_tenant
+
+
+def path(subpath):
+    return os.path.realpath(os.path.join(
+        os.getcwd(),
+        os.path.dirname(__file__),
+        subpath))
+
+
+def membership_event(event_type, user, channel):
+    return {
+        'type': 'event_callback',
+        'event': {'type': event_type, 'user': user, 'channel': channel}
+    }
+
+
+class AccessTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(AccessTestCase, self).setUp()
+        self.testbed.init_taskqueue_stub(root_path=path('..'))
+        self.taskqueue_stub = self.testbed.get_stub('taskqueue')
+        self.tenant = get_tenant({'channel_access': True}, None)
+        self.pins = [
+            Pin.create(
+                text=u'pin {}'.format(i),
+                author_id='user-{}'.format(i % 2),
+                pinner_id='user-0',
+                channel_id='channel-{}'.format(i % 3),
+                created_ts=1525829853 + i,
+                attachments=[],
+                ts='1525829847.{:06d}'.format(i))
+            for i in range(18)
+        ]
+        ndb.put_multi(self.pins)
+        self.newest_first = list(reversed(self.pins))
+
+    def tearDown(self):
+        Pin.set_shards(1)
+        super(AccessTestCase, self).tearDown()
+
+    def ids(self, pins):
+        return [p.key.id() for p in pins]
+
+    def visible(self, channel_ids, pins=None):
+        return [
+            p for p in pins or self.newest_first if p.channel_id in channel_ids
+        ]
+
+    def refresh_tasks(self):
+        return self.taskqueue_stub.get_filtered_tasks(
+            url='/worker/access/refresh', queue_names=['access'])
+
+    def test_disabled_by_default(self):
+        tenant = get_tenant({}, None)
+        self.assertFalse(access.is_enabled(tenant))
+        self.assertIsNone(access.visible_channels(tenant, 'U1'))
+
+    def test_encode_channels(self):
+        encoded = access.encode_channels(['C2', 'C1', 'C2'])
+        self.assertEquals('C1,C2', encoded)
+        self.assertEquals(frozenset(['C1', 'C2']), access.decode_channels(encoded))
+        self.assertEquals(frozenset(), access.decode_channels(''))
+        self.assertEquals('all', access.fingerprint(None))
+        self.assertNotEqual(
+            access.fingerprint(frozenset(['C1'])),
+            access.fingerprint(frozenset(['C1', 'C2'])))
+
+    def test_channels_are_cached(self):
+        ChannelMembership(id='U1', channel_ids=['channel-0', 'channel-2']).put()
+        channels = access.visible_channels(self.tenant, 'U1')
+        self.assertEquals(frozenset(['channel-0', 'channel-2']), channels)
+        self.assertEquals(
+            'channel-0,channel-2', memcache.get(access.cache_key('U1')))
+
+        ChannelMembership.get_by_id('U1').key.delete()
+        self.assertEquals(channels, access.visible_channels(self.tenant, 'U1'))
+
+    def test_missing_membership_enqueues_refresh(self):
+        self.assertEquals(frozenset(), access.visible_channels(self.tenant, 'U1'))
+        self.assertEquals(frozenset(), access.visible_channels(self.tenant, 'U1'))
+        self.assertEquals(1, len(self.refresh_tasks()))
+        self.assertEquals(frozenset(), access.visible_channels(self.tenant, None))
+
+    def test_apply_event(self):
+        ChannelMembership(id='U1', channel_ids=['channel-0']).put()
+        access.visible_channels(self.tenant, 'U1')
+
+        joined = membership_event('member_joined_channel', 'U1', 'channel-1')
+        self.assertTrue(access.is_membership_event(joined))
+        self.assertTrue(access.apply_event(joined))
+        self.assertEquals(
+            frozenset(['channel-0', 'channel-1']),
+            access.visible_channels(self.tenant, 'U1'))
+
+        left = membership_event('member_left_channel', 'U1', 'channel-0')
+        self.assertTrue(access.apply_event(left))
+        self.assertEquals(
+            ['channel-1'], ChannelMembership.get_by_id('U1').channel_ids)
+        self.assertEquals(
+            frozenset(['channel-1']), access.visible_channels(self.tenant, 'U1'))
+
+        unknown = membership_event('member_joined_channel', 'U2', 'channel-0')
+        self.assertFalse(access.apply_event(unknown))
+        self.assertIsNone(ChannelMembership.get_by_id('U2'))
+
+    def test_query_all(self):
+        channels = frozenset(['channel-0', 'channel-2'])
+        expected = self.visible(channels)
+        self.assertEquals(
+            self.ids(expected[:5]), self.ids(Pin.query_all(channels).fetch(5)))
+        self.assertEquals(
+            self.ids(expected[3:8]),
+            self.ids(Pin.query_all(channels).fetch(5, offset=3)))
+        self.assertEquals(len(expected), Pin.query_all(channels).count())
+
+    def test_query_single_channel(self):
+        query = Pin.query_all(['channel-1'])
+        self.assertIsInstance(query, ndb.Query)
+        self.assertEquals(
+            self.ids(self.visible(['channel-1'])), self.ids(query.fetch(10)))
+
+    def test_query_no_channels(self):
+        self.assertEquals([], Pin.query_all(frozenset()).fetch(10))
+        self.assertEquals(0, Pin.query_all(frozenset()).count())
+
+    def test_query_user(self):
+        channels = frozenset(['channel-0', 'channel-1'])
+        expected = [
+            p for p in self.visible(channels) if p.author_id == 'user-1'
+        ]
+        self.assertEquals(
+            self.ids(expected), self.ids(Pin.query_user('user-1', channels).fetch(10)))
+
+    def test_query_sharded(self):
+        Pin.set_shards(4)
+        ndb.put_multi(self.pins)
+        channels = frozenset(['channel-0', 'channel-2'])
+        expected = self.visible(channels)
+        self.assertEquals(
+            self.ids(expected[:6]), self.ids(Pin.query_all(channels).fetch(6)))
+
+    def test_query_archived(self):
+        ndb.put_multi([
+            ArchivedPin.create(p, 'blob', 0, 0) for p in self.pins
+        ])
+        channels = frozenset(['channel-2'])
+        self.assertEquals(
+            self.ids(self.visible(channels)),
+            self.ids(ArchivedPin.query_all(channels).fetch(10)))
+        self.assertEquals(
+            self.ids(self.visible(channels)),
+            self.ids(ArchivedPin.query_all(list(channels) + ['channel-9']).fetch(10)))
+
+    def test_enqueue_all(self):
+        User(id='alice', password='x', slack_user_id='U1',
+             slack_verified=True).put()
+        User(id='bob', password='x').put()
+        User(id='carol', password='x', slack_user_id='U2').put()
+        self.assertEquals(1, access.enqueue_all({'channel_access': True}))
+        self.assertEquals(0, access.enqueue_all({}))
+        self.assertEquals('', namespace_manager.get_namespace())
+        self.assertEquals(1, len(self.refresh_tasks()))
+
+
+if __name__ == '__main__':
+    unittest.main()
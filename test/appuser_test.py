@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from datastore_test_case import DatastoreTestCase
+from pins4days.appuser import AppUser
+from pins4days.models.user import User
+
+
+class AppUserTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(AppUserTestCase, self).setUp()
+        User(id='bobross', password='hashed').put()
+
+    def test_lazy_user_model(self):
+        app_user = AppUser('bobross')
+        self.assertEquals('bobross', app_user.get_id())
+        self.assertIsNone(app_user._user_model)
+        self.assertEquals('hashed', app_user.user_model.password)
+
+    def test_loaded_user_model(self):
+        user = User.get_by_id('bobross')
+        app_user = AppUser('bobross', user)
+        self.assertIs(user, app_user.user_model)
+
+    def test_missing_user(self):
+        self.assertIsNone(AppUser('nobody').user_model)
+
+
+if __name__ == '__main__':
+    unittest.main()
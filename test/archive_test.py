@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from google.appengine.ext import ndb
+
+from datastore_test_case import DatastoreTestCase
+from pins4days import archive
+from pins4days import compression
+from pins4days.blobs import LocalBlobStore
+from pins4days.event import PinnedMessage
+from pins4days.models.archive import ArchivedPin
+from pins4days.models.pin import Pin
+
+
+def path(subpath):
+    return os.path.realpath(os.path.join(
+        os.getcwd(),
+        os.path.dirname(__file__),
+        subpath))
+
+
+class ArchiveTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(ArchiveTestCase, self).setUp()
+        self.testbed.init_taskqueue_stub(root_path=path('..'))
+        self.root = tempfile.mkdtemp()
+        self.store = LocalBlobStore(self.root)
+        self.cutoff = 1525829853 + 5
+        self.pins = [
+            Pin.create(
+                text=u'pin {}'.format(i),
+                author_id='user-{}'.format(i % 2),
+                pinner_id='user-0',
+                channel_id='channel-{}'.format(i % 3),
+                created_ts=1525829853 + i,
+                attachments=[],
+                ts='1525829847.{:06d}'.format(i))
+            for i in range(9)
+        ]
+        with open(path('data/pin_added_multi.json')) as f:
+            multi = PinnedMessage.factory(json.load(f))
+        multi.created_ts = 1525829853
+        self.pins.append(multi)
+        ndb.put_multi(self.pins)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        super(ArchiveTestCase, self).tearDown()
+
+    def test_archive_batch(self):
+        self.assertEquals(6, archive.archive_batch(self.store, self.cutoff))
+        self.assertEquals(4, Pin.query().count())
+        self.assertEquals(6, ArchivedPin.query().count())
+        self.assertEquals(0, archive.archive_batch(self.store, self.cutoff))
+
+    def test_hydrate_matches_pins(self):
+        archive.archive_batch(self.store, self.cutoff)
+        stubs = ArchivedPin.query_all().fetch()
+        originals = dict((p.key.id(), p) for p in self.pins)
+        for pin in archive.hydrate(stubs, self.store):
+            self.assertEquals(
+                originals[pin.key.id()].to_dict(), pin.to_dict())
+
+    def test_get_pins(self):
+        archive.archive_batch(self.store, self.cutoff)
+        key_ids = [self.pins[8].key.id(), self.pins[0].key.id(), 'missing']
+        pins = archive.get_pins(key_ids, self.store)
+        self.assertEquals(self.pins[8].to_dict(), pins[0].to_dict())
+        self.assertEquals(self.pins[0].to_dict(), pins[1].to_dict())
+        self.assertIsNone(pins[2])
+
+    def test_fetch_page_spans_tiers(self):
+        archive.archive_batch(self.store, self.cutoff)
+        expected = Pin.query_all().fetch() + archive.hydrate(
+            ArchivedPin.query_all().fetch(), self.store)
+        key_ids, cursor = [], None
+        while True:
+            pins, cursor = archive.fetch_page_async(
+                Pin.query_all, ArchivedPin.query_all, 3, cursor,
+                self.store).get_result()
+            self.assertTrue(len(pins) <= 3)
+            key_ids.extend(p.key.id() for p in pins)
+            if cursor is None:
+                break
+        self.assertEquals([p.key.id() for p in expected], key_ids)
+        self.assertEquals(
+            expected[-1].to_dict(), pins[-1].to_dict())
+
+    def test_blob_is_compressed_whole(self):
+        archive.archive_batch(self.store, self.cutoff)
+        stub = ArchivedPin.query(
+            ArchivedPin.channel_id == 'channel-0').get()
+        data = compression.decompress(self.store.read(stub.blob))
+        self.assertEquals(
+            ArchivedPin.query(ArchivedPin.channel_id == 'channel-0').count(),
+            data.count('\n'))
+        self.assertEquals(
+            archive.encode_record(self.pins[0]),
+            data[stub.offset:stub.offset + stub.length])
+
+    def test_fetch_page_skips_restored_pins(self):
+        archive.archive_batch(self.store, self.cutoff)
+        self.pins[0].put()
+        pins, cursor = archive.fetch_page_async(
+            Pin.query_all, ArchivedPin.query_all, 20, None,
+            self.store).get_result()
+        self.assertIsNone(cursor)
+        key_ids = [p.key.id() for p in pins]
+        self.assertEquals(len(self.pins), len(key_ids))
+        self.assertEquals(len(set(key_ids)), len(key_ids))
+
+    def test_run_archive(self):
+        old = int(time.time()) - 40 * 24 * 60 * 60
+        pin = Pin.create(
+            text=u'old', author_id='user-0', pinner_id='user-0',
+            channel_id='channel-0', created_ts=old, attachments=[], ts='1.0')
+        recent = Pin.create(
+            text=u'recent', author_id='user-0', pinner_id='user-0',
+            channel_id='channel-0', created_ts=int(time.time()),
+            attachments=[], ts='2.0')
+        ndb.put_multi([pin, recent])
+        self.assertEquals(11, archive.run_archive(self.store, 30))
+        self.assertEquals([recent.key], Pin.query().fetch(keys_only=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import zlib
+
+from flask import Flask
+from flask import Response
+
+from pins4days import compression
+
+
+class CompressionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['gzip_min_size'] = 100
+        compression.init_app(self.app)
+        self.body = '{"pins":[' + ','.join(['"pin"'] * 100) + ']}'
+
+        @self.app.route('/big')
+        def big():
+            return Response(self.body, mimetype='application/json')
+
+        @self.app.route('/small')
+        def small():
+            return Response('{}', mimetype='application/json')
+
+        @self.app.route('/text')
+        def text():
+            return Response(self.body, mimetype='text/plain')
+
+        @self.app.route('/cached')
+        def cached():
+            return compression.precompressed_response(
+                compression.compress(self.body), 'application/json')
+
+        self.client = self.app.test_client()
+
+    def test_roundtrip(self):
+        for encoding in ('gzip', 'deflate'):
+            compressed = compression.compress(self.body, encoding)
+            self.assertLess(len(compressed), len(self.body))
+            self.assertEquals(
+                self.body, compression.decompress(compressed, encoding))
+
+    def test_gzip(self):
+        response = self.client.get(
+            '/big', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEquals('gzip', response.headers['Content-Encoding'])
+        self.assertEquals('Accept-Encoding', response.headers['Vary'])
+        self.assertEquals(
+            self.body, zlib.decompress(response.data, 16 + zlib.MAX_WBITS))
+
+    def test_deflate(self):
+        response = self.client.get('/big', headers={'Accept-Encoding': 'deflate'})
+        self.assertEquals('deflate', response.headers['Content-Encoding'])
+        self.assertEquals(self.body, zlib.decompress(response.data))
+
+    def test_not_accepted(self):
+        response = self.client.get('/big')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEquals(self.body, response.data)
+
+    def test_below_threshold(self):
+        response = self.client.get('/small', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_mimetype(self):
+        response = self.client.get('/text', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_precompressed(self):
+        response = self.client.get('/cached', headers={'Accept-Encoding': 'gzip'})
+        self.assertEquals('gzip', response.headers['Content-Encoding'])
+        self.assertEquals(compression.compress(self.body), response.data)
+
+        response = self.client.get('/cached')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEquals(self.body, response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import calendar
+from datetime import datetime
+
+from google.appengine.ext import ndb
+
+from datastore_test_case import DatastoreTestCase
+from pins4days import digests
+from pins4days.models.digest import Digest
+from pins4days.models.digest import DigestMark
+from pins4days.models.pin import Attachment
+from pins4days.models.pin import Pin
+
+
+def ts(*args):
+    return calendar.timegm(datetime(*args).timetuple())
+
+
+def make_pin(i, created_ts, channel_id='channel-0', author_id='user-0',
+             urls=()):
+    return Pin.create(
+        text=u'pin {}'.format(i),
+        author_id=author_id,
+        pinner_id='pinner-0',
+        channel_id=channel_id,
+        created_ts=created_ts,
+        attachments=[Attachment(original_url=url) for url in urls],
+        ts='1525829847.{:06d}'.format(i))
+
+
+class DigestsTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(DigestsTestCase, self).setUp()
+        self.now = ts(2018, 5, 16, 12)
+        self.pins = [
+            make_pin(0, ts(2018, 5, 14, 9), urls=['https://www.example.com/a']),
+            make_pin(1, ts(2018, 5, 15, 9), author_id='user-1',
+                     urls=['http://EXAMPLE.com:8080/b', 'https://slack.com']),
+            make_pin(2, ts(2018, 5, 2, 9), channel_id='channel-1'),
+            make_pin(3, ts(2018, 4, 30, 9), channel_id='channel-1'),
+        ]
+        ndb.put_multi(self.pins)
+
+    def test_buckets(self):
+        self.assertEquals(
+            ts(2018, 5, 14), digests.bucket_start('week', ts(2018, 5, 20, 23)))
+        self.assertEquals(
+            ts(2018, 5, 1), digests.bucket_start('month', ts(2018, 5, 31, 23)))
+        self.assertEquals(
+            ts(2019, 1, 1), digests.next_start('month', ts(2018, 12, 1)))
+        self.assertEquals(
+            ts(2018, 2, 1), digests.previous_start('month', ts(2018, 3, 1)))
+        self.assertEquals('2018-05-14', digests.bucket_label('week', ts(2018, 5, 14)))
+        self.assertEquals('2018-05', digests.bucket_label('month', ts(2018, 5, 1)))
+
+    def test_domain_of(self):
+        self.assertEquals('example.com', digests.domain_of('https://www.example.com/a'))
+        self.assertEquals('example.com', digests.domain_of('http://EXAMPLE.com:8080/b'))
+        self.assertIsNone(digests.domain_of(None))
+        self.assertIsNone(digests.domain_of('not a url'))
+
+    def test_record_is_idempotent(self):
+        digests.record_async(self.pins).get_result()
+        digests.record_async(self.pins[:2]).get_result()
+        key = digests.digest_key(self.pins[0], 'month')
+        digest = key.get()
+        self.assertEquals(2, digest.count)
+        self.assertEquals({'user-0': 1, 'user-1': 1}, digest.authors)
+        self.assertEquals({'pinner-0': 2}, digest.pinners)
+        self.assertEquals({'example.com': 2, 'slack.com': 1}, digest.domains)
+        self.assertEquals(5, Digest.query().count())
+        self.assertEquals(8, DigestMark.query().count())
+        self.assertEquals(2, DigestMark.query(ancestor=key).count())
+
+    def test_reconcile_keeps_record_idempotent(self):
+        digests.record_async(self.pins).get_result()
+        self.pins[0].key.delete()
+        digests.reconcile({'digest_reconcile_days': 60}, now=self.now)
+        key = digests.digest_key(self.pins[1], 'month')
+        self.assertEquals(1, key.get().count)
+        self.assertEquals(1, DigestMark.query(ancestor=key).count())
+
+        digests.record_async(self.pins[:2]).get_result()
+        self.assertEquals(2, key.get().count)
+
+    def test_query_digests(self):
+        digests.record_async(self.pins).get_result()
+        results = digests.query_digests('month', buckets=2, now=self.now)
+        self.assertEquals(['2018-05', '2018-04'], [r['bucket'] for r in results])
+        self.assertEquals(3, results[0]['count'])
+        self.assertEquals({'channel-0': 2, 'channel-1': 1}, results[0]['channels'])
+        self.assertEquals([('user-0', 2), ('user-1', 1)], results[0]['authors'])
+        self.assertEquals([('example.com', 2)], digests.query_digests(
+            'month', buckets=1, top=1, now=self.now)[0]['domains'])
+
+        results = digests.query_digests(
+            'week', buckets=1, channel_id='channel-1', now=self.now)
+        self.assertEquals([], results)
+        results = digests.query_digests(
+            'week', buckets=3, channel_id='channel-1', now=self.now)
+        self.assertEquals(['2018-04-30'], [r['bucket'] for r in results])
+        self.assertEquals(2, results[0]['count'])
+
+    def test_reconcile_matches_incremental(self):
+        digests.record_async(self.pins).get_result()
+        expected = dict((d.key, d.to_dict()) for d in Digest.query())
+
+        digests.digest_key(self.pins[1], 'week').delete()
+        Digest(id='week:2018-05-07:gone', period='week', start=ts(2018, 5, 7),
+               channel_id='gone', count=1).put()
+
+        digests.reconcile({'digest_reconcile_days': 60}, now=self.now)
+        actual = dict((d.key, d.to_dict()) for d in Digest.query())
+        self.assertEquals(set(expected.keys()), set(actual.keys()))
+        for key, digest in expected.items():
+            self.assertEquals(digest['count'], actual[key]['count'])
+            self.assertEquals(digest['authors'], actual[key]['authors'])
+            self.assertEquals(digest['domains'], actual[key]['domains'])
+
+    def test_reconcile_counts_pins_recorded_meanwhile(self):
+        digests.record_async(self.pins[1:]).get_result()
+        query_created_since = Pin.query_created_since
+        pin = self.pins[0]
+
+        class QueryThenRecord(object):
+            # Stores a pin after the rebuild's Pin query has read its pins.
+            def __init__(self, since):
+                self.pins = query_created_since(since).fetch()
+
+            def iter(self, **options):
+                pin.put()
+                digests.record_async([pin]).get_result()
+                return iter(self.pins)
+
+        pin.key.delete()
+        Pin.query_created_since = classmethod(
+            lambda cls, since: QueryThenRecord(since))
+        try:
+            digests.reconcile({'digest_reconcile_days': 60}, now=self.now)
+        finally:
+            Pin.query_created_since = query_created_since
+        key = digests.digest_key(self.pins[0], 'month')
+        self.assertEquals(2, key.get().count)
+        self.assertEquals(2, DigestMark.query(ancestor=key).count())
+
+        digests.record_async(self.pins[:1]).get_result()
+        self.assertEquals(2, key.get().count)
+
+    def test_reconcile_leaves_older_buckets(self):
+        digests.record_async(self.pins).get_result()
+        digests.reconcile({'digest_reconcile_days': 10}, now=self.now)
+        self.assertIsNotNone(digests.digest_key(self.pins[3], 'month').get())
+        self.assertIsNotNone(digests.digest_key(self.pins[2], 'week').get())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import urlparse
+
+from datastore_test_case import DatastoreTestCase
+from pins4days import identity
+from pins4days.models.user import User
+
+
+APP_CONFIG = {
+    'slack_client_id': 'client-id-0',
+    'slack_client_secret': 'client-secret-0',
+}
+
+
+class IdentityTestCase(DatastoreTestCase):
+
+    def test_is_configured(self):
+        self.assertTrue(identity.is_configured(APP_CONFIG))
+        self.assertFalse(identity.is_configured({'slack_client_id': 'x'}))
+
+    def test_check_state(self):
+        state = identity.new_state()
+        self.assertNotEquals(state, identity.new_state())
+        self.assertTrue(identity.check_state(state, state))
+        self.assertFalse(identity.check_state(state, state + 'x'))
+        self.assertFalse(identity.check_state(None, None))
+        self.assertFalse(identity.check_state(state, None))
+
+    def test_authorize_url(self):
+        url = identity.authorize_url(
+            APP_CONFIG, 'state-0', 'https://example.com/slack/connect/callback')
+        params = urlparse.parse_qs(urlparse.urlparse(url).query)
+        self.assertEquals(['client-id-0'], params['client_id'])
+        self.assertEquals([identity.SCOPE], params['scope'])
+        self.assertEquals(['state-0'], params['state'])
+
+    def test_unverified_identity_is_ignored(self):
+        user = User(id='alice', password='x', team_id='T1', slack_user_id='U1')
+        self.assertEquals(
+            {'team_id': None, 'user_id': None},
+            identity.session_identity(user))
+        self.assertEquals(
+            {'team_id': None, 'user_id': None},
+            identity.session_identity(None))
+
+    def test_link_slack_identity(self):
+        User(id='alice', password='x', team_id='T0').put()
+        user = User.link_slack_identity('alice', 'T1', 'U1')
+        self.assertTrue(User.get_by_id('alice').slack_verified)
+        self.assertEquals(
+            {'team_id': 'T1', 'user_id': 'U1'},
+            identity.session_identity(user))
+        self.assertIsNone(User.link_slack_identity('nobody', 'T1', 'U1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
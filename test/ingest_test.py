@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import calendar
+import json
+import os
+import time
+
+from google.appengine.api import taskqueue
+
+from datastore_test_case import DatastoreTestCase
+from pins4days.constants import INGEST_MODE_PULL
+from pins4days.constants import INGEST_MODE_PUSH
+from pins4days.constants import PRIORITY_BACKFILL
+from pins4days.constants import PRIORITY_LIVE
+from pins4days.constants import PULL_QUEUE_INGEST
+from pins4days.ingest import enqueue_pins_async
+from pins4days.ingest import drain
+from pins4days.ingest import DRAIN_KICK_INTERVAL
+from pins4days.ingest import lease_and_store
+from pins4days.models.pin import Pin
+
+
+def path(subpath):
+    return os.path.realpath(os.path.join(
+        os.getcwd(),
+        os.path.dirname(__file__),
+        subpath))
+
+
+class IngestTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(IngestTestCase, self).setUp()
+        self.testbed.init_taskqueue_stub(root_path=path('..'))
+        self.taskqueue_stub = self.testbed.get_stub('taskqueue')
+        with open(path('data/pin_added_link.json')) as f:
+            self.pin_added_link = json.load(f)
+        with open(path('data/pin_added_message.json')) as f:
+            self.pin_added_message = json.load(f)
+
+    def enqueue(self, pins, mode, priority=PRIORITY_LIVE):
+        for future in enqueue_pins_async(pins, mode, priority):
+            future.get_result()
+
+    def test_push_mode(self):
+        self.enqueue([self.pin_added_link, self.pin_added_message],
+                     INGEST_MODE_PUSH)
+        tasks = self.taskqueue_stub.get_filtered_tasks(
+            url='/worker/create_pin', queue_names=['pins-live'])
+        self.assertEquals(2, len(tasks))
+
+    def test_push_mode_backfill(self):
+        self.enqueue([self.pin_added_link], INGEST_MODE_PUSH, PRIORITY_BACKFILL)
+        tasks = self.taskqueue_stub.get_filtered_tasks(
+            url='/worker/create_pin', queue_names=['pins-backfill'])
+        self.assertEquals(1, len(tasks))
+
+    def test_pull_mode_leases_live_first(self):
+        self.enqueue([self.pin_added_link], INGEST_MODE_PULL, PRIORITY_BACKFILL)
+        self.enqueue([self.pin_added_message], INGEST_MODE_PULL)
+        leased, written = lease_and_store(max_tasks=1)
+        self.assertEquals(1, written)
+        self.assertEquals(
+            'pinned-to-0_1525813275.000339', Pin.query().get().key.id())
+
+    def test_pull_mode_dedupes(self):
+        self.enqueue(
+            [self.pin_added_link, self.pin_added_message, self.pin_added_link],
+            INGEST_MODE_PULL)
+        self.assertEquals(
+            1, len(self.taskqueue_stub.get_filtered_tasks(
+                url='/worker/ingest/drain')))
+
+        leased, written = lease_and_store()
+        self.assertEquals(3, leased)
+        self.assertEquals(2, written)
+        self.assertEquals(2, Pin.query().count())
+        self.assertEquals(
+            [], taskqueue.Queue(PULL_QUEUE_INGEST).lease_tasks(0, 10))
+
+    def test_pull_mode_delays_drain(self):
+        now = time.time()
+        for future in enqueue_pins_async(
+                [self.pin_added_message], INGEST_MODE_PULL, countdown=30):
+            future.get_result()
+        tasks = self.taskqueue_stub.get_filtered_tasks(
+            url='/worker/ingest/drain')
+        self.assertEquals(1, len(tasks))
+        delay = calendar.timegm(tasks[0].eta.utctimetuple()) - now
+        self.assertTrue(30 <= delay <= 30 + DRAIN_KICK_INTERVAL + 1)
+
+    def test_drain_drops_malformed_tasks(self):
+        self.enqueue([{'type': 'unknown'}, self.pin_added_message],
+                     INGEST_MODE_PULL)
+        leased, written = drain()
+        self.assertEquals(2, leased)
+        self.assertEquals(1, written)
+        self.assertEquals(
+            [], taskqueue.Queue(PULL_QUEUE_INGEST).lease_tasks(0, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import copy
+import json
+import os
+
+from google.appengine.ext import ndb
+
+from datastore_test_case import DatastoreTestCase
+from pins4days import links
+from pins4days import serializers
+from pins4days.event import PinnedMessage
+from pins4days.ingest import store_async
+from pins4days.models.link import Link
+from pins4days.models.pin import Pin
+
+
+def path(subpath):
+    return os.path.realpath(os.path.join(
+        os.getcwd(),
+        os.path.dirname(__file__),
+        subpath))
+
+
+class LinksTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(LinksTestCase, self).setUp()
+        self.testbed.init_taskqueue_stub(root_path=path('..'))
+        self.taskqueue_stub = self.testbed.get_stub('taskqueue')
+        self.events = {}
+        for name in ['image', 'link', 'message', 'multi']:
+            with open(path('data/pin_added_{}.json'.format(name))) as f:
+                self.events[name] = json.load(f)
+
+    def test_normalise_url(self):
+        self.assertEquals(
+            u'https://example.com/a?b=1',
+            links.normalise_url(
+                u'HTTPS://Example.COM:443/a?utm_source=x&b=1#top'))
+        self.assertEquals(
+            u'http://example.com:8080/',
+            links.normalise_url(u'http://example.com:8080'))
+        self.assertEquals(
+            links.link_id(u'https://example.com/a?b=1'),
+            links.link_id(u'https://EXAMPLE.com/a?b=1&utm_medium=y'))
+
+    def test_store_and_resolve(self):
+        names = ['image', 'link', 'message', 'multi']
+        pins = [PinnedMessage.factory(self.events[n]) for n in names]
+        expected = [p.to_dict() for p in pins]
+        store_async(pins).get_result()
+
+        stored = ndb.get_multi([p.key for p in pins])
+        attachments = [a for p in stored for a in p.attachments]
+        self.assertTrue(all(links.is_reference(a) for a in attachments))
+        # Three distinct links: the link pin and the multi pin share the
+        # medium.com link.
+        self.assertEquals(3, Link.query().count())
+        self.assertEquals(
+            [], self.taskqueue_stub.get_filtered_tasks(queue_names=['media']))
+
+        links.resolve_async(stored).get_result()
+        for pin, data in zip(stored[:3], expected[:3]):
+            self.assertEquals(data, pin.to_dict())
+        # Both pins show the preview that was stored first.
+        self.assertEquals(
+            stored[1].attachments[0].to_dict(),
+            stored[3].attachments[0].to_dict())
+        self.assertEquals(
+            expected[3]['attachments'][1], stored[3].attachments[1].to_dict())
+
+    def test_known_link_is_not_rewritten(self):
+        store_async([PinnedMessage.factory(self.events['link'])]).get_result()
+        link = Link.query().get()
+        event = copy.deepcopy(self.events['link'])
+        event['event']['item']['message']['ts'] = '1525829847.000999'
+        event['event']['item']['message']['attachments'][0]['text'] = u'changed'
+        store_async([PinnedMessage.factory(event)]).get_result()
+        self.assertEquals(link.updated, Link.query().get().updated)
+        self.assertEquals(
+            [], self.taskqueue_stub.get_filtered_tasks(queue_names=['media']))
+
+    def test_missing_preview_is_refreshed(self):
+        event = copy.deepcopy(self.events['link'])
+        attachment = event['event']['item']['message']['attachments'][0]
+        del attachment['text']
+        del attachment['image_url']
+        store_async([PinnedMessage.factory(event)]).get_result()
+        store_async([PinnedMessage.factory(event)]).get_result()
+        tasks = self.taskqueue_stub.get_filtered_tasks(queue_names=['media'])
+        self.assertEquals(1, len(tasks))
+        key = links.link_key(attachment['original_url'])
+        self.assertEquals('/worker/links/{}/refresh'.format(key.id()), tasks[0].url)
+
+    def test_legacy_attachments_are_left_alone(self):
+        pin = PinnedMessage.factory(self.events['link'])
+        pin.put()
+        expected = pin.to_dict()
+        links.resolve_async([pin]).get_result()
+        self.assertEquals(expected, pin.to_dict())
+
+    def test_refreshed_preview_is_not_served_from_cache(self):
+        pin = PinnedMessage.factory(self.events['link'])
+        store_async([pin]).get_result()
+        stored = links.resolve_async(
+            [pin.key.get(use_cache=False)]).get_result()
+        serializers.encode_pins(stored, cache=True)
+        ndb.get_context().flush().get_result()
+
+        link = Link.query().get()
+        link.text = u'refreshed'
+        link.put()
+        stored = links.resolve_async(
+            [pin.key.get(use_cache=False)]).get_result()
+        body = json.loads(serializers.encode_pins(stored, cache=True))
+        self.assertEquals(u'refreshed', body[0]['attachments'][0]['text'])
+
+    def test_parse_preview(self):
+        html = (
+            '<html><head>'
+            '<meta content="https://example.com/i.png" property="og:image">'
+            "<meta name='description' content='Plain &amp; simple'>"
+            '<meta property="og:description" content="Caf\xc3\xa9 &quot;menu&quot;" />'
+            '</head></html>')
+        self.assertEquals(
+            (u'https://example.com/i.png', u'Caf\xe9 "menu"'),
+            links.parse_preview(html))
+        self.assertEquals((None, None), links.parse_preview('<p>hi</p>'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from flask import Flask
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from datastore_test_case import DatastoreTestCase
+from pins4days import metrics
+from pins4days.models.pin import Pin
+
+
+class PercentileTestCase(unittest.TestCase):
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEquals(1, metrics.percentile(values, 0))
+        self.assertEquals(51, metrics.percentile(values, 50))
+        self.assertEquals(99, metrics.percentile(values, 99))
+        self.assertEquals(100, metrics.percentile(values, 100))
+
+    def test_empty(self):
+        self.assertIsNone(metrics.percentile([], 50))
+
+
+class MetricsTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        metrics.reset()
+        self.app = Flask(__name__)
+        metrics.init_app(self.app)
+
+        @self.app.route('/pins/<channel_id>')
+        @ndb.toplevel
+        def pins(channel_id):
+            # Keep ndb's own memcache traffic out of the counts.
+            ndb.get_context().set_memcache_policy(False)
+            memcache.set('a', 1)
+            memcache.get_multi(['a', 'b'])
+            Pin.create(channel_id=channel_id, ts='1.0', text='hi').put()
+            return 'ok'
+
+        self.client = self.app.test_client()
+
+    def test_records_rpcs(self):
+        self.client.get('/pins/channel-0')
+        self.client.get('/pins/channel-1')
+        summary = metrics.summary()['/pins/<channel_id>']
+        self.assertEquals(2, summary['requests'])
+        self.assertEquals(1, summary['rpcs']['datastore_v3']['count_per_request'])
+        # set, get_multi, and the put's response cache invalidation.
+        self.assertEquals(3, summary['rpcs']['memcache']['count_per_request'])
+        self.assertEquals(0.5, summary['cache_hit_ratio'])
+        self.assertEquals(2, summary['bytes']['p50'])
+
+    def test_metrics_endpoint(self):
+        self.client.get('/pins/channel-0')
+        response = self.client.get('/debug/metrics')
+        self.assertEquals(200, response.status_code)
+        self.assertIn('/pins/<channel_id>', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+
+from google.appengine.api import namespace_manager
+from google.appengine.ext import ndb
+
+from datastore_test_case import DatastoreTestCase
+from pins4days.migration import register_migration
+from pins4days.migration import run_migration
+from pins4days.migration import start_in_namespaces
+from pins4days.migration import start_migration
+from pins4days.models.migration import MigrationState
+from pins4days.models.pin import Pin
+
+
+def path(subpath):
+    return os.path.realpath(os.path.join(
+        os.getcwd(),
+        os.path.dirname(__file__),
+        subpath))
+
+
+@register_migration('test_upper_text')
+def upper_text(pin):
+    if pin.text.isupper():
+        return None
+    pin.text = pin.text.upper()
+    return pin
+
+
+class MigrationTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(MigrationTestCase, self).setUp()
+        self.testbed.init_taskqueue_stub(root_path=path('..'))
+        self.taskqueue_stub = self.testbed.get_stub('taskqueue')
+        pins = [
+            Pin.create(
+                text='pin {}'.format(i),
+                author_id='user-0',
+                pinner_id='user-0',
+                channel_id='channel-0',
+                created_ts=1525829853 + i,
+                attachments=[],
+                ts='1525829847.{:06d}'.format(i))
+            for i in range(7)
+        ]
+        ndb.put_multi(pins)
+
+    def test_run_to_completion(self):
+        state = run_migration('test_upper_text', batch_size=3)
+        self.assertTrue(state.done)
+        self.assertEquals(3, state.batches)
+        self.assertEquals(7, state.processed)
+        self.assertEquals(7, state.written)
+        self.assertTrue(all(p.text.startswith('PIN') for p in Pin.query()))
+        self.assertEquals([], self.taskqueue_stub.get_filtered_tasks())
+
+    def test_resumes_from_checkpoint(self):
+        state = run_migration('test_upper_text', batch_size=3, time_budget=0)
+        self.assertFalse(state.done)
+        self.assertEquals(3, state.processed)
+        tasks = self.taskqueue_stub.get_filtered_tasks(
+            url='/worker/migrations/test_upper_text',
+            queue_names=['migrations'])
+        self.assertEquals(1, len(tasks))
+
+        state = run_migration('test_upper_text', batch_size=3)
+        self.assertTrue(state.done)
+        self.assertEquals(7, state.processed)
+
+    def test_skips_unchanged_pins(self):
+        run_migration('test_upper_text', batch_size=10)
+        start_migration('test_upper_text')
+        state = run_migration('test_upper_text', batch_size=10)
+        self.assertEquals(7, state.processed)
+        self.assertEquals(0, state.written)
+
+    def test_start_resets_checkpoint(self):
+        run_migration('test_upper_text', batch_size=10)
+        state = start_migration('test_upper_text')
+        self.assertFalse(state.done)
+        self.assertEquals(0, MigrationState.get_by_id('test_upper_text').processed)
+
+    def test_start_in_namespaces(self):
+        states = start_in_namespaces('test_upper_text', ['', 'team-T1'])
+        self.assertEquals(['', 'team-T1'], sorted(states))
+        self.assertEquals('', namespace_manager.get_namespace())
+        self.assertIsNotNone(
+            MigrationState.get_by_id('test_upper_text', namespace='team-T1'))
+        tasks = self.taskqueue_stub.get_filtered_tasks(
+            url='/worker/migrations/test_upper_text',
+            queue_names=['migrations'])
+        self.assertEquals(2, len(set(task.name for task in tasks)))
+
+    def test_duplicate_registration(self):
+        with self.assertRaises(ValueError):
+            register_migration('test_upper_text')(upper_text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import unittest
+
+from google.appengine.ext import ndb
+
+from datastore_test_case import DatastoreTestCase
+from pins4days import paging
+from pins4days.models.archive import ArchivedPin
+from pins4days.models.pin import Pin
+from pins4days.sharding import ShardedQuery
+
+
+class RecordingQuery(object):
+
+    def __init__(self, query, limits):
+        self.query = query
+        self.limits = limits
+
+    def fetch_async(self, limit=None, **options):
+        self.limits.append(limit)
+        return self.query.fetch_async(limit, **options)
+
+
+class PagingTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(PagingTestCase, self).setUp()
+        # Four pins per second, so pages split ties.
+        self.pins = [
+            Pin.create(
+                text=u'pin {}'.format(i),
+                author_id='user-{}'.format(i % 2),
+                pinner_id='user-0',
+                channel_id='channel-{}'.format(i % 3),
+                created_ts=1525829853 + i // 4,
+                attachments=[],
+                ts='1525829847.{:06d}'.format(i))
+            for i in range(24)
+        ]
+        ndb.put_multi(self.pins)
+        self.newest_first = sorted(
+            self.pins, key=lambda p: (-p.created_ts, p.key.id()))
+        self.limits = []
+
+    def tearDown(self):
+        Pin.set_shards(1)
+        super(PagingTestCase, self).tearDown()
+
+    def ids(self, pins):
+        return [p.key.id() for p in pins]
+
+    def recording(self, build_query):
+        def build(before=None):
+            query = build_query(before=before)
+            inner = getattr(query, 'query', query)
+            if isinstance(inner, ShardedQuery):
+                inner.queries = [
+                    RecordingQuery(q, self.limits) for q in inner.queries
+                ]
+                return query
+            return RecordingQuery(query, self.limits)
+        return build
+
+    def walk(self, tiers, limit):
+        pages, cursor = [], None
+        while True:
+            page, cursor = paging.fetch_page_async(
+                tiers, limit, cursor).get_result()
+            pages.append(page)
+            if cursor is None:
+                return pages
+
+    def test_pages_split_ties(self):
+        pages = self.walk([self.recording(Pin.query_all)], 3)
+        self.assertEquals(8, len(pages))
+        self.assertEquals(
+            self.ids(self.newest_first), self.ids(sum(pages, [])))
+        # Never more than a page, the pins of the cursor's second, and one.
+        self.assertTrue(max(self.limits) <= 3 + 4 + 1)
+
+    def test_sharded_channels(self):
+        Pin.set_shards(4)
+        ndb.put_multi(self.pins)
+        channels = frozenset(['channel-0', 'channel-2'])
+        pages = self.walk(
+            [self.recording(functools.partial(Pin.query_all, channels))], 5)
+        self.assertEquals(
+            self.ids([p for p in self.newest_first if p.channel_id in channels]),
+            self.ids(sum(pages, [])))
+        self.assertTrue(max(self.limits) <= 5 + 4 + 1)
+
+    def test_tiers(self):
+        archived = self.pins[:8]
+        ndb.put_multi([ArchivedPin.create(p, 'blob', 0, 0) for p in archived])
+        ndb.delete_multi([p.key for p in archived[1:]])
+        pages = self.walk([Pin.query_all, ArchivedPin.query_all], 5)
+        listed = sum(pages, [])
+        self.assertEquals(self.ids(self.newest_first), self.ids(listed))
+        self.assertEquals(
+            7, len([p for p in listed if isinstance(p, ArchivedPin)]))
+
+    def test_many_channels_are_batched(self):
+        Pin.set_shards(4)
+        ndb.put_multi(self.pins)
+        channels = frozenset(
+            ['channel-1'] + ['other-{}'.format(i) for i in range(40)])
+        self.assertEquals(
+            [30, 11], [len(b) for b in paging.channel_batches(channels)])
+        query = Pin.query_all(channels)
+        self.assertIsInstance(query, ShardedQuery)
+        self.assertEquals(2 * 4, len(query.queries))
+        expected = [p for p in self.newest_first if p.channel_id in channels]
+        self.assertEquals(self.ids(expected), self.ids(query.fetch()))
+        pages = self.walk(
+            [self.recording(functools.partial(Pin.query_all, channels))], 3)
+        self.assertEquals(self.ids(expected), self.ids(sum(pages, [])))
+        # Every pin read is visible, so only the last page is short.
+        self.assertEquals([3] * 2 + [2], [len(p) for p in pages])
+        self.assertTrue(max(self.limits) <= 3 + 4 + 1)
+
+    def test_archived_channels_are_batched(self):
+        ndb.put_multi([ArchivedPin.create(p, 'blob', 0, 0) for p in self.pins])
+        channels = ['channel-2'] + ['other-{}'.format(i) for i in range(40)]
+        query = ArchivedPin.query_all(channels)
+        self.assertEquals(2, len(query.queries))
+        self.assertEquals(
+            self.ids([p for p in self.newest_first
+                      if p.channel_id == 'channel-2']),
+            self.ids(query.fetch()))
+        self.assertEquals([], ArchivedPin.query_all([]).fetch())
+
+    def test_invalid_cursor(self):
+        for cursor in ('nope', paging.encode_cursor((1, 'a'), 'x')):
+            self.assertRaises(
+                ValueError, paging.fetch_page_async([Pin.query_all], 3,
+                                                    cursor).get_result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import copy
+import json
+import os
+
+from google.appengine.ext import ndb
+
+from datastore_test_case import DatastoreTestCase
+from pins4days import rotation
+from pins4days.event import PinnedMessage
+from pins4days.models.pin import Pin
+from pins4days.tenants import get_tenant
+from pins4days.utils import SlackRateLimitedException
+
+
+def path(subpath):
+    return os.path.realpath(os.path.join(
+        os.getcwd(),
+        os.path.dirname(__file__),
+        subpath))
+
+
+def message_item(i):
+    return {
+        'type': 'message',
+        'channel': 'channel-0',
+        'created': 1525829853 + i,
+        'created_by': 'user-0',
+        'message': {
+            'type': 'message',
+            'user': 'user-0',
+            'text': u'pin {}'.format(i),
+            'ts': '1525829847.{:06d}'.format(i)
+        }
+    }
+
+
+class RotationTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(RotationTestCase, self).setUp()
+        self.testbed.init_taskqueue_stub(root_path=path('..'))
+        self.taskqueue_stub = self.testbed.get_stub('taskqueue')
+        self.tenant = get_tenant({'rotate_pins_at': 95}, None)
+        with open(path('data/pin_added_link.json')) as f:
+            self.event = json.load(f)
+        self.slack = (
+            rotation.get_channel_pins_async, rotation.remove_channel_pin_async)
+        self.removed = []
+
+    def tearDown(self):
+        rotation.get_channel_pins_async, rotation.remove_channel_pin_async = (
+            self.slack)
+        super(RotationTestCase, self).tearDown()
+
+    def fake_slack(self, items, responses):
+        """Replaces the Slack API calls of the rotation. pins.list returns
+        the items, and each pins.remove call returns the next response, or
+        raises it if it is an exception.
+        """
+        def result(value):
+            future = ndb.Future()
+            if isinstance(value, Exception):
+                future.set_exception(value)
+            else:
+                future.set_result(value)
+            return future
+
+        def remove(channel_id, ts, token):
+            self.removed.append(ts)
+            return result(responses[len(self.removed) - 1])
+
+        rotation.get_channel_pins_async = (
+            lambda channel_id, token: result({'ok': True, 'items': items}))
+        rotation.remove_channel_pin_async = remove
+
+    def test_disabled_by_default(self):
+        tenant = get_tenant({}, None)
+        self.assertFalse(rotation.is_enabled(tenant))
+        self.assertFalse(rotation.should_rotate(tenant, self.event))
+
+    def test_should_rotate(self):
+        self.assertFalse(rotation.should_rotate(self.tenant, self.event))
+        event = copy.deepcopy(self.event)
+        event['event']['pin_count'] = 95
+        self.assertTrue(rotation.should_rotate(self.tenant, event))
+        del event['event']['pin_count']
+        self.assertTrue(rotation.should_rotate(self.tenant, event))
+        self.assertEquals('channel-id-0', rotation.event_channel(event))
+
+    def test_keep_count(self):
+        self.assertEquals(85, rotation.keep_count(self.tenant))
+        tenant = get_tenant({'rotate_pins_at': 95, 'rotate_pins_keep': 100}, None)
+        self.assertEquals(94, rotation.keep_count(tenant))
+
+    def test_schedule_coalesces(self):
+        rotation.schedule('channel-0', None)
+        rotation.schedule('channel-0', None)
+        rotation.schedule('channel-1', None)
+        tasks = self.taskqueue_stub.get_filtered_tasks(
+            url='/worker/rotation', queue_names=['pins-rotation'])
+        self.assertEquals(2, len(tasks))
+
+    def test_plan_rotation(self):
+        items = [message_item(i) for i in reversed(range(95))]
+        items.append({'type': 'file', 'created': 0})
+        self.assertEquals([], rotation.plan_rotation(items, 97, 85))
+        planned = rotation.plan_rotation(items, 95, 85)
+        self.assertEquals(11, len(planned))
+        self.assertEquals(
+            [1525829853 + i for i in range(11)],
+            [i['created'] for i in planned])
+
+    def test_lease(self):
+        self.assertTrue(rotation.acquire_lease('channel-0'))
+        self.assertFalse(rotation.acquire_lease('channel-0'))
+        self.assertTrue(rotation.acquire_lease('channel-1'))
+        rotation.release_lease('channel-0', 3)
+        self.assertTrue(rotation.acquire_lease('channel-0'))
+
+    def test_lease_expires(self):
+        self.assertTrue(rotation.acquire_lease('channel-0', seconds=-1))
+        self.assertTrue(rotation.acquire_lease('channel-0'))
+
+    def test_confirm_stored(self):
+        items = [message_item(i) for i in range(3)]
+        PinnedMessage.factory(items[0]).put()
+        bot_item = message_item(3)
+        del bot_item['message']['user']
+        confirmed = rotation.confirm_stored(items + [bot_item])
+        self.assertEquals(items, confirmed)
+        self.assertEquals(3, Pin.query().count())
+
+    def test_rotate(self):
+        tenant = get_tenant(
+            {'rotate_pins_at': 95, 'rotate_pins_per_minute': 5}, None)
+        items = [message_item(i) for i in reversed(range(95))]
+        self.fake_slack(items, [
+            {'ok': True},
+            {'ok': True},
+            {'ok': False, 'error': 'no_pin'},
+            SlackRateLimitedException(30),
+            {'ok': False, 'error': 'channel_not_found'},
+        ])
+
+        self.assertEquals(3, rotation.rotate(tenant, 'channel-0'))
+        self.assertEquals(
+            ['1525829847.{:06d}'.format(i) for i in range(5)], self.removed)
+        self.assertEquals(5, Pin.query().count())
+        tasks = self.taskqueue_stub.get_filtered_tasks(
+            url='/worker/rotation', queue_names=['pins-rotation'])
+        self.assertEquals(1, len(tasks))
+        self.assertEquals('1', tasks[0].extract_params()['attempt'])
+        self.assertTrue(rotation.acquire_lease('channel-0'))
+
+    def test_reschedule_in_the_same_minute(self):
+        rotation.schedule('channel-0', None, countdown=0)
+        rotation.schedule('channel-0', None, countdown=0, attempt=1)
+        tasks = self.taskqueue_stub.get_filtered_tasks(
+            url='/worker/rotation', queue_names=['pins-rotation'])
+        self.assertEquals(2, len(tasks))
+
+    def test_rotate_needs_the_lease(self):
+        self.fake_slack([], [])
+        rotation.acquire_lease('channel-0')
+        self.assertIsNone(rotation.rotate(self.tenant, 'channel-0'))
+
+
+if __name__ == '__main__':
+    unittest.main()
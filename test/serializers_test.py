@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import json
+import os
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from datastore_test_case import DatastoreTestCase
+from pins4days import serializers
+from pins4days.event import PinnedMessage
+
+
+def path(subpath):
+    return os.path.realpath(os.path.join(
+        os.getcwd(),
+        os.path.dirname(__file__),
+        subpath))
+
+
+class SerializersTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(SerializersTestCase, self).setUp()
+        self.pins = []
+        for name in ['image', 'link', 'message', 'multi']:
+            with open(path('data/pin_added_{}.json'.format(name))) as f:
+                self.pins.append(PinnedMessage.factory(json.load(f)))
+
+    def test_matches_to_dict(self):
+        for pin in self.pins:
+            self.assertDictEqual(pin.to_dict(), serializers.serialize_pin(pin))
+
+    def test_response(self):
+        body = serializers.encode_pins_response(self.pins)
+        expected = {'data': {'pins': [pin.to_dict() for pin in self.pins]}}
+        self.assertEquals(expected, json.loads(body))
+        self.assertNotIn(', ', body[:20])
+
+    def test_cache(self):
+        ndb.put_multi(self.pins)
+        body = serializers.encode_pins_response(self.pins, cache=True)
+        ndb.get_context().flush().get_result()
+        key = serializers.cache_key(
+            self.pins[0].key.id(), serializers.version_of(self.pins[0]))
+        self.assertEquals(serializers.encode_pin(self.pins[0]), memcache.get(key))
+        self.assertEquals(
+            body, serializers.encode_pins_response(self.pins, cache=True))
+
+    def test_put_changes_cache_key(self):
+        self.pins[0].put()
+        serializers.encode_pins_response(self.pins[:1], cache=True)
+        ndb.get_context().flush().get_result()
+        version = serializers.version_of(self.pins[0])
+        self.pins[0].text = u'edited'
+        self.pins[0].put()
+        self.assertGreater(serializers.version_of(self.pins[0]), version)
+        body = serializers.encode_pins_response(self.pins[:1], cache=True)
+        self.assertEquals(u'edited', json.loads(body)['data']['pins'][0]['text'])
+
+    def test_stale_add_is_not_served(self):
+        self.pins[0].put()
+        stale = serializers.encode_pin(self.pins[0])
+        version = serializers.version_of(self.pins[0])
+        self.pins[0].text = u'edited'
+        self.pins[0].put()
+        # A reader of the old version caching its JSON after the write.
+        memcache.add(serializers.cache_key(self.pins[0].key.id(), version), stale)
+        body = serializers.encode_pins_response(self.pins[:1], cache=True)
+        self.assertEquals(u'edited', json.loads(body)['data']['pins'][0]['text'])
+
+    def test_put_changes_response_cache_key(self):
+        key = serializers.response_cache_key('api_pins', None)
+        self.pins[0].put()
+        ndb.get_context().flush().get_result()
+        self.assertNotEqual(key, serializers.response_cache_key('api_pins', None))
+
+    def test_evicted_generation_does_not_restart(self):
+        self.pins[0].put()
+        ndb.get_context().flush().get_result()
+        key = serializers.response_cache_key('api_pins', None)
+        memcache.flush_all()
+        self.assertNotEqual(key, serializers.response_cache_key('api_pins', None))
+        self.assertNotIn(':0:', serializers.response_cache_key('api_pins', None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from google.appengine.ext import ndb
+
+from datastore_test_case import DatastoreTestCase
+from pins4days import sharding
+from pins4days.migration import run_migration
+from pins4days.models.pin import Pin
+
+
+class ShardingTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(ShardingTestCase, self).setUp()
+        Pin.set_shards(4)
+        self.pins = [
+            Pin.create(
+                text=u'pin {}'.format(i),
+                author_id='user-{}'.format(i % 2),
+                pinner_id='user-0',
+                channel_id='channel-{}'.format(i % 3),
+                created_ts=1525829853 + i,
+                attachments=[],
+                ts='1525829847.{:06d}'.format(i))
+            for i in range(20)
+        ]
+        ndb.put_multi(self.pins)
+        self.newest_first = list(reversed(self.pins))
+
+    def tearDown(self):
+        Pin.set_shards(1)
+        super(ShardingTestCase, self).tearDown()
+
+    def ids(self, pins):
+        return [p.key.id() for p in pins]
+
+    def test_shard_key(self):
+        self.assertEquals('03:', sharding.shard_prefix(3))
+        self.assertEquals(
+            ('03:0000000042', '03:0000000050'),
+            sharding.shard_range(3, since=42, before=50))
+        self.assertEquals(('03:', '03;'), sharding.shard_range(3))
+        key = self.pins[0].key.get().shard_key
+        self.assertEquals(
+            sharding.shard_key(self.pins[0].key.id(), 1525829853, 4), key)
+        self.assertNotIn('shard_key', self.pins[0].to_dict())
+
+    def test_resharding_needs_resave(self):
+        Pin.set_shards(8)
+        self.assertTrue(run_migration('resave').done)
+        self.assertEquals(
+            set(sharding.shard_key(p.key.id(), p.created_ts, 8)
+                for p in self.pins),
+            set(p.shard_key for p in Pin.query()))
+        self.assertEquals(
+            self.ids(self.newest_first[:10]), self.ids(Pin.query_all().fetch(10)))
+
+    def test_pins_are_spread(self):
+        shards = set(p.shard_key[:3] for p in Pin.query())
+        self.assertTrue(len(shards) > 1)
+
+    def test_query_all(self):
+        self.assertEquals(
+            self.ids(self.newest_first[:10]), self.ids(Pin.query_all().fetch(10)))
+        self.assertEquals(
+            self.ids(self.newest_first[5:12]),
+            self.ids(Pin.query_all().fetch(7, offset=5)))
+        self.assertEquals(20, Pin.query_all().count())
+
+    def test_query_user(self):
+        expected = [p for p in self.newest_first if p.author_id == 'user-1']
+        self.assertEquals(
+            self.ids(expected[:5]), self.ids(Pin.query_user('user-1').fetch(5)))
+
+    def test_query_created(self):
+        self.assertEquals(
+            self.ids(self.pins[:5]),
+            self.ids(Pin.query_created_before(1525829853 + 5).fetch(10)))
+        self.assertEquals(
+            self.ids(self.pins[15:]),
+            self.ids(list(Pin.query_created_since(1525829853 + 15).iter())))
+
+    def test_unsharded(self):
+        Pin.set_shards(1)
+        self.assertIsInstance(Pin.query_all(), ndb.Query)
+
+    def test_unsharding_keeps_pins_listed(self):
+        Pin.set_shards(1)
+        self.assertEquals(
+            self.ids(self.newest_first[:10]), self.ids(Pin.query_all().fetch(10)))
+        self.assertTrue(run_migration('resave').done)
+        self.assertEquals(
+            self.ids(self.newest_first[:10]), self.ids(Pin.query_all().fetch(10)))
+        self.assertEquals(0, Pin.query(Pin.shard_key > '').count())
+
+
+if __name__ == '__main__':
+    unittest.main()
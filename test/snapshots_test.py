@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import calendar
+import json
+import os
+import shutil
+import tempfile
+
+from flask import Flask
+from google.appengine.api import namespace_manager
+from google.appengine.api import taskqueue
+
+from datastore_test_case import DatastoreTestCase
+from pins4days import archive
+from pins4days import compression
+from pins4days import snapshots
+from pins4days.blobs import LocalBlobStore
+from pins4days.ingest import store_async
+from pins4days.models.pin import Pin
+from pins4days.models.snapshot import SnapshotPage
+from pins4days.tenants import get_tenant
+
+
+APRIL = calendar.timegm((2018, 4, 10, 0, 0, 0))
+MAY = calendar.timegm((2018, 5, 10, 0, 0, 0))
+
+
+def path(subpath):
+    return os.path.realpath(os.path.join(
+        os.getcwd(),
+        os.path.dirname(__file__),
+        subpath))
+
+
+class SnapshotsTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(SnapshotsTestCase, self).setUp()
+        self.testbed.init_taskqueue_stub(root_path=path('..'))
+        self.taskqueue_stub = self.testbed.get_stub('taskqueue')
+        self.root = tempfile.mkdtemp()
+        self.store = LocalBlobStore(self.root)
+        self.app = Flask(__name__)
+        self.app.config.update({'snapshots': True, 'blob_local_dir': self.root})
+        snapshots.init_app(self.app)
+        self.pins = [
+            Pin.create(
+                text=u'pin {} <b>'.format(i),
+                author_id='user-{}'.format(i % 2),
+                pinner_id='user-0',
+                channel_id='channel-{}'.format(i % 2),
+                created_ts=(APRIL if i < 4 else MAY) + i,
+                attachments=[],
+                ts='1525829847.{:06d}'.format(i))
+            for i in range(10)
+        ]
+        store_async(self.pins).get_result()
+
+    def tearDown(self):
+        snapshots._state.clear()
+        shutil.rmtree(self.root)
+        super(SnapshotsTestCase, self).tearDown()
+
+    def read(self, snapshot_path):
+        data = self.store.read(snapshots.blob_name(snapshot_path))
+        return compression.decompress(data)
+
+    def version(self, channel_id, label):
+        return SnapshotPage.get_by_id(
+            SnapshotPage.build_key_id(channel_id, label)).version
+
+    def read_page(self, channel_id, label, extension):
+        return self.read(snapshots.page_path(
+            channel_id, label, extension, self.version(channel_id, label)))
+
+    def render_tasks(self):
+        return self.taskqueue_stub.get_filtered_tasks(
+            url='/worker/snapshots/render', queue_names=['snapshots'])
+
+    def test_disabled(self):
+        self.assertFalse(snapshots.is_enabled(get_tenant({}, None)))
+        self.assertFalse(snapshots.is_enabled(
+            get_tenant({'snapshots': True, 'channel_access': True}, None)))
+        self.assertTrue(snapshots.is_enabled(get_tenant(self.app.config, None)))
+
+    def test_storing_schedules_renders(self):
+        # The feed, both months, and both channels in both months.
+        self.assertEquals(7, len(self.render_tasks()))
+        store_async(self.pins[:1]).get_result()
+        self.assertEquals(7, len(self.render_tasks()))
+
+    def test_render_month(self):
+        self.assertEquals(4, snapshots.render_page(
+            self.app.config, None, '2018-04'))
+        self.assertRegexpMatches(self.version(None, '2018-04'), r'^[0-9a-f]{12}$')
+        body = json.loads(self.read_page(None, '2018-04', 'json'))
+        self.assertEquals(
+            [p.text for p in reversed(self.pins[:4])],
+            [p['text'] for p in body['data']['pins']])
+
+        html = self.read_page(None, '2018-04', 'html').decode('utf-8')
+        self.assertIn(u'pin 3 &lt;b&gt;', html)
+        # Other past months are linked through the index.
+        self.assertIn('href="../index.html#2018-05"', html)
+        self.assertIn('href="../index.html#2018-04"', html)
+        self.assertIn('href="../index.html"', html)
+
+    def test_render_current_month(self):
+        now = MAY + 60
+        self.assertEquals(3, snapshots.render_page(
+            self.app.config, 'channel-0', '2018-05', now))
+        self.assertIsNone(SnapshotPage.get_by_id(
+            SnapshotPage.build_key_id('channel-0', '2018-05')))
+        body = json.loads(self.read('channels/channel-0/2018-05.json'))
+        self.assertEquals(
+            ['channel-0'] * 3, [p['channel_id'] for p in body['data']['pins']])
+        html = self.read('channels/channel-0/2018-05.html')
+        self.assertIn('href="../../index.html#2018-04"', html)
+        self.assertIn('href="../../channels/channel-0/2018-05.html"', html)
+        self.assertNotIn('latest.html', html)
+
+    def test_render_feed_and_index(self):
+        snapshots.render_page(self.app.config, None, '2018-05')
+        version = self.version(None, '2018-05')
+        self.assertEquals(10, snapshots.render_page(
+            self.app.config, None, snapshots.FEED))
+        feed = self.read('all/latest.html')
+        self.assertIn('href="../all/2018-05.{}.html"'.format(version), feed)
+        # Not rendered since it became a past month.
+        self.assertIn('href="../channels/channel-1/2018-04.html"', feed)
+
+        self.assertEquals(2, snapshots.render_index(self.app.config))
+        months = json.loads(self.read('index.json'))['data']['months']
+        self.assertEquals(['2018-05', '2018-04'], [m['label'] for m in months])
+        self.assertEquals(6, months[0]['count'])
+        self.assertEquals(
+            'all/2018-05.{}.html'.format(version), months[0]['path'])
+        html = self.read('index.html')
+        self.assertIn('id="2018-04"', html)
+        self.assertIn('href="all/2018-05.{}.html"'.format(version), html)
+        self.assertIn('href="channels/channel-1/2018-04.html"', html)
+
+    def test_versions_change_with_contents(self):
+        self.taskqueue_stub.FlushQueue('snapshots')
+        snapshots.render_page(self.app.config, None, '2018-04')
+        version = self.version(None, '2018-04')
+        self.assertEquals(1, len(self.render_tasks()))
+        # Nothing changed: nothing is written, nor scheduled.
+        snapshots.render_page(self.app.config, None, '2018-04')
+        self.assertEquals(version, self.version(None, '2018-04'))
+        self.assertEquals(1, len(self.render_tasks()))
+
+        self.pins[0].text = u'edited'
+        self.pins[0].put()
+        self.taskqueue_stub.FlushQueue('snapshots')
+        snapshots.render_page(self.app.config, None, '2018-04')
+        self.assertNotEqual(version, self.version(None, '2018-04'))
+        self.assertIn('edited', self.read_page(None, '2018-04', 'html'))
+        # The old version is still there, for whoever links to it.
+        self.assertNotIn('edited', self.read(
+            snapshots.page_path(None, '2018-04', 'html', version)))
+        self.assertEquals(
+            [snapshots.FEED],
+            [t.extract_params()['label'] for t in self.render_tasks()])
+
+    def test_render_includes_archived_pins(self):
+        archive.archive_batch(self.store, MAY)
+        self.app.config['archive_after_days'] = 30
+        self.assertEquals(0, Pin.query_created_between(APRIL, MAY).count())
+        self.assertEquals(4, snapshots.render_page(
+            self.app.config, None, '2018-04'))
+
+    def test_renders_are_enqueued_in_one_batch(self):
+        self.taskqueue_stub.FlushQueue('snapshots')
+        calls = []
+        add = taskqueue.Queue.add
+
+        def counting_add(queue, tasks, *args, **kwargs):
+            calls.append(len(tasks))
+            return add(queue, tasks, *args, **kwargs)
+
+        taskqueue.Queue.add = counting_add
+        try:
+            snapshots.schedule(self.pins)
+            # Already enqueued for this window; not an error.
+            snapshots.schedule(self.pins)
+        finally:
+            taskqueue.Queue.add = add
+        self.assertEquals([7, 7], calls)
+        self.assertEquals(7, len(self.render_tasks()))
+
+    def test_rebuild(self):
+        self.taskqueue_stub.FlushQueue('snapshots')
+        self.assertEquals(7, snapshots.rebuild())
+        self.assertEquals(7, len(self.render_tasks()))
+
+    def test_cache_ttl(self):
+        self.assertEquals(
+            snapshots.HISTORICAL_TTL,
+            snapshots.cache_ttl(self.app.config, snapshots.page_path(
+                'channel-0', '2018-04', 'json', '0123456789ab')))
+        for path in ('all/2018-05.html', 'all/latest.json', 'index.html'):
+            self.assertEquals(
+                snapshots.RECENT_TTL,
+                snapshots.cache_ttl(self.app.config, path))
+        self.app.config['snapshot_ttl'] = 60
+        self.assertEquals(60, snapshots.cache_ttl(
+            self.app.config, 'all/2018-04.0123456789ab.html'))
+
+    def test_read(self):
+        snapshots.render_index(self.app.config)
+        data, content_type, ttl = snapshots.read(
+            self.app.config, snapshots.blob_name('index.html'))
+        self.assertEquals('text/html', content_type)
+        self.assertEquals(snapshots.RECENT_TTL, ttl)
+        snapshots.render_page(self.app.config, None, '2018-04')
+        data, content_type, ttl = snapshots.read(
+            self.app.config, snapshots.blob_name(snapshots.page_path(
+                None, '2018-04', 'json', self.version(None, '2018-04'))))
+        self.assertEquals('application/json', content_type)
+        self.assertEquals(snapshots.HISTORICAL_TTL, ttl)
+        self.assertIsNone(snapshots.read(
+            self.app.config, 'snapshots/_/../../etc/passwd.html'))
+        self.assertIsNone(snapshots.read(self.app.config, 'archive/_/x.json'))
+        self.assertIsNone(snapshots.read(
+            self.app.config, snapshots.blob_name('all/1999-01.html')))
+        self.assertRegexpMatches(
+            snapshots.snapshot_url(self.app.config),
+            r'^/snapshots/[0-9a-f]{32}/index\.html$')
+
+    def test_blob_names_are_unguessable(self):
+        name = snapshots.blob_name('index.html')
+        self.assertEquals(name, snapshots.blob_name('index.html'))
+        self.assertNotIn('/_/', name)
+        other = snapshots.blob_name('index.html', 'team-T1')
+        self.assertNotEqual(name, other)
+        namespace_manager.set_namespace('team-T1')
+        try:
+            self.assertEquals(other, snapshots.blob_name('index.html'))
+        finally:
+            namespace_manager.set_namespace('')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from flask import Flask
+
+from pins4days import storage
+from pins4days.appuser import AppUser
+from pins4days.models.exceptions import EntityDoesNotExistException
+from pins4days.models.exceptions import IncorrectPasswordException
+from pins4days.storage.sqlite_repository import SqliteRepository
+
+
+class SqliteRepositoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.repository = SqliteRepository()
+
+    def tearDown(self):
+        storage.set_repository(None)
+        self.repository.database.close()
+
+    def test_users(self):
+        users = self.repository.users
+        self.assertTrue(users.create_with_encryption('bobross', 'trees'))
+        self.assertFalse(users.create_with_encryption('bobross', 'other'))
+        self.assertIsNone(users.login('bobross', 'trees').team_id)
+        user = users.link_slack_identity('bobross', 'T1', 'U1')
+        self.assertEquals(('T1', 'U1'), (user.team_id, user.slack_user_id))
+        self.assertTrue(users.login('bobross', 'trees').slack_verified)
+        self.assertIsNone(users.link_slack_identity('nobody', 'T1', 'U1'))
+        with self.assertRaises(IncorrectPasswordException):
+            users.login('bobross', 'other')
+        with self.assertRaises(EntityDoesNotExistException):
+            users.login('nobody', 'trees')
+
+    def test_app_user(self):
+        storage.set_repository(self.repository)
+        self.repository.users.create_with_encryption('bobross', 'trees')
+        self.assertEquals('bobross', AppUser('bobross').user_model.username)
+        self.assertIsNone(AppUser('nobody').user_model)
+
+    def test_init_app(self):
+        app = Flask(__name__)
+        app.config['user_storage'] = 'sqlite'
+        storage.init_app(app)
+        self.assertIsInstance(storage.get_repository(), SqliteRepository)
+        storage.get_repository().database.close()
+        app.config['user_storage'] = 'mysql'
+        self.assertRaises(ValueError, storage.init_app, app)
+
+
+if __name__ == '__main__':
+    unittest.main()
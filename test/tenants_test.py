@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import json
+import os
+
+from google.appengine.api import namespace_manager
+
+from datastore_test_case import DatastoreTestCase
+from pins4days.constants import INGEST_MODE_PULL
+from pins4days.ingest import enqueue_pins_async
+from pins4days.ingest import lease_and_store
+from pins4days.models.pin import Pin
+from pins4days.tenants import get_tenant
+from pins4days.tenants import list_namespaces
+from pins4days.tenants import namespace_for
+from pins4days.tenants import UnknownTenantException
+
+
+def path(subpath):
+    return os.path.realpath(os.path.join(
+        os.getcwd(),
+        os.path.dirname(__file__),
+        subpath))
+
+
+APP_CONFIG = {
+    'slack_verification_token': 'token-0',
+    'slack_user_token': 'user-token-0',
+    'teams': {
+        'team-id-0': {'slack_verification_token': 'token-team-0'},
+        'team-id-1': {'max_pins_per_minute': 2},
+    }
+}
+
+
+class TenantTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(TenantTestCase, self).setUp()
+        self.testbed.init_taskqueue_stub(root_path=path('..'))
+
+    def tearDown(self):
+        namespace_manager.set_namespace('')
+        super(TenantTestCase, self).tearDown()
+
+    def test_single_tenant(self):
+        tenant = get_tenant({'slack_user_token': 'user-token-0'}, 'anything')
+        self.assertIsNone(tenant.team_id)
+        self.assertEquals('', tenant.namespace)
+        self.assertEquals('user-token-0', tenant.setting('slack_user_token'))
+
+    def test_multi_tenant(self):
+        tenant = get_tenant(APP_CONFIG, 'team-id-0')
+        self.assertEquals('team-team-id-0', tenant.namespace)
+        self.assertEquals('token-team-0', tenant.setting('slack_verification_token'))
+        self.assertEquals('user-token-0', tenant.setting('slack_user_token'))
+        with self.assertRaises(UnknownTenantException):
+            get_tenant(APP_CONFIG, 'team-id-2')
+
+    def test_namespace_for(self):
+        self.assertEquals('', namespace_for(None))
+        self.assertEquals('team-T0_12', namespace_for('T0/12'))
+
+    def test_enqueue_delay(self):
+        tenant = get_tenant(APP_CONFIG, 'team-id-1')
+        self.assertEquals(0, tenant.enqueue_delay(2))
+        self.assertEquals(60, tenant.enqueue_delay(1))
+        self.assertEquals(0, get_tenant(APP_CONFIG, 'team-id-0').enqueue_delay(1))
+
+    def test_pull_ingest_keeps_namespace(self):
+        with open(path('data/pin_added_message.json')) as f:
+            event = json.load(f)
+        get_tenant(APP_CONFIG, 'team-id-0').activate()
+        for future in enqueue_pins_async([event], INGEST_MODE_PULL):
+            future.get_result()
+        namespace_manager.set_namespace('')
+
+        lease_and_store()
+        self.assertEquals(0, Pin.query().count())
+        self.assertEquals(1, Pin.query(namespace='team-team-id-0').count())
+
+    def test_list_namespaces(self):
+        self.assertEquals([''], list_namespaces({}))
+        self.assertEquals(
+            ['team-team-id-0', 'team-team-id-1'], list_namespaces(APP_CONFIG))
+
+
+if __name__ == '__main__':
+    unittest.main()
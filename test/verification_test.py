@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pins4days.verification import verify_signature
+from pins4days.verification import verify_token
+
+
+# The example request from
+# https://api.slack.com/authentication/verifying-requests-from-slack
+SECRET = '8f742231b10e8888abcd99yyyzzz85a5'
+TIMESTAMP = '1531420618'
+BODY = (
+    'token=xyzz0WbapA4vBCDEFasx0q6G&team_id=T1DC2JH3J&team_domain=testteamnow'
+    '&channel_id=G8PSS9T3V&channel_name=foobar&user_id=U2CERLKJA'
+    '&user_name=roadrunner&command=%2Fwebhook-collect&text='
+    '&response_url=https%3A%2F%2Fhooks.slack.com%2Fcommands%2FT1DC2JH3J'
+    '%2F397700885554%2F96rGlfmibIGlgcZRskXaIFfN'
+    '&trigger_id=398738663015.47445629121.803a0bc887a14d10d2c447fce8b6703c')
+SIGNATURE = 'v0=a2114d57b48eac39b9ad189dd8316235a7b4a8d21a10bd27519666489c69b503'
+
+
+class VerifySignatureTestCase(unittest.TestCase):
+
+    def verify(self, secret=SECRET, timestamp=TIMESTAMP, body=BODY,
+               signature=SIGNATURE, now=int(TIMESTAMP) + 10):
+        return verify_signature(secret, timestamp, body, signature, now=now)
+
+    def test_valid(self):
+        self.assertTrue(self.verify())
+        self.assertTrue(self.verify(secret=unicode(SECRET)))
+
+    def test_tampered_body(self):
+        self.assertFalse(self.verify(body=BODY + '&x=1'))
+
+    def test_wrong_secret(self):
+        self.assertFalse(self.verify(secret='not-the-secret'))
+
+    def test_replayed(self):
+        self.assertFalse(self.verify(now=int(TIMESTAMP) + 301))
+        self.assertFalse(self.verify(now=int(TIMESTAMP) - 301))
+
+    def test_missing_or_malformed_headers(self):
+        self.assertFalse(self.verify(timestamp=None))
+        self.assertFalse(self.verify(timestamp='yesterday'))
+        self.assertFalse(self.verify(signature=None))
+        self.assertFalse(self.verify(signature='v0=abc'))
+
+
+class VerifyTokenTestCase(unittest.TestCase):
+
+    def test_verify_token(self):
+        self.assertTrue(verify_token('6da89cd09ab7937478a1d47d', u'6da89cd09ab7937478a1d47d'))
+        self.assertFalse(verify_token('6da89cd09ab7937478a1d47d', 'token-0'))
+        self.assertFalse(verify_token('6da89cd09ab7937478a1d47d', None))
+
+    def test_verify_token_not_configured(self):
+        self.assertFalse(verify_token(None, 'token-0'))
+        self.assertFalse(verify_token('', ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,15 +5,54 @@ import json
 
 from flask import Flask
 from flask import request
+from flask import jsonify
 from flask import make_response
+from google.appengine.api import namespace_manager
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
 
+from pins4days import access
+from pins4days import archive
+from pins4days import digests
+from pins4days import links
+from pins4days import metrics
+from pins4days import rotation
+from pins4days import snapshots
+from pins4days.blobs import get_blob_store
+from pins4days.constants import KEY_FLASK_APP_CONFIG
+from pins4days.constants import QUEUE_MIGRATIONS
 from pins4days.event import PinnedMessage
+from pins4days.ingest import drain
+from pins4days.ingest import store_async
+from pins4days.migration import DEFAULT_BATCH_SIZE
+from pins4days.migration import run_migration
+from pins4days.migration import start_in_namespaces
+from pins4days.models.migration import MigrationState
+from pins4days.models.pin import Pin
+from pins4days.tenants import get_tenant
+from pins4days.tenants import list_namespaces
+from pins4days.tenants import NAMESPACE_HEADER
+from pins4days.tenants import UnknownTenantException
+from pins4days.utils import load_config
 
 
 app = Flask(__name__)
+app.config.update(load_config()[KEY_FLASK_APP_CONFIG])
+metrics.init_app(app, url='/worker/debug/metrics')
+Pin.set_shards(app.config.get('pin_shards', 1))
+snapshots.init_app(app)
+
+
+@app.before_request
+def restore_namespace():
+    """Runs every task in the namespace (i.e. the workspace) it was
+    enqueued in. See pins4days.tenants.
+    """
+    namespace_manager.set_namespace(request.headers.get(NAMESPACE_HEADER, ''))
 
 
 @app.route('/worker/create_pin', methods=['POST'])
+@ndb.toplevel
 def create_pin():
     """Creates a pin.
 
@@ -22,5 +61,243 @@ def create_pin():
     """
     pin_data = json.loads(request.data)
     pin = PinnedMessage.factory(pin_data)
-    pin.put()
+    store_async([pin])
     return make_response('', 201)
+
+
+@app.route('/worker/ingest/drain', methods=['POST', 'GET'])
+def ingest_drain():
+    """Stores the pins buffered in the ingest pull queue, in batches.
+
+    Called by the drain tasks that pins4days.ingest enqueues, and by cron as a
+    safety net.
+
+    Returns:
+        Response:
+    """
+    leased, written = drain()
+    return jsonify(leased=leased, written=written)
+
+
+def enqueue_per_namespace(url):
+    """Enqueues a POST task in the namespace of every workspace the
+    deployment serves. See tenants.list_namespaces().
+
+    Args:
+        url (str): The task's URL.
+
+    Returns:
+        int: Number of tasks enqueued.
+    """
+    namespaces = list_namespaces(app.config)
+    try:
+        for namespace in namespaces:
+            namespace_manager.set_namespace(namespace)
+            taskqueue.add(
+                queue_name=QUEUE_MIGRATIONS,
+                url=url,
+                target='worker',
+                method='POST')
+    finally:
+        namespace_manager.set_namespace('')
+    return len(namespaces)
+
+
+@app.route('/worker/archive', methods=['POST', 'GET'])
+def archive_pins():
+    """Moves old pins to archive blobs. See pins4days.archive.
+
+    A GET (from cron) enqueues an archive task for every namespace, i.e. for
+    every workspace. A POST archives the pins of the task's namespace.
+
+    Returns:
+        Response:
+    """
+    archive_after_days = app.config.get('archive_after_days')
+    if not archive_after_days:
+        return jsonify(message='Archiving is disabled.')
+
+    if request.method == 'GET':
+        return jsonify(namespaces=enqueue_per_namespace('/worker/archive'))
+
+    archived = archive.run_archive(
+        get_blob_store(app.config), int(archive_after_days))
+    return jsonify(archived=archived)
+
+
+@app.route('/worker/digests/reconcile', methods=['POST', 'GET'])
+def reconcile_digests():
+    """Rebuilds the recent digests from the stored pins. See
+    pins4days.digests.
+
+    A GET (from cron) enqueues a task for every namespace. A POST rebuilds
+    the digests of the task's namespace.
+
+    Returns:
+        Response:
+    """
+    if request.method == 'GET':
+        return jsonify(
+            namespaces=enqueue_per_namespace('/worker/digests/reconcile'))
+    return jsonify(written=digests.reconcile(app.config))
+
+
+@app.route('/worker/links/<link_id>/refresh', methods=['POST'])
+def refresh_link(link_id):
+    """Fetches a link again and updates its shared preview. See
+    pins4days.links.
+
+    Args:
+        link_id (str): The Link's key id.
+
+    Returns:
+        Response:
+    """
+    link = links.refresh(link_id)
+    if link is None:
+        return make_response(jsonify(message='Link does not exist.'), 404)
+    return jsonify(url=link.url, has_preview=link.has_preview)
+
+
+@app.route('/worker/access/refresh', methods=['POST', 'GET'])
+def refresh_access():
+    """Lists users' channels from Slack. See pins4days.access.
+
+    A GET (from cron) enqueues a refresh for every user whose workspace has
+    channel access control on. A POST refreshes the user in the task's
+    'slack_user_id' param.
+
+    Returns:
+        Response:
+    """
+    if request.method == 'GET':
+        return jsonify(enqueued=access.enqueue_all(app.config))
+
+    try:
+        tenant = get_tenant(app.config, request.form.get('team_id') or None)
+    except UnknownTenantException:
+        logging.warning('Dropping channel refresh for unknown team.')
+        return jsonify(message='Unrecognized team.')
+    if not access.is_enabled(tenant):
+        return jsonify(message='Channel access control is disabled.')
+
+    channel_ids = access.refresh(tenant, request.form['slack_user_id'])
+    return jsonify(channels=len(channel_ids))
+
+
+@app.route('/worker/snapshots', methods=['POST', 'GET'])
+def rebuild_snapshots():
+    """Renders every static snapshot again. See pins4days.snapshots.
+
+    A GET (from cron) enqueues a task for every namespace. A POST enqueues a
+    render of every page of the task's namespace.
+
+    Returns:
+        Response:
+    """
+    if request.method == 'GET':
+        return jsonify(namespaces=enqueue_per_namespace('/worker/snapshots'))
+
+    tenant = snapshots.current_tenant(app.config)
+    if tenant is None or not snapshots.is_enabled(tenant):
+        return jsonify(message='Snapshots are disabled.')
+    return jsonify(enqueued=snapshots.rebuild())
+
+
+@app.route('/worker/snapshots/render', methods=['POST'])
+def render_snapshot():
+    """Renders a page, or the feed and the index, to static snapshots. See
+    pins4days.snapshots.
+
+    Returns:
+        Response:
+    """
+    tenant = snapshots.current_tenant(app.config)
+    if tenant is None or not snapshots.is_enabled(tenant):
+        return jsonify(message='Snapshots are disabled.')
+
+    label = request.form['label']
+    pins = snapshots.render_page(
+        app.config, request.form.get('channel_id') or None, label)
+    if label == snapshots.FEED:
+        snapshots.render_index(app.config)
+    return jsonify(pins=pins)
+
+
+@app.route('/worker/rotation', methods=['POST'])
+def rotate_channel():
+    """Unpins the oldest pins of a channel that is close to Slack's pin cap.
+    See pins4days.rotation.
+
+    Returns:
+        Response:
+    """
+    try:
+        tenant = get_tenant(app.config, request.form.get('team_id') or None)
+    except UnknownTenantException:
+        logging.warning('Dropping rotation for unknown team.')
+        return jsonify(message='Unrecognized team.')
+    if not rotation.is_enabled(tenant):
+        return jsonify(message='Rotation is disabled.')
+
+    unpinned = rotation.rotate(
+        tenant, request.form['channel_id'],
+        int(request.form.get('attempt', 0)))
+    return jsonify(unpinned=unpinned)
+
+
+@app.route('/worker/migrations/<name>', methods=['POST', 'GET'])
+def migration(name):
+    """Runs the next slice of a migration, or reports its progress.
+
+    A POST processes batches of the task's namespace until the task's time
+    budget runs out, and is what the migration's own tasks call. A GET
+    returns the checkpoint of every workspace's namespace.
+
+    Args:
+        name (str): The registered migration name.
+
+    Returns:
+        Response:
+    """
+    if request.method == 'GET':
+        states = {}
+        for namespace in list_namespaces(app.config):
+            state = MigrationState.get_by_id(name, namespace=namespace)
+            if state is not None:
+                states[namespace] = state.to_status()
+        if not states:
+            return make_response(
+                jsonify(message='Migration has not been started.'), 404)
+        return jsonify(namespaces=states)
+
+    batch_size = int(request.form.get('batch_size', DEFAULT_BATCH_SIZE))
+    try:
+        state = run_migration(name, batch_size=batch_size)
+    except KeyError:
+        return make_response(
+            jsonify(message='Unknown migration.'), 404)
+    return jsonify(state.to_status())
+
+
+@app.route('/worker/migrations/<name>/start', methods=['POST'])
+def migration_start(name):
+    """(Re)starts a migration from the beginning of the Pin kind, in every
+    workspace's namespace.
+
+    Args:
+        name (str): The registered migration name.
+
+    Returns:
+        Response:
+    """
+    batch_size = int(request.form.get('batch_size', DEFAULT_BATCH_SIZE))
+    try:
+        states = start_in_namespaces(
+            name, list_namespaces(app.config), batch_size=batch_size)
+    except KeyError:
+        return make_response(
+            jsonify(message='Unknown migration.'), 404)
+    return make_response(jsonify(namespaces={
+        namespace: state.to_status()
+        for namespace, state in states.items()}), 202)